@@ -7,12 +7,10 @@ import pandas as pd
 import re
 from datetime import datetime
 import numpy as np
-import statsmodels.api as sm
 
-try:
-    import google.generativeai as genai
-except ImportError:
-    genai = None
+from lazy_modules import lazy_module
+
+genai = lazy_module("google.generativeai", optional=True)  # import จริงตอนเรียก API ครั้งแรก
 
 # ==============================================================================
 # AI FUNCTION 2: CASE CONSULTATION
@@ -3,8 +3,12 @@ import re
 from pathlib import Path
 
 import streamlit as st
-from transformers import pipeline, AutoTokenizer, AutoModelForTokenClassification
-from huggingface_hub import snapshot_download
+
+from lazy_modules import lazy_module
+
+# transformers / huggingface_hub ใช้เวลา import หลายวินาที -> โหลดตอน load_ner_model() ครั้งแรกเท่านั้น
+transformers = lazy_module("transformers")
+huggingface_hub = lazy_module("huggingface_hub")
 
 # ====== ค่าตัวแทนเมื่อปกปิดข้อมูล ======
 ENTITY_TO_ANONYMIZED_TOKEN_MAP = {
@@ -30,17 +34,17 @@ def load_ner_model():
             local_dir = Path("model")
             if not local_dir.exists() or not any(local_dir.iterdir()):
                 st.write("🔽 กำลังดาวน์โหลดโมเดลจาก Hugging Face...")
-                snapshot_download(
+                huggingface_hub.snapshot_download(
                     repo_id="pythainlp/thainer-corpus-v2-base-model",
                     local_dir=local_dir,
                     local_dir_use_symlinks=False,
                 )
 
             st.write("⚙️ กำลังโหลดโมเดลเข้าหน่วยความจำ...")
-            tokenizer = AutoTokenizer.from_pretrained(str(local_dir))
-            model = AutoModelForTokenClassification.from_pretrained(str(local_dir))
+            tokenizer = transformers.AutoTokenizer.from_pretrained(str(local_dir))
+            model = transformers.AutoModelForTokenClassification.from_pretrained(str(local_dir))
 
-            ner_pipeline = pipeline(
+            ner_pipeline = transformers.pipeline(
                 "token-classification",
                 model=model,
                 tokenizer=tokenizer,
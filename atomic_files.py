@@ -0,0 +1,79 @@
+# atomic_files.py
+# -*- coding: utf-8 -*-
+# เขียนไฟล์/โฟลเดอร์แบบสลับทีเดียว และลบไฟล์เก่าในโฟลเดอร์แคช (ไม่ใช้ Streamlit)
+#
+#   write_atomic(path, lambda tmp: df.to_parquet(tmp))                  # ไฟล์
+#   write_atomic(root, lambda tmp: ds.write_dataset(..., tmp), directory=True)   # ทั้งโฟลเดอร์
+#   prune_files(out_dir, "export-*", max_age_seconds=3600)
+#
+# ของชั่วคราวชื่อไม่ซ้ำ (tempfile) อยู่ในโฟลเดอร์เดียวกับปลายทาง ขึ้นต้นด้วย ".tmp-"
+# -> หลาย process/thread เขียนปลายทางเดียวกันพร้อมกันไม่ชนกัน (ตัวที่สลับทีหลังชนะ) ผู้อ่านไม่เห็นผลที่เขียนไม่เสร็จ
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+TMP_PREFIX = ".tmp-"
+
+# สิทธิ์ตาม umask ของ process (mkstemp/mkdtemp สร้างแบบ 0600/0700 — process อื่นต่างผู้ใช้จะอ่านไม่ได้)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _swap_dir(tmp: Path, path: Path):
+    """โฟลเดอร์ที่มีของอยู่แล้วแทนที่ด้วย os.replace ตรงๆ ไม่ได้: ย้ายของเดิมออก สลับของใหม่เข้า แล้วจึงลบของเดิม"""
+    old = None
+    if path.exists():
+        old = Path(tempfile.mkdtemp(prefix=TMP_PREFIX, dir=path.parent))
+        os.replace(path, old / path.name)
+    try:
+        os.replace(tmp, path)
+    except BaseException:
+        if old is not None:
+            os.replace(old / path.name, path)  # คืนของเดิม
+        raise
+    finally:
+        if old is not None:
+            shutil.rmtree(old, ignore_errors=True)
+
+
+def write_atomic(path, write, directory: bool = False) -> Path:
+    """
+    write(tmp) เขียนลงไฟล์ (หรือโฟลเดอร์ว่าง ถ้า directory=True) ชั่วคราวข้าง path แล้วสลับเข้าที่ path
+    write โยน exception -> ลบของชั่วคราว ปลายทางเดิมไม่เปลี่ยน แล้วโยนต่อ
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if directory:
+        tmp = Path(tempfile.mkdtemp(prefix=TMP_PREFIX, dir=path.parent))
+        os.chmod(tmp, 0o777 & ~_UMASK)
+    else:
+        fd, name = tempfile.mkstemp(prefix=TMP_PREFIX, suffix=path.suffix, dir=path.parent)
+        os.close(fd)
+        tmp = Path(name)
+        os.chmod(tmp, 0o666 & ~_UMASK)
+    try:
+        write(tmp)
+        if directory:
+            _swap_dir(tmp, path)
+        else:
+            os.replace(tmp, path)
+    except BaseException:
+        if directory:
+            shutil.rmtree(tmp, ignore_errors=True)
+        else:
+            tmp.unlink(missing_ok=True)
+        raise
+    return path
+
+
+def prune_files(out_dir, pattern: str, max_age_seconds: float):
+    """ลบไฟล์ใน out_dir ที่ตรง pattern และแก้ไขล่าสุดเก่ากว่า max_age_seconds (ไฟล์ที่ถูกใช้อยู่ให้ os.utime ไว้)"""
+    cutoff = time.time() - max_age_seconds
+    for path in Path(out_dir).glob(pattern):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except OSError:
+            pass
@@ -0,0 +1,95 @@
+# benchmarks/bench_arrow_mmap.py
+# -*- coding: utf-8 -*-
+"""
+หลาย worker process โหลดข้อมูลชุดเดียวกัน: อ่าน Parquet (แต่ละ process มีสำเนาของตัวเอง) เทียบกับ memory-map Arrow snapshot
+
+    python benchmarks/bench_arrow_mmap.py --rows 500000 --workers 1 2 4
+
+วัดเวลาโหลดต่อ worker และหน่วยความจำรวม: RSS (นับหน้าที่ใช้ร่วมซ้ำทุก process) และ PSS (หารหน้าที่ใช้ร่วมตามจำนวน process)
+ข้อมูลคือ jib.xlsx ที่ประมวลผลแล้วทำซ้ำจนได้จำนวนแถวที่กำหนด
+"""
+import argparse
+import multiprocessing as mp
+import os
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+from incident_store import to_arrow_safe, write_arrow_snapshot, map_arrow_snapshot  # noqa: E402
+
+
+def _memory_kb() -> dict:
+    """Rss / Pss ของ process นี้ (kB) จาก /proc/self/smaps_rollup (Linux)"""
+    out = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("Rss", "Pss"):
+                out[key] = int(rest.split()[0])
+    return out
+
+
+def _worker(mode, path, barrier, results):
+    t0 = time.perf_counter()
+    df = map_arrow_snapshot(path) if mode == "arrow-mmap" else pd.read_parquet(path)
+    for col in df.columns:  # อ่านทุกคอลัมน์ (ข้อความอ่านถึงตัวอักษร) ให้หน้าหน่วยความจำถูกโหลดจริง
+        s = df[col]
+        s.str.startswith("x").sum() if pd.api.types.is_string_dtype(s) and not isinstance(s.dtype, pd.CategoricalDtype) \
+            else s.isna().sum()
+    seconds = time.perf_counter() - t0
+    barrier.wait()  # วัดหน่วยความจำตอนทุก worker ถือข้อมูลพร้อมกัน
+    results.put({"seconds": seconds, **_memory_kb()})
+    barrier.wait()
+
+
+def run(mode, path, n_workers) -> dict:
+    ctx = mp.get_context("spawn")
+    barrier, results = ctx.Barrier(n_workers), ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(mode, str(path), barrier, results)) for _ in range(n_workers)]
+    for p in procs: p.start()
+    rows = [results.get() for _ in procs]
+    for p in procs: p.join()
+    return {"load_s": statistics.median(r["seconds"] for r in rows),
+            "rss_mb": sum(r["Rss"] for r in rows) / 1024, "pss_mb": sum(r["Pss"] for r in rows) / 1024}
+
+
+def make_data(rows: int) -> pd.DataFrame:
+    from incident_pipeline import process_incident_frame
+    from reference_data import load_reference_data
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        ref = load_reference_data(ROOT)
+        base = process_incident_frame(pd.read_excel(ROOT / "jib.xlsx"), ref.psg9_master)
+    reps = -(-rows // len(base))
+    return pd.concat([base] * reps, ignore_index=True).iloc[:rows]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--rows", type=int, default=500_000)
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = ap.parse_args(argv)
+
+    df = make_data(args.rows)
+    with tempfile.TemporaryDirectory() as tmp:
+        parquet, arrow = Path(tmp) / "data.parquet", Path(tmp) / "data.arrow"
+        to_arrow_safe(df).to_parquet(parquet, index=False)
+        write_arrow_snapshot(df, arrow)
+        print(f"{len(df):,} rows | parquet {parquet.stat().st_size / 2**20:.0f} MB | arrow {arrow.stat().st_size / 2**20:.0f} MB"
+              f" | cpu {os.cpu_count()}")
+        print(f"{'mode':<12} {'workers':>7} {'load (s)':>9} {'RSS รวม (MB)':>13} {'PSS รวม (MB)':>13}")
+        for mode, path in (("parquet", parquet), ("arrow-mmap", arrow)):
+            for n in args.workers:
+                r = run(mode, path, n)
+                print(f"{mode:<12} {n:>7} {r['load_s']:>9.2f} {r['rss_mb']:>13.0f} {r['pss_mb']:>13.0f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+# benchmarks/bench_early_warning.py
+# -*- coding: utf-8 -*-
+"""
+เวลา fit แนวโน้ม Early Warning เทียบตามจำนวนรหัส × จำนวนเดือน
+vectorized (numpy IRLS) เทียบ statsmodels GLM ทีละรหัสใน process pool
+
+    python benchmarks/bench_early_warning.py --codes 100 1000 10000 --months 12 36 --glm-max 1000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from early_warning import fit_trends  # noqa: E402
+
+
+def make_counts(n_codes: int, n_months: int, alpha: float = 0.3, seed: int = 0) -> np.ndarray:
+    """เมทริกซ์จำนวนรายเดือนแบบ NB2 มีทั้งรหัสที่พบบ่อยและรหัสที่นานๆ เกิด"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_months) - (n_months - 1) / 2
+    a = rng.normal(0.5, 1.2, n_codes)
+    b = rng.normal(0.0, 0.05, n_codes)
+    mu = np.exp(a[:, None] + b[:, None] * t)
+    r = 1.0 / alpha
+    return rng.negative_binomial(r, r / (r + mu))
+
+
+def _time(fn, runs: int) -> float:
+    best = float("inf")
+    for _ in range(runs):
+        t0 = time.perf_counter(); fn(); best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--codes", type=int, nargs="+", default=[100, 1_000, 10_000])
+    ap.add_argument("--months", type=int, nargs="+", default=[12, 36])
+    ap.add_argument("--glm-max", type=int, default=1_000, help="ข้าม GLM เมื่อรหัสมากกว่านี้ (ช้า)")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--runs", type=int, default=3)
+    args = ap.parse_args(argv)
+
+    print(f"{'codes':>7} {'months':>6} {'dense':>6} {'vectorized (ms)':>16} {'glm pool (ms)':>14} {'max |Δslope|':>13}")
+    for n_months in args.months:
+        for n_codes in args.codes:
+            Y = make_counts(n_codes, n_months)
+            vec = fit_trends(Y)
+            t_vec = _time(lambda: fit_trends(Y), args.runs)
+            dense = int((vec["method"] == "nb").sum())
+            if n_codes <= args.glm_max:
+                glm = fit_trends(Y, method="glm", max_workers=args.workers)
+                t_glm = _time(lambda: fit_trends(Y, method="glm", max_workers=args.workers), 1)
+                both = (vec["method"] == "nb") & (glm["method"] == "nb_glm")
+                diff = float(np.abs(vec.loc[both, "slope"] - glm.loc[both, "slope"]).max()) if both.any() else float("nan")
+                glm_txt, diff_txt = f"{t_glm * 1000:>14.1f}", f"{diff:>13.2e}"
+            else:
+                glm_txt, diff_txt = f"{'-':>14}", f"{'-':>13}"
+            print(f"{n_codes:>7,} {n_months:>6} {dense:>6,} {t_vec * 1000:>16.1f} {glm_txt} {diff_txt}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+# benchmarks/bench_export.py
+# -*- coding: utf-8 -*-
+"""
+ส่งออกผลลัพธ์ที่กรองแล้ว: สร้าง CSV ทั้งก้อนในหน่วยความจำ (to_csv().encode แบบเดิม) เทียบกับเขียนลงไฟล์ทีละช่วงแถว
+
+    python benchmarks/bench_export.py --rows 100000 500000
+
+วัดเวลาและหน่วยความจำสูงสุดที่จัดสรรเพิ่ม (tracemalloc) ของแต่ละวิธี; Parquet / XLSX แสดงเฉพาะแบบเขียนลงไฟล์
+ข้อมูลคือ jib.xlsx ที่ประมวลผลแล้วทำซ้ำจนได้จำนวนแถวที่กำหนด
+"""
+import argparse
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+from export_engine import export_columns, write_csv, write_parquet, write_xlsx  # noqa: E402
+
+
+def measure(fn) -> tuple:
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak / 2**20
+
+
+def make_data(rows: int) -> pd.DataFrame:
+    from incident_pipeline import process_incident_frame
+    from reference_data import load_reference_data
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        base = process_incident_frame(pd.read_excel(ROOT / "jib.xlsx"), load_reference_data(ROOT).psg9_master)
+    reps = -(-rows // len(base))
+    df = pd.concat([base] * reps, ignore_index=True).iloc[:rows]
+    return df[export_columns(df)]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--rows", type=int, nargs="+", default=[100_000, 500_000])
+    ap.add_argument("--xlsx", action="store_true", help="วัด XLSX ด้วย (ช้า)")
+    args = ap.parse_args(argv)
+
+    print(f"{'rows':>9} {'method':<24} {'seconds':>8} {'peak MB':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        out = Path(tmp)
+        for n in args.rows:
+            df = make_data(n)
+            methods = {
+                "csv in memory (เดิม)": lambda: df.to_csv(index=False).encode("utf-8-sig"),
+                "csv chunked file": lambda: write_csv(df, out / "a.csv"),
+                "parquet chunked file": lambda: write_parquet(df, out / "a.parquet"),
+            }
+            if args.xlsx:
+                methods["xlsx constant_memory"] = lambda: write_xlsx({"ข้อมูล": df}, out / "a.xlsx")
+            for name, fn in methods.items():
+                seconds, peak = measure(fn)
+                print(f"{n:>9,} {name:<24} {seconds:>8.2f} {peak:>8.1f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,34 @@
+# benchmarks/bench_risk_level.py
+# -*- coding: utf-8 -*-
+"""
+เปรียบเทียบหน้า Risk level แบบเดิม (st.columns 1 คู่ต่อรหัส) กับแบบตารางเดียว
+วัดจำนวน element และเวลา rerun เมื่อมีรหัสอุบัติการณ์จำนวนมาก
+
+    python benchmarks/bench_risk_level.py --codes 500 3000
+"""
+import argparse
+import sys
+
+import numpy as np
+
+from bench_risk_matrix import bench, make_frame
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--codes", type=int, nargs="+", default=[500, 3_000])
+    ap.add_argument("--rows", type=int, default=50_000)
+    ap.add_argument("--runs", type=int, default=3)
+    args = ap.parse_args(argv)
+
+    print(f"{'codes':>7} {'renderer':<28} {'elements':>9} {'rerun (ms)':>11}")
+    for n_codes in args.codes:
+        df = make_frame(args.rows, n_codes=n_codes)
+        df['Incident Rate/mth'] = np.random.default_rng(1).gamma(1.5, 2.0, len(df)).round(1)
+        for name in ("render_risk_level_summary", "render_risk_level_table"):
+            n_el, t = bench(name, df, args.runs)
+            print(f"{n_codes:>7,} {name:<28} {n_el:>9} {t * 1000:>11.1f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
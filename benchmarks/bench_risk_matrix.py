@@ -0,0 +1,81 @@
+# benchmarks/bench_risk_matrix.py
+# -*- coding: utf-8 -*-
+"""
+เปรียบเทียบ Risk Matrix ตัวเดิม (st.columns + ปุ่มรายช่อง) กับแบบกราฟเดียว (Plotly heatmap)
+วัดจำนวน element ที่ Streamlit ต้องส่งไปหน้าเว็บ และเวลา rerun (ไม่ต้องเปิดเบราว์เซอร์)
+
+    python benchmarks/bench_risk_matrix.py --rows 50000 --runs 5
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+
+REPO_DIR = Path(__file__).resolve().parents[1]
+
+
+def make_frame(n_rows: int, n_codes: int = 50, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    il = rng.choice(list("12345"), size=n_rows, p=[0.45, 0.3, 0.15, 0.07, 0.03])
+    fl = rng.choice(list("12345"), size=n_rows, p=[0.4, 0.25, 0.2, 0.1, 0.05])
+    return pd.DataFrame({
+        'รหัส': rng.choice([f"CPM{100 + i}" for i in range(n_codes)], size=n_rows),
+        'ชื่ออุบัติการณ์ความเสี่ยง': "synthetic",
+        'Impact Level': il, 'Frequency Level': fl, 'Risk Level': np.char.add(il, fl),
+        'Occurrence Date': pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 365, n_rows), unit="D"),
+        'หน่วยงาน': "หน่วยตรวจรักษาทั่วไป", 'กลุ่มงาน': "กลุ่มงานการพยาบาล",
+    })
+
+
+def _script(renderer_name, repo_dir, df):
+    import inspect
+    import sys
+    sys.path.insert(0, repo_dir)
+    import risk_views
+    renderer = getattr(risk_views, renderer_name)
+    if "key_prefix" in inspect.signature(renderer).parameters:
+        renderer(df, key_prefix="bench")
+    else:
+        renderer(df)
+
+
+def count_elements(node) -> int:
+    children = getattr(node, "children", None)
+    if not children:
+        return 1
+    kids = children.values() if isinstance(children, dict) else children
+    return 1 + sum(count_elements(c) for c in kids)
+
+
+def bench(renderer_name: str, df: pd.DataFrame, runs: int):
+    at = AppTest.from_function(_script, args=(renderer_name, str(REPO_DIR), df), default_timeout=120)
+    at.run()  # warm-up (import, cache)
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    timings = []
+    for _ in range(runs):
+        t0 = time.perf_counter(); at.run(); timings.append(time.perf_counter() - t0)
+    return count_elements(at.main), statistics.median(timings)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--rows", type=int, nargs="+", default=[5_000, 50_000])
+    ap.add_argument("--runs", type=int, default=5)
+    args = ap.parse_args(argv)
+
+    print(f"{'rows':>9} {'renderer':<32} {'elements':>9} {'rerun (ms)':>11}")
+    for n in args.rows:
+        df = make_frame(n)
+        for name in ("render_risk_matrix_interactive", "render_risk_matrix_heatmap"):
+            n_el, t = bench(name, df, args.runs)
+            print(f"{n:>9,} {name:<32} {n_el:>9} {t * 1000:>11.1f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+# benchmarks/bench_severity_tab.py
+# -*- coding: utf-8 -*-
+"""
+เวลาสร้างตาราง PSG9 + รายรหัส + รายหมวด (C/G) ด้วย pd.crosstab แยกทีละตาราง เทียบกับนับครั้งเดียว (severity_tab)
+
+    python benchmarks/bench_severity_tab.py --rows 10000 100000 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from severity_tab import build_severity_tab, psg9_table, code_table, category_table  # noqa: E402
+
+PSG9_LABELS = {i: f"{i:02d} PSG{i}" for i in range(1, 10)}
+
+
+def make_frame(n_rows: int, n_codes: int = 300, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    code_id = rng.integers(0, n_codes, n_rows)
+    codes = np.array([("C" if i % 2 else "G") + f"PM{100 + i}" for i in range(n_codes)])
+    psg = np.array(["ไม่จัดอยู่ใน PSG9 Catalog"] * (n_codes // 2) + [PSG9_LABELS[1 + i % 9] for i in range(n_codes - n_codes // 2)])
+    return pd.DataFrame({
+        'รหัส': codes[code_id], 'ชื่ออุบัติการณ์ความเสี่ยง': np.char.add("ชื่อ ", codes[code_id]),
+        'หมวด': np.char.add("หมวด ", (code_id % 12).astype(str)), 'หมวดหมู่มาตรฐานสำคัญ': psg[code_id],
+        'Impact': rng.choice(list("ABCDEFGHI12345"), n_rows, p=[.05, .45, .15, .1, .05, .03, .01, .005, .005, .08, .04, .02, .005, .005]),
+    })
+
+
+def crosstab_tables(df: pd.DataFrame):
+    """แบบเดิม: copy + สร้างสตริง key + crosstab แยกทีละตาราง"""
+    d = df.copy()
+    d['label'] = d['รหัส'].astype(str) + " | " + d['ชื่ออุบัติการณ์ความเสี่ยง'].fillna('')
+    by_code = pd.crosstab(d['label'], d['Impact'])
+    p = df[df['หมวดหมู่มาตรฐานสำคัญ'] != "ไม่จัดอยู่ใน PSG9 Catalog"].copy()
+    psg9 = pd.crosstab(p['หมวดหมู่มาตรฐานสำคัญ'], p['Impact'], margins=True)
+    clinical = df[df['รหัส'].str.startswith('C', na=False)].copy()
+    general = df[df['รหัส'].str.startswith('G', na=False)].copy()
+    return by_code, psg9, pd.crosstab(clinical['หมวด'], clinical['Impact']), pd.crosstab(general['หมวด'], general['Impact'])
+
+
+def tab_tables(df: pd.DataFrame):
+    tab = build_severity_tab(df)
+    return (code_table(tab), psg9_table(tab, PSG9_LABELS),
+            category_table(tab, 'หมวด', 'C'), category_table(tab, 'หมวด', 'G'))
+
+
+def best_of(fn, df, runs):
+    best = float("inf")
+    for _ in range(runs):
+        t0 = time.perf_counter(); fn(df); best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    ap.add_argument("--runs", type=int, default=3)
+    args = ap.parse_args(argv)
+
+    print(f"{'rows':>10} {'crosstab (ms)':>14} {'severity_tab (ms)':>18} {'speedup':>8}")
+    for n in args.rows:
+        df = make_frame(n)
+        t_old, t_new = best_of(crosstab_tables, df, args.runs), best_of(tab_tables, df, args.runs)
+        print(f"{n:>10,} {t_old * 1000:>14.1f} {t_new * 1000:>18.1f} {t_old / t_new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+# benchmarks/bench_spc.py
+# -*- coding: utf-8 -*-
+"""
+เวลาสแกน EWMA/CUSUM ทุก series (รหัส × หน่วยงาน) และเวลาอัปเดตเมื่อมีเดือนใหม่ 1 เดือน
+
+    python benchmarks/bench_spc.py --series 1000 10000 50000 --months 36
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from spc_alerts import scan_spc, update_spc, alert_table  # noqa: E402
+
+
+def make_counts(n_series: int, n_months: int, shifted: float = 0.02, seed: int = 0):
+    """series แบบ Poisson คงที่ มีบางส่วน (shifted) อัตราเพิ่มขึ้น 2 เท่าในช่วงท้าย"""
+    rng = np.random.default_rng(seed)
+    lam = rng.gamma(0.8, 1.5, n_series)[:, None] * np.ones(n_months)
+    shift_rows = rng.random(n_series) < shifted
+    lam[shift_rows, -n_months // 4:] *= 2.0
+    return rng.poisson(lam), shift_rows
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--series", type=int, nargs="+", default=[1_000, 10_000, 50_000])
+    ap.add_argument("--months", type=int, default=36)
+    ap.add_argument("--runs", type=int, default=5)
+    args = ap.parse_args(argv)
+
+    print(f"{'series':>8} {'months':>6} {'scan (ms)':>10} {'update (ms)':>12} {'alerts':>7} {'shifted caught':>15}")
+    for n in args.series:
+        Y, shifted = make_counts(n, args.months)
+        keys = pd.Index([f"S{i}" for i in range(n)])
+        t_scan = t_upd = float("inf")
+        for _ in range(args.runs):
+            t0 = time.perf_counter(); state, hist = scan_spc(keys, Y[:, :-1]); t_scan = min(t_scan, time.perf_counter() - t0)
+            new_month = pd.Series(Y[:, -1], index=keys)
+            t0 = time.perf_counter(); update_spc(state, new_month); t_upd = min(t_upd, time.perf_counter() - t0)
+        alerts = alert_table(state, hist, Y[:, :-1])
+        caught = shifted[keys.get_indexer(alerts["series"])].sum() if len(alerts) else 0
+        print(f"{n:>8,} {args.months:>6} {t_scan * 1000:>10.1f} {t_upd * 1000:>12.2f} {len(alerts):>7,} "
+              f"{caught:>6,}/{shifted.sum():<8,}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+# benchmarks/bench_startup.py
+# -*- coding: utf-8 -*-
+"""
+เวลาเปิดแอปครั้งแรก (cold start) จนหน้าแดชบอร์ดแสดงผลเสร็จ วัดใน process ใหม่ทุกรอบ (นับเวลา import ทั้งหมด)
+
+    python benchmarks/bench_startup.py                      # โฟลเดอร์นี้
+    git worktree add /tmp/hoiarr-before HEAD~1
+    python benchmarks/bench_startup.py . /tmp/hoiarr-before # เทียบก่อน/หลัง
+
+ข้อมูลตั้งต้น (URL jib.xlsx) อ่านจาก jib.xlsx ในโฟลเดอร์แอปแทน เพื่อไม่นับเวลาเครือข่าย
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+HEAVY_MODULES = ["statsmodels.api", "plotly.express", "google.generativeai", "transformers"]
+
+CHILD = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import pandas as pd
+_read_excel = pd.read_excel
+def _local_default(io, *a, **k):
+    if isinstance(io, str) and io.startswith("http") and io.endswith("jib.xlsx"):
+        io = "jib.xlsx"
+    return _read_excel(io, *a, **k)
+pd.read_excel = _local_default
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file("app.py", default_timeout=600)
+at.session_state["selected_analysis"] = "แดชบอร์ดสรุปภาพรวม"
+at.run()
+print(json.dumps({"seconds": time.perf_counter() - t0, "errors": [str(e.value)[:120] for e in at.exception],
+                  "loaded": [m for m in HEAVY if m in sys.modules]}))
+"""
+
+
+def first_render(app_dir: Path) -> dict:
+    code = f"HEAVY = {HEAVY_MODULES!r}\n" + CHILD
+    out = subprocess.run([sys.executable, "-c", code], cwd=app_dir, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("app_dirs", nargs="*", default=[str(Path(__file__).resolve().parent.parent)],
+                    help="โฟลเดอร์ที่มี app.py (หลายโฟลเดอร์ = เทียบกัน)")
+    ap.add_argument("--runs", type=int, default=3)
+    args = ap.parse_args(argv)
+
+    print(f"{'app':<40} {'median (s)':>10} {'best (s)':>9}  heavy modules loaded")
+    for d in args.app_dirs:
+        first_render(Path(d))  # รอบอุ่นเครื่อง (cache ไฟล์นิยาม / disk cache ของ OS)
+        runs = [first_render(Path(d)) for _ in range(args.runs)]
+        secs = [r["seconds"] for r in runs]
+        loaded = ", ".join(runs[-1]["loaded"]) or "-"
+        print(f"{str(d):<40} {statistics.median(secs):>10.2f} {min(secs):>9.2f}  {loaded}")
+        if runs[-1]["errors"]:
+            print(f"  exceptions: {runs[-1]['errors']}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+# benchmarks/bench_suite.py
+# -*- coding: utf-8 -*-
+"""
+วัดทั้งเส้นทางของแอปตามขนาดข้อมูล: นำเข้า -> massage_schema -> ตัวกรอง -> ตัวเลขของทุกหน้า -> ส่งออก
+
+    python benchmarks/bench_suite.py --rows 10000 100000 1000000
+    python benchmarks/bench_suite.py --rows 5000000 --json bench_history.jsonl
+    python benchmarks/bench_suite.py --rows 100000 --baseline bench_history.jsonl   # เทียบกับผลครั้งก่อน
+
+ข้อมูลจาก synthetic_incidents.make_incidents (seed เดิม = ข้อมูลเดิมทุกครั้ง) เขียนเป็น CSV ก่อนเริ่มจับเวลา
+ต่อขั้น: เวลา (วินาที) และหน่วยความจำสูงสุดที่เพิ่มจากก่อนเริ่มขั้น (peak RSS — รีเซ็ต VmHWM ผ่าน
+/proc/self/clear_refs ก่อนแต่ละขั้น, Linux เท่านั้น; ระบบอื่นแสดง "-") — หน่วยความจำที่คืนแล้วแต่ allocator
+ยังถือไว้ถูกใช้ซ้ำได้ ขั้นเล็กจึงอาจแสดงใกล้ 0
+หน้าที่วัดคือฟังก์ชันคำนวณฝั่งเซิร์ฟเวอร์ของแต่ละหน้าบนข้อมูลทั้งชุด (ไม่รวมการวาดกราฟ/Streamlit)
+--json เพิ่มผลหนึ่งบรรทัดต่อขนาดข้อมูล ใช้เป็น baseline ของรอบถัดไปเพื่อดูว่าขั้นไหนช้าลง
+"""
+import argparse
+import gc
+import json
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+from export_engine import XLSX_MAX_ROWS, export_columns, write_csv, write_parquet, write_xlsx  # noqa: E402
+from incident_cube import build_incident_cube  # noqa: E402
+from filter_warmup import FilterWarmup  # noqa: E402
+from incident_pipeline import (HOSPITAL_COL, REF_COL, FLAG_COL, FLAG_PSG9, FLAG_SENTINEL, FLAG_SEVERE,  # noqa: E402
+                               FLAG_UNRESOLVED, incident_flags, flag_counts, massage_schema, add_time_parts_fiscal,
+                               read_incident_file, filter_positions,
+                               filter_by_period_fiscal, filter_by_group_and_unit, filter_by_hospital,
+                               build_risk_matrix, find_sentinel_events, status_index,
+                               create_psg9_summary_table, create_summary_table_by_code,
+                               create_summary_table_by_category, create_goal_summary_table,
+                               persistence_risk_from_cube, rolling_persistence_from_cube,
+                               prioritize_incidents_nb_logit_v2)
+from reference_data import load_reference_data  # noqa: E402
+from risk_views import summarize_risk_level_table, build_risk_level_html  # noqa: E402
+from severity_tab import build_severity_tab  # noqa: E402
+from spc_alerts import scan_spc, alert_table  # noqa: E402
+from stage_profiler import rss_mb  # noqa: E402
+from synthetic_incidents import make_incidents, write_incidents  # noqa: E402
+
+GOAL_SEARCH_TERMS = ["Patient Safety", "Specific Clinical", "Personnel Safety", "Organization Safety"]
+
+
+# =========================
+# วัดเวลา / peak RSS ต่อขั้น
+# =========================
+def _reset_peak() -> bool:
+    """รีเซ็ต VmHWM ของ process (Linux ≥ 4.0) — False ถ้าทำไม่ได้"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb() -> float | None:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def measure(results: list, name: str, fn):
+    """เรียก fn() แล้วเพิ่ม {stage, seconds, peak_mb, rows} ลง results — คืนผลของ fn"""
+    gc.collect()
+    rss0 = rss_mb()
+    tracked = _reset_peak()
+    t0 = time.perf_counter()
+    out = fn()
+    seconds = time.perf_counter() - t0
+    peak = _peak_rss_mb() if tracked else None
+    shape = getattr(out, "shape", None)
+    results.append({"stage": name, "seconds": round(seconds, 4),
+                    "peak_mb": round(max(0.0, peak - rss0), 1) if peak is not None and rss0 is not None else None,
+                    "rows": int(shape[0]) if shape else None})
+    return out
+
+
+# =========================
+# ขั้นของแต่ละหน้า (ตัวเลขเดียวกับที่หน้าในแอปคำนวณ)
+# =========================
+def _total_months(df: pd.DataFrame) -> int:
+    max_p = df['Occurrence Date'].max().to_period('M'); min_p = df['Occurrence Date'].min().to_period('M')
+    return max(1, (max_p.year - min_p.year) * 12 + (max_p.month - min_p.month) + 1)
+
+
+def page_tasks(df: pd.DataFrame, cube, ref) -> dict:
+    """ชื่อหน้า -> ฟังก์ชันที่คำนวณตารางของหน้านั้นบน df ทั้งชุด (ไม่มีตัวกรอง = กรณีหนักสุด)"""
+    def overview():
+        counts = flag_counts(df, FLAG_PSG9, FLAG_SENTINEL, FLAG_SEVERE, FLAG_SEVERE | FLAG_PSG9,
+                             FLAG_SEVERE | FLAG_UNRESOLVED, FLAG_SEVERE | FLAG_UNRESOLVED | FLAG_PSG9, FLAG_UNRESOLVED)
+        status_index(df, 'หมวดหมู่มาตรฐานสำคัญ')
+        return cube.monthly_totals(), counts
+
+    def incidents_analysis():
+        tab = build_severity_tab(df)
+        create_psg9_summary_table(df, ref.psg9_label_dict, tab=tab)
+        create_summary_table_by_category(df, 'หมวด', tab=tab, code_prefix='C')
+        create_summary_table_by_category(df, 'หมวด', tab=tab, code_prefix='G')
+        status_index(df, 'หมวด')
+        return create_summary_table_by_code(df, tab=tab)
+
+    def heatmap():
+        heat = cube.label_by_calendar_month()
+        for term in GOAL_SEARCH_TERMS:
+            cube.label_by_calendar_month(None, None, cube.goal_entry_mask(term))
+        return heat
+
+    def early_warning():
+        res = prioritize_incidents_nb_logit_v2(df, horizon=3, cube_view=(cube, None, None))
+        keys, Y = cube.grouped_month(('รหัส', 'หน่วยงาน'))
+        state, hist = scan_spc(keys, Y)
+        alert_table(state, hist, Y, cube.months.strftime('%Y-%m'))
+        return res
+
+    total_months = _total_months(df)
+    return {
+        "page: ภาพรวม": overview,
+        "page: Incidents Analysis": incidents_analysis,
+        "page: Risk Matrix": lambda: build_risk_matrix(df),
+        "page: Risk level": lambda: build_risk_level_html(summarize_risk_level_table(df)),
+        "page: Heatmap รายเดือน": heatmap,
+        "page: Sentinel Events": lambda: find_sentinel_events(df, set(ref.sentinel_keys), ref.sentinel_df),
+        "page: Safety Goals": lambda: create_goal_summary_table(df, ref.code_mapping, ref.goal_type_order),
+        "page: Persistence": lambda: (persistence_risk_from_cube(cube, None, None, total_months),
+                                      rolling_persistence_from_cube(cube))[0],
+        "page: Early Warning + SPC": early_warning,
+    }
+
+
+def run_size(rows: int, seed: int, months: int, hospitals: int, xlsx: bool, tmp: Path) -> list:
+    ref = load_reference_data(ROOT)
+    source = write_incidents(make_incidents(rows, seed, months=months), tmp / f"incidents_{rows}.csv")
+    results = []
+
+    raw = measure(results, "ingest: read csv", lambda: read_incident_file(source))
+    if xlsx and rows < XLSX_MAX_ROWS:
+        xlsx_source = write_incidents(raw, tmp / f"incidents_{rows}.xlsx")
+        measure(results, "ingest: read xlsx", lambda: read_incident_file(xlsx_source))
+    df = measure(results, "massage_schema", lambda: massage_schema(raw, ref.psg9_master))
+    df = measure(results, "add_time_parts_fiscal", lambda: add_time_parts_fiscal(df))
+    raw = None  # ปล่อยข้อมูลดิบก่อนวัดขั้นถัดไป
+    df[FLAG_COL] = measure(results, "incident_flags",
+                           lambda: incident_flags(df, ref.psg9_codes, ref.sentinel_keys))
+    # หลายโรงพยาบาล: แบ่งแถวแบบเดียวกับที่ ingest_incident_files ติดชื่อไฟล์ให้แต่ละชุด
+    names = [f"รพ.{i + 1}" for i in range(hospitals)]
+    df[HOSPITAL_COL] = pd.Categorical.from_codes(np.random.default_rng(seed).integers(0, hospitals, len(df)), names)
+
+    latest_fy = int(df['FY_int'].max())
+    top_group = df['กลุ่มงาน'].value_counts().index[0]
+    top_unit = df.loc[df['กลุ่มงาน'] == top_group, REF_COL].value_counts().index[0]
+    measure(results, "filter: period (รายปี)", lambda: filter_by_period_fiscal(df, "รายปี", latest_fy))
+    measure(results, "filter: period (รายเดือน)", lambda: filter_by_period_fiscal(df, "รายเดือน", latest_fy, m=1))
+    measure(results, "filter: group/unit", lambda: filter_by_group_and_unit(df, top_group, top_unit))
+    measure(results, "filter: hospital", lambda: filter_by_hospital(df, names[:1]))
+    measure(results, "filter: positions + take", lambda: df.take(filter_positions(df, "รายปี", latest_fy, group_name=top_group, unit_name=top_unit)))
+
+    cube = measure(results, "build_incident_cube", lambda: build_incident_cube(df))
+    groups = [g for g in df['กลุ่มงาน'].dropna().unique() if g != "N/A"]
+    measure(results, "warm-up: default plan",
+            lambda: [f.result() for f in FilterWarmup(usage_path=None).schedule("bench", df, cube, groups)])
+    for name, fn in page_tasks(df, cube, ref).items():
+        measure(results, name, fn)
+
+    data = df[export_columns(df)]
+    measure(results, "export: csv", lambda: write_csv(data, tmp / "export.csv"))
+    measure(results, "export: parquet", lambda: write_parquet(data, tmp / "export.parquet"))
+    if xlsx and len(data) < XLSX_MAX_ROWS:
+        measure(results, "export: xlsx", lambda: write_xlsx({"ข้อมูล": data}, tmp / "export.xlsx"))
+    for path in tmp.glob("*"):
+        path.unlink()
+    return results
+
+
+def load_baseline(path) -> dict:
+    """rows -> {stage: seconds} จากบรรทัดล่าสุดของแต่ละขนาดในไฟล์ --json"""
+    out = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                out[entry["rows"]] = {s["stage"]: s["seconds"] for s in entry["stages"]}
+    return out
+
+
+def print_results(rows: int, results: list, baseline: dict = None):
+    base = (baseline or {}).get(rows, {})
+    total = sum(r["seconds"] for r in results)
+    print(f"\n{rows:,} แถว — รวม {total:.2f}s")
+    print(f"{'stage':<28} {'seconds':>9} {'peak MB':>8} {'rows out':>10}" + (f" {'×base':>6}" if base else ""))
+    for r in results:
+        peak = f"{r['peak_mb']:>8.1f}" if r["peak_mb"] is not None else f"{'-':>8}"
+        out_rows = f"{r['rows']:>10,}" if r["rows"] is not None else f"{'':>10}"
+        ratio = ""
+        if base:
+            prev = base.get(r["stage"])
+            ratio = f" {r['seconds'] / prev:>6.2f}" if prev else f" {'new':>6}"
+        print(f"{r['stage']:<28} {r['seconds']:>9.3f} {peak} {out_rows}{ratio}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--months", type=int, default=36)
+    ap.add_argument("--hospitals", type=int, default=2)
+    ap.add_argument("--xlsx", action="store_true", help="วัดอ่าน/เขียน XLSX ด้วย (ช้า, เฉพาะขนาดที่ไม่เกินขีดจำกัด Excel)")
+    ap.add_argument("--json", help="เพิ่มผลลงไฟล์ JSON lines (หนึ่งบรรทัดต่อขนาดข้อมูล)")
+    ap.add_argument("--baseline", help="ไฟล์จาก --json ครั้งก่อน: แสดงอัตราส่วนเวลาเทียบผลล่าสุดของขนาดเดียวกัน")
+    args = ap.parse_args(argv)
+
+    baseline = load_baseline(args.baseline) if args.baseline else None
+    with tempfile.TemporaryDirectory() as tmp, warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for rows in args.rows:
+            results = run_size(rows, args.seed, args.months, args.hospitals, args.xlsx, Path(tmp))
+            print_results(rows, results, baseline)
+            if args.json:
+                entry = {"ts": time.strftime("%Y-%m-%dT%H:%M:%S"), "rows": rows, "seed": args.seed,
+                         "months": args.months, "hospitals": args.hospitals, "stages": results}
+                with open(args.json, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
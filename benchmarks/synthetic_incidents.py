@@ -0,0 +1,301 @@
+# benchmarks/synthetic_incidents.py
+# -*- coding: utf-8 -*-
+"""
+สร้างไฟล์ส่งออกอุบัติการณ์สังเคราะห์ (คอลัมน์เดียวกับ jib.xlsx) สำหรับวัดประสิทธิภาพที่ 10k – 5M แถว
+
+    python benchmarks/synthetic_incidents.py --rows 1000000 -o synth_1m.csv
+    python benchmarks/synthetic_incidents.py --rows 100000 --months 24 --seed 7 -o synth.xlsx
+
+การกระจายตัวปรับจาก jib.xlsx (ไม่มีข้อมูลจริงในผลลัพธ์):
+- รหัส/ชื่อ/หมวด/ประเภท จาก Code2024.xlsx — PSG9 (PSG9code.xlsx) ≈ 41%, clinical อื่น ≈ 17%, general ≈ 42%
+  ภายในแต่ละกลุ่มความถี่แบบ Zipf (มีไม่กี่รหัสที่พบบ่อยมาก และหางยาว)
+- ระดับความรุนแรงตามกลุ่มรหัส: clinical A–I, general ส่วนใหญ่ A–F ปน 1–4
+- หน่วยงานจาก SERVICE_MAP (Zipf, ~4% มีช่องว่างท้ายชื่อ), ชั่วโมงเกิดเหตุ/วันในสัปดาห์ตามตัวอย่าง
+- วันเวลาเป็นข้อความไทยหลายรูปแบบ: dd/mm/พ.ศ. HH:MM[:SS] น., เดือนย่อไทย, เลขไทย, dd-mm-ค.ศ., Excel serial, ค่าว่าง
+- ข้อความบรรยาย/การแก้ไข/ข้อเสนอแนะ สร้างจากแม่แบบ, ชื่อผู้รายงานเป็นรหัส (ผู้รายงาน 00001)
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+from incident_pipeline import SERVICE_MAP, TH_MONTH_TINY  # noqa: E402
+from reference_data import load_reference_data, normalize_goal_label  # noqa: E402
+
+COLUMNS = [
+    'เลขที่รับ', 'หน่วยงาน', 'วัน-เวลา ที่รายงาน', 'สถานที่เกิดเหตุ', 'วัน-เวลา ที่เกิดเหตุ', 'หน่วยงานที่เกี่ยวข้อง',
+    'ที่มา และประเภทของความเสี่ยง', 'กลุ่มอุบัติการณ์', 'หมวด', 'ประเภท', 'ประเภทย่อย', 'รหัสหัวข้อ', 'หัวข้อ',
+    'ระดับความรุนแรง', 'สรุปปัญหา/เหตุการณ์โดยย่อ', 'การดำเนินการ/การแก้ไขที่ได้ดำเนินการไปแล้ว',
+    'ผลลัพธ์ของการแก้ไขเบื้องต้น', 'ข้อเสนอแนะเพื่อการป้องกัน', 'ทบทวนส่งศูนย์คุณภาพภายใน', 'ทีมคร่อม',
+    'สรุปเหตุการณ์/ประเด็นที่ต้องทบทวน', 'self_report', 'potential_harm', 'ชื่อผู้รายงาน',
+]
+
+# =========================
+# การกระจายตัวจากตัวอย่าง (jib.xlsx)
+# =========================
+CODE_POOL_SHARE = {"psg9": 0.41, "clinical": 0.17, "general": 0.42}
+CODE_ZIPF = {"psg9": 1.4, "clinical": 1.4, "general": 1.8}
+UNIT_ZIPF = 1.2
+SEVERITY_MIX = {
+    "C": {"A": .013, "B": .640, "C": .151, "D": .100, "E": .054, "F": .030, "G": .004, "H": .004, "I": .004},
+    "G": {"1": .197, "2": .040, "3": .019, "4": .002, "A": .070, "B": .613, "C": .026, "D": .021, "E": .010, "F": .002},
+}
+HOUR_WEIGHTS = [.018, .008, .007, .003, .003, .001, .012, .025, .115, .107, .102, .078,
+                .046, .075, .090, .066, .051, .039, .043, .025, .029, .014, .017, .025]
+DOW_WEIGHTS = [.186, .182, .205, .160, .139, .066, .062]  # จันทร์ ... อาทิตย์
+# รูปแบบวัน-เวลา ที่เกิดเหตุ -> สัดส่วน (ตัวอย่างจริงมีสองแบบแรก ~69/31; แบบอื่นคือที่ parse_incident_datetime รองรับ)
+DATE_FORMATS = {"slash_be": .60, "slash_be_sec": .27, "thai_month": .04, "thai_digits": .03,
+                "dash_ce": .03, "excel_serial": .02, "blank": .01}
+GROUP_LABELS = {"C": "กลุ่มอุบัติการณ์ความเสี่ยงด้านคลินิก (Clinical Risk Incident: C)",
+                "G": "กลุ่มอุบัติการณ์ความเสี่ยงทั่วไป (General Risk Incident: G)"}
+SOURCES = {"เชิงรับ : งานงานอุบัติการณ์": .99, "เชิงรุก : UI": .01}
+SHARES = {"unit_space": .04, "place_missing": .005, "related": .34, "unresolved": .002, "outcome": .68,
+          "recommendation": .65, "review": .69, "self_report": .74, "potential_harm": .076}
+
+# ข้อความ: ก่อนชื่ออุบัติการณ์, ระหว่างชื่อกับหน่วยงาน, ต่อท้าย
+DETAIL_TEMPLATES = [
+    ("พบ", " ระหว่างปฏิบัติงานที่", ""),
+    ("เกิดเหตุการณ์ ", " ที่", " ผู้ป่วยไม่ได้รับอันตราย"),
+    ("", " ตรวจพบขณะส่งเวรที่", " แจ้งหัวหน้าเวรทราบแล้ว"),
+    ("รายงานอุบัติการณ์: ", " (", ") ตรวจสอบย้อนหลังพบสาเหตุจากขั้นตอนการทำงาน"),
+    ("เจ้าหน้าที่แจ้ง ", " ในพื้นที่", " ได้ดำเนินการแก้ไขเบื้องต้นแล้ว"),
+]
+ACTIONS = ["แจ้งหัวหน้าหน่วยงานและแก้ไขทันที", "ทบทวนขั้นตอนการปฏิบัติงานร่วมกับทีม", "ประสานหน่วยงานที่เกี่ยวข้องเพื่อแก้ไข",
+           "ตรวจสอบซ้ำและบันทึกในระบบ", "เฝ้าระวังอาการผู้ป่วยอย่างใกล้ชิด", "ซ่อมแซม/เปลี่ยนอุปกรณ์ให้พร้อมใช้งาน"]
+OUTCOMES = ["แก้ไขได้เรียบร้อย ไม่เกิดผลกระทบต่อผู้ป่วย", "ผู้ป่วยปลอดภัย อาการคงที่", "ระบบกลับมาใช้งานได้ตามปกติ",
+            "อยู่ระหว่างติดตามผล"]
+RECOMMENDATIONS = ["ทบทวนแนวทางปฏิบัติและสื่อสารให้ทุกเวรทราบ", "เพิ่มขั้นตอนการตรวจสอบซ้ำ (double check)",
+                   "จัดอบรมเจ้าหน้าที่ใหม่", "ตรวจสอบความพร้อมของอุปกรณ์ทุกวัน", "ปรับปรุงระบบแจ้งเตือนในโปรแกรม"]
+
+_PAD2 = np.array([f"{i:02d}" for i in range(100)], dtype=object)
+_PLAIN = np.array([str(i) for i in range(100)], dtype=object)
+_THAI_DIGITS = str.maketrans("0123456789", "๐๑๒๓๔๕๖๗๘๙")
+_EXCEL_EPOCH = np.datetime64("1899-12-30T00:00:00", "s")
+
+
+def _zipf_weights(n: int, s: float) -> np.ndarray:
+    w = 1.0 / np.arange(1, n + 1) ** s
+    return w / w.sum()
+
+
+def _normalized(p: dict) -> tuple:
+    keys = list(p)
+    w = np.array([p[k] for k in keys], dtype=float)
+    return keys, w / w.sum()
+
+
+def code_catalog(base_dir=ROOT, seed: int = 0) -> pd.DataFrame:
+    """Code2024 พร้อมคอลัมน์ weight (ความน่าจะเป็นของแต่ละรหัส) — ลำดับ Zipf ในแต่ละกลุ่มสุ่มด้วย seed"""
+    ref = load_reference_data(base_dir)
+    codes = ref.code_mapping.dropna(subset=['รหัส']).drop_duplicates('รหัส').reset_index(drop=True)
+    codes['รหัส'] = codes['รหัส'].astype(str).str.strip()
+    codes = codes[codes['รหัส'].str[0].isin(["C", "G"])].reset_index(drop=True)
+    pool = np.where(codes['รหัส'].isin(ref.psg9_codes), "psg9",
+                    np.where(codes['รหัส'].str[0] == "C", "clinical", "general"))
+    rng = np.random.default_rng(seed)
+    weights = np.zeros(len(codes))
+    for name, share in CODE_POOL_SHARE.items():
+        idx = np.flatnonzero(pool == name)
+        if len(idx):
+            weights[rng.permutation(idx)] = share * _zipf_weights(len(idx), CODE_ZIPF[name])
+    out = pd.DataFrame({
+        'รหัส': codes['รหัส'],
+        'หัวข้อ': codes['ชื่ออุบัติการณ์ความเสี่ยง'].astype(str).str.strip(),
+        'กลุ่มอุบัติการณ์': codes['รหัส'].str[0].map(GROUP_LABELS),
+        'หมวด': codes['หมวด'].map(normalize_goal_label),
+        'ประเภท': codes['ประเภท'].map(normalize_goal_label),
+        'ประเภทย่อย': codes['ประเภทย่อย'].map(normalize_goal_label),
+        'weight': weights / weights.sum(),
+    })
+    return out
+
+
+def _day_weights(days: pd.DatetimeIndex, rng) -> np.ndarray:
+    """น้ำหนักรายวัน = ปริมาณรายเดือน (แนวโน้มขึ้น + สุ่ม) / จำนวนวันในเดือน × วันในสัปดาห์"""
+    month_no = (days.year - days[0].year) * 12 + days.month - days[0].month
+    n_months = int(month_no.max()) + 1
+    volume = rng.gamma(8.0, 1 / 8.0, n_months) * (1 + 0.6 * np.arange(n_months) / max(1, n_months - 1))
+    w = volume[month_no] / days.days_in_month.to_numpy() * np.asarray(DOW_WEIGHTS)[days.dayofweek]
+    return w / w.sum()
+
+
+def _parts(ts: np.ndarray) -> tuple:
+    idx = pd.DatetimeIndex(ts)
+    return (idx.day.to_numpy(), idx.month.to_numpy(), idx.year.to_numpy(),
+            idx.hour.to_numpy(), idx.minute.to_numpy(), idx.second.to_numpy())
+
+
+def _year_text(years: np.ndarray, offset: int = 0) -> np.ndarray:
+    uniq, inv = np.unique(years, return_inverse=True)
+    return np.array([str(y + offset) for y in uniq], dtype=object)[inv]
+
+
+def format_datetimes(ts: np.ndarray, kinds: np.ndarray) -> np.ndarray:
+    """ข้อความวันเวลาตามรูปแบบใน DATE_FORMATS (kinds = ชื่อรูปแบบของแต่ละแถว)"""
+    out = np.empty(len(ts), dtype=object)
+    d, m, y, hh, mm, ss = _parts(ts)
+    be = _year_text(y, 543)
+    for kind in np.unique(kinds):
+        k = kinds == kind
+        if kind in ("slash_be", "slash_be_sec", "thai_digits"):
+            text = _PAD2[d[k]] + "/" + _PAD2[m[k]] + "/" + be[k] + " " + _PAD2[hh[k]] + ":" + _PAD2[mm[k]]
+            text = text + ":" + _PAD2[ss[k]] + " น." if kind == "slash_be_sec" else text + " น."
+            if kind == "thai_digits":
+                text = pd.Series(text, dtype=object).str.translate(_THAI_DIGITS).to_numpy(dtype=object)
+        elif kind == "thai_month":
+            months = np.array([""] + [TH_MONTH_TINY[i] for i in range(1, 13)], dtype=object)
+            text = _PLAIN[d[k]] + " " + months[m[k]] + " " + be[k] + " " + _PAD2[hh[k]] + ":" + _PAD2[mm[k]]
+        elif kind == "dash_ce":
+            text = _PAD2[d[k]] + "-" + _PAD2[m[k]] + "-" + _year_text(y[k]) + " " + _PAD2[hh[k]] + ":" + _PAD2[mm[k]]
+        elif kind == "excel_serial":
+            text = np.round((ts[k] - _EXCEL_EPOCH).astype(np.int64) / 86400, 5).astype(object)
+        else:  # blank -> ถูกตัดทิ้งใน massage_schema
+            text = None
+        out[k] = text
+    return out
+
+
+def _pick(rng, options, n: int) -> np.ndarray:
+    return np.asarray(options, dtype=object)[rng.integers(0, len(options), n)]
+
+
+def _maybe(rng, values: np.ndarray, share: float) -> np.ndarray:
+    out = values.astype(object, copy=True)
+    out[rng.random(len(out)) >= share] = None
+    return out
+
+
+def make_incidents(rows: int, seed: int = 0, start: str = "2022-10-01", months: int = 36,
+                   base_dir=ROOT) -> pd.DataFrame:
+    """ข้อมูลดิบสังเคราะห์ rows แถว ช่วง months เดือนตั้งแต่ start (เลือกด้วย seed เดิม = ผลเหมือนเดิม)"""
+    rng = np.random.default_rng(seed)
+    catalog = code_catalog(base_dir, seed)
+    units = np.array(list(dict.fromkeys(s["หน่วยงาน"] for s in SERVICE_MAP)), dtype=object)
+    units = units[rng.permutation(len(units))]
+
+    # --- รหัส / ระดับความรุนแรง ---
+    code_idx = rng.choice(len(catalog), rows, p=catalog['weight'].to_numpy())
+    codes = catalog['รหัส'].to_numpy(dtype=object)[code_idx]
+    severity = np.empty(rows, dtype=object)
+    for prefix, mix in SEVERITY_MIX.items():
+        k = np.flatnonzero(catalog['รหัส'].str[0].to_numpy()[code_idx] == prefix)
+        levels, p = _normalized(mix)
+        severity[k] = np.asarray(levels, dtype=object)[rng.choice(len(levels), len(k), p=p)]
+
+    # --- หน่วยงาน ---
+    unit_idx = rng.choice(len(units), rows, p=_zipf_weights(len(units), UNIT_ZIPF))
+    unit = units[unit_idx]
+    unit_raw = unit.copy()
+    spaced = rng.random(rows) < SHARES["unit_space"]
+    unit_raw[spaced] = unit_raw[spaced] + " "
+
+    # --- วันเวลาเกิดเหตุ / รายงาน ---
+    start_ts = pd.Timestamp(start).normalize()
+    days = pd.date_range(start_ts, start_ts + pd.DateOffset(months=months) - pd.Timedelta(days=1), freq="D")
+    day = days.to_numpy().astype("datetime64[s]")[rng.choice(len(days), rows, p=_day_weights(days, rng))]
+    hour = rng.choice(24, rows, p=np.asarray(HOUR_WEIGHTS) / sum(HOUR_WEIGHTS))
+    occurred = day + (hour * 3600 + rng.integers(0, 3600, rows)).astype("timedelta64[s]")
+    lag_days = np.select([rng.random(rows) < 0.45, rng.random(rows) < 0.45],
+                         [rng.exponential(0.3, rows), rng.exponential(7.0, rows)], rng.uniform(30, 180, rows))
+    reported = occurred + (lag_days * 86400).astype("timedelta64[s]")
+    fmt_names, fmt_p = _normalized(DATE_FORMATS)
+    occurred_text = format_datetimes(occurred, np.asarray(fmt_names)[rng.choice(len(fmt_names), rows, p=fmt_p)])
+    reported_text = format_datetimes(reported, np.full(rows, "slash_be_sec"))
+
+    # เลขที่รับ: ปี ค.ศ. ที่รายงาน-ลำดับในปีนั้น (ตามเวลารายงาน)
+    report_year = pd.DatetimeIndex(reported).year.to_numpy()
+    order = np.lexsort((reported, report_year))
+    seq = np.empty(rows, dtype=np.int64)
+    seq[order] = pd.Series(report_year[order]).groupby(report_year[order]).cumcount().to_numpy() + 1
+    receipt = _year_text(report_year) + "-" + pd.Series(seq).astype(str).to_numpy(dtype=object)
+    review = pd.DatetimeIndex(reported + rng.integers(0, 15, rows).astype("timedelta64[D]")).strftime("%Y-%m-%d")
+
+    # --- ข้อความจากแม่แบบ ---
+    names = catalog['หัวข้อ'].to_numpy(dtype=object)[code_idx]
+    detail = np.empty(rows, dtype=object)
+    template = rng.integers(0, len(DETAIL_TEMPLATES), rows)
+    for t, (before, between, after) in enumerate(DETAIL_TEMPLATES):
+        k = template == t
+        detail[k] = before + names[k] + between + unit[k] + after
+    actions = _pick(rng, ACTIONS, rows)
+    actions[rng.random(rows) < SHARES["unresolved"]] = None
+    places = unit.copy()
+    places[rng.random(rows) < SHARES["place_missing"]] = None
+
+    reporter_ids = np.array([f"ผู้รายงาน {i:05d}" for i in range(1, max(50, rows // 8) + 1)], dtype=object)
+    reporters = reporter_ids[rng.integers(0, len(reporter_ids), rows)]
+
+    cat = catalog.iloc[code_idx]
+    df = pd.DataFrame({
+        'เลขที่รับ': receipt,
+        'หน่วยงาน': unit_raw,
+        'วัน-เวลา ที่รายงาน': reported_text,
+        'สถานที่เกิดเหตุ': places,
+        'วัน-เวลา ที่เกิดเหตุ': occurred_text,
+        'หน่วยงานที่เกี่ยวข้อง': _maybe(rng, _pick(rng, units, rows), SHARES["related"]),
+        'ที่มา และประเภทของความเสี่ยง': np.asarray(list(SOURCES), dtype=object)[
+            rng.choice(len(SOURCES), rows, p=_normalized(SOURCES)[1])],
+        'กลุ่มอุบัติการณ์': cat['กลุ่มอุบัติการณ์'].to_numpy(dtype=object),
+        'หมวด': cat['หมวด'].to_numpy(dtype=object),
+        'ประเภท': cat['ประเภท'].to_numpy(dtype=object),
+        'ประเภทย่อย': cat['ประเภทย่อย'].to_numpy(dtype=object),
+        'รหัสหัวข้อ': codes,
+        'หัวข้อ': names,
+        'ระดับความรุนแรง': severity,
+        'สรุปปัญหา/เหตุการณ์โดยย่อ': detail,
+        'การดำเนินการ/การแก้ไขที่ได้ดำเนินการไปแล้ว': actions,
+        'ผลลัพธ์ของการแก้ไขเบื้องต้น': _maybe(rng, _pick(rng, OUTCOMES, rows), SHARES["outcome"]),
+        'ข้อเสนอแนะเพื่อการป้องกัน': _maybe(rng, _pick(rng, RECOMMENDATIONS, rows), SHARES["recommendation"]),
+        'ทบทวนส่งศูนย์คุณภาพภายใน': _maybe(rng, review.to_numpy(dtype=object), SHARES["review"]),
+        'ทีมคร่อม': np.nan,
+        'สรุปเหตุการณ์/ประเด็นที่ต้องทบทวน': np.nan,
+        'self_report': np.where(rng.random(rows) < SHARES["self_report"], 1.0, np.nan),
+        'potential_harm': np.where(rng.random(rows) < SHARES["potential_harm"], 1.0, np.nan),
+        'ชื่อผู้รายงาน': reporters,
+    }, columns=COLUMNS)
+    return df
+
+
+def write_incidents(df: pd.DataFrame, path) -> Path:
+    """เขียนเป็น .csv (utf-8) หรือ .xlsx ชีตเดียว (ไม่เกินขีดจำกัดแถวของ Excel) แบบที่ read_incident_file อ่านได้"""
+    from export_engine import XLSX_MAX_ROWS, write_xlsx
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix == ".csv":
+        df.to_csv(path, index=False)
+    elif suffix == ".xlsx":
+        if len(df) >= XLSX_MAX_ROWS:
+            raise ValueError(f"xlsx เก็บได้ไม่เกิน {XLSX_MAX_ROWS - 1:,} แถวต่อชีต — ใช้ .csv สำหรับ {len(df):,} แถว")
+        write_xlsx({"Sheet1": df}, path)
+    else:
+        raise ValueError("รองรับ .csv, .xlsx")
+    return path
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--start", default="2022-10-01", help="วันแรกของช่วงข้อมูล (ค.ศ.)")
+    ap.add_argument("--months", type=int, default=36)
+    ap.add_argument("-o", "--output", required=True, help="ไฟล์ผลลัพธ์ .csv หรือ .xlsx")
+    args = ap.parse_args(argv)
+
+    t0 = time.perf_counter()
+    df = make_incidents(args.rows, args.seed, args.start, args.months)
+    t1 = time.perf_counter()
+    try:
+        path = write_incidents(df, args.output)
+    except ValueError as e:
+        ap.error(str(e))
+    print(f"{len(df):,} แถว -> {path} ({path.stat().st_size / 2**20:.1f} MB) | "
+          f"สร้าง {t1 - t0:.1f}s เขียน {time.perf_counter() - t1:.1f}s")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
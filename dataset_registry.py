@@ -0,0 +1,130 @@
+# dataset_registry.py
+# -*- coding: utf-8 -*-
+# ทะเบียนชุดข้อมูลที่ประมวลผลแล้ว ใช้ร่วมกันทุก session ใน process เดียวกัน (ไม่ใช้ Streamlit)
+#
+#   source_key (hash ไฟล์ที่อัปโหลด / URL ข้อมูลตั้งต้น) --alias--> key = dataset_fingerprint(df) --> DataFrame (อ่านอย่างเดียว)
+#
+# - ชุดข้อมูลเดียวกันเก็บครั้งเดียว: ไฟล์เดียวกันจากหลาย session หรือคนละแหล่งแต่เนื้อหาเดียวกันได้ DataFrame ตัวเดียวกัน
+# - session เก็บเพียง key (handle) + สถานะตัวกรองของตัวเอง; ทะเบียนนับว่า session ใดใช้ชุดไหนล่าสุดเมื่อไร
+# - ชุดที่ไม่มี session ใช้ภายใน idle_seconds ถูกปลดออก (และเมื่อเกิน max_datasets ปลดชุดที่ว่างนานสุดก่อน)
+# - ข้อมูลในทะเบียนตั้งเป็น read-only: แก้ค่าในที่ (in place) จะเกิด ValueError แทนที่จะกระทบ session อื่น
+import threading
+import time
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+from incident_cube import dataset_fingerprint
+
+
+def freeze_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """ตั้ง array ภายใน DataFrame เป็น read-only (numpy block; categorical/datetime ตั้งที่ ndarray ที่อยู่ข้างใน)"""
+    for block in getattr(df._mgr, "blocks", ()):
+        arr = getattr(block.values, "_ndarray", block.values)
+        if hasattr(arr, "flags"):
+            arr.flags.writeable = False
+    return df
+
+
+@dataclass
+class _Entry:
+    frame: pd.DataFrame
+    nbytes: int
+    sessions: dict = field(default_factory=dict)  # session_id -> เวลาที่ใช้ล่าสุด
+    last_used: float = 0.0
+
+
+class DatasetRegistry:
+    def __init__(self, idle_seconds: float = 1800, max_datasets: int = 8):
+        self.idle_seconds = idle_seconds
+        self.max_datasets = max_datasets
+        self._entries = {}        # key -> _Entry
+        self._aliases = {}        # source_key -> key
+        self._session_key = {}    # session_id -> key ที่ session ใช้อยู่
+        self._lock = threading.Lock()
+        self._load_locks = {}     # source_key -> Lock (หลาย session เปิดแหล่งเดียวกันพร้อมกัน โหลดครั้งเดียว)
+
+    def open(self, source_key: str, loader, session_id: str) -> str:
+        """
+        key ของชุดข้อมูลจาก source_key — ยังไม่มีในทะเบียนจึงเรียก loader() (คืน DataFrame ที่ประมวลผลแล้ว)
+        loader ที่โยน exception (รวมถึง st.stop) ไม่ถูกบันทึก
+        """
+        key = self._lookup(source_key, session_id)
+        if key is not None:
+            return key
+        with self._lock:
+            load_lock = self._load_locks.setdefault(source_key, threading.Lock())
+        with load_lock:
+            key = self._lookup(source_key, session_id)  # session อื่นโหลดเสร็จระหว่างรอ
+            if key is not None:
+                return key
+            frame = loader()
+            key = dataset_fingerprint(frame)
+            with self._lock:
+                if key not in self._entries:
+                    nbytes = int(frame.memory_usage(deep=True).sum())  # ก่อน freeze (memory_usage deep อ่าน buffer แบบเขียนได้)
+                    self._entries[key] = _Entry(freeze_frame(frame), nbytes)
+                self._aliases[source_key] = key
+                self._touch(key, session_id)
+                self._evict()
+            return key
+
+    def get(self, key: str, session_id: str = None) -> pd.DataFrame | None:
+        """DataFrame ของ key (None = ถูกปลดไปแล้ว ต้อง open ใหม่)"""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            if session_id is not None:
+                self._touch(key, session_id)
+            return self._entries[key].frame
+
+    def release(self, session_id: str):
+        """session เลิกใช้ชุดข้อมูล (เช่น เปลี่ยนไปใช้ store) — ชุดที่ไม่มีผู้ใช้จะถูกปลดตามเวลา"""
+        with self._lock:
+            key = self._session_key.pop(session_id, None)
+            if key in self._entries:
+                self._entries[key].sessions.pop(session_id, None)
+            self._evict()
+
+    def stats(self) -> pd.DataFrame:
+        """สรุปทะเบียน: key, จำนวนแถว, MB, session ที่ยังใช้อยู่"""
+        now = time.monotonic()
+        with self._lock:
+            rows = [{"key": k[:12], "rows": len(e.frame), "MB": round(e.nbytes / 2**20, 1),
+                     "sessions": sum(now - t <= self.idle_seconds for t in e.sessions.values()),
+                     "idle_s": round(now - e.last_used)}
+                    for k, e in self._entries.items()]
+        return pd.DataFrame(rows, columns=["key", "rows", "MB", "sessions", "idle_s"])
+
+    # --- ภายใน (เรียกขณะถือ self._lock) ---
+    def _lookup(self, source_key, session_id):
+        with self._lock:
+            key = self._aliases.get(source_key)
+            if key not in self._entries:
+                return None
+            self._touch(key, session_id)
+            return key
+
+    def _touch(self, key, session_id):
+        now = time.monotonic()
+        previous = self._session_key.get(session_id)
+        if previous is not None and previous != key and previous in self._entries:
+            self._entries[previous].sessions.pop(session_id, None)  # session เปลี่ยนชุดข้อมูล -> ลดการอ้างอิงชุดเดิม
+        self._session_key[session_id] = key
+        entry = self._entries[key]
+        entry.sessions[session_id] = now
+        entry.last_used = now
+
+    def _evict(self):
+        now = time.monotonic()
+        for entry in self._entries.values():
+            for sid in [s for s, t in entry.sessions.items() if now - t > self.idle_seconds]:
+                del entry.sessions[sid]  # session ที่หายไป (ปิดเบราว์เซอร์) ไม่ถือการอ้างอิงไว้ตลอด
+        idle = sorted((e.last_used, k) for k, e in self._entries.items() if not e.sessions)
+        over = max(0, len(self._entries) - self.max_datasets)
+        for i, (last_used, key) in enumerate(idle):
+            if i < over or now - last_used > self.idle_seconds:
+                del self._entries[key]
+        self._aliases = {s: k for s, k in self._aliases.items() if k in self._entries}
+        self._session_key = {s: k for s, k in self._session_key.items() if k in self._entries}
+        self._load_locks = {s: lk for s, lk in self._load_locks.items() if s in self._aliases or lk.locked()}
@@ -0,0 +1,228 @@
+# early_warning.py
+# -*- coding: utf-8 -*-
+# Early Warning: แบบจำลองแนวโน้มจำนวนอุบัติการณ์รายเดือนของทุกรหัสพร้อมกัน
+#
+#   log E[y_it] = a_i + b_i * (t - t̄)      y_it ~ NegativeBinomial(μ_it, α_i)   (NB2: Var = μ + αμ²)
+#
+# - รหัสที่มีข้อมูลพอ: IRLS แบบ vectorized (ทุกรหัสใน numpy array เดียว, 2 พารามิเตอร์ → แก้ 2×2 แบบปิด)
+#   ประมาณ α ด้วย moment จาก Pearson residual แล้ว fit ซ้ำ
+# - method="glm": fit statsmodels GLM(NegativeBinomial) ทีละรหัสใน process pool (ช้ากว่า แต่เป็นค่าอ้างอิง)
+# - รหัสที่ข้อมูลบาง (sparse): สูตรปิด rate ratio ครึ่งหลัง/ครึ่งแรก (continuity 0.5) แทนการ fit
+# - น้อยกว่า 2 เดือน หรือเดือนที่เลือกไม่ต่อเนื่อง: ไม่มีแนวโน้ม (slope 0, p = 1) คาดการณ์ = อัตราเฉลี่ย × horizon
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+
+_ETA_CLIP = 30.0
+_erfc = np.frompyfunc(math.erfc, 1, 1)
+
+
+def _two_sided_p(z: np.ndarray) -> np.ndarray:
+    return _erfc(np.abs(z) / math.sqrt(2.0)).astype(float)
+
+
+def _month_axis(n_month: int) -> np.ndarray:
+    t = np.arange(n_month, dtype=float)
+    return t - t.mean()
+
+
+# =========================
+# Vectorized NB2 IRLS (ทุกรหัสพร้อมกัน)
+# =========================
+def _irls_batch(Y: np.ndarray, t: np.ndarray, alpha: np.ndarray, a: np.ndarray, b: np.ndarray,
+                max_iter: int = 50, tol: float = 1e-8):
+    """Newton/IRLS สำหรับ log μ = a + b t โดย α คงที่ต่อแถว — คืน (a, b, var_b, converged)"""
+    active = np.ones(len(Y), dtype=bool)
+    for _ in range(max_iter):
+        mu = np.exp(np.clip(a[:, None] + b[:, None] * t, -_ETA_CLIP, _ETA_CLIP))
+        w = mu / (1.0 + alpha[:, None] * mu)
+        r = (Y - mu) / mu
+        s0, s1, s2 = w.sum(1), (w * t).sum(1), (w * t * t).sum(1)
+        u0, u1 = (w * r).sum(1), (w * t * r).sum(1)
+        det = s0 * s2 - s1 * s1
+        det = np.where(det > 1e-12, det, np.nan)
+        da = np.nan_to_num((s2 * u0 - s1 * u1) / det)
+        db = np.nan_to_num((s0 * u1 - s1 * u0) / det)
+        da, db = np.where(active, da, 0.0), np.where(active, db, 0.0)
+        a, b = a + da, b + db
+        active = (np.abs(da) > tol) | (np.abs(db) > tol)
+        if not active.any():
+            break
+    mu = np.exp(np.clip(a[:, None] + b[:, None] * t, -_ETA_CLIP, _ETA_CLIP))
+    w = mu / (1.0 + alpha[:, None] * mu)
+    s0, s1, s2 = w.sum(1), (w * t).sum(1), (w * t * t).sum(1)
+    det = s0 * s2 - s1 * s1
+    var_b = np.where(det > 1e-12, s0 / np.where(det > 1e-12, det, 1.0), np.nan)
+    return a, b, var_b, ~active
+
+
+def _moment_alpha(Y: np.ndarray, a: np.ndarray, b: np.ndarray, t: np.ndarray) -> np.ndarray:
+    """α แบบ moment: mean[((y-μ)² - y) / μ²] (ตัดค่าติดลบเป็น 0 = Poisson)"""
+    mu = np.exp(np.clip(a[:, None] + b[:, None] * t, -_ETA_CLIP, _ETA_CLIP))
+    dof = max(1, Y.shape[1] - 2)
+    return np.clip((((Y - mu) ** 2 - Y) / mu ** 2).sum(1) / dof, 0.0, 1e3)
+
+
+def fit_nb_trend_batch(Y: np.ndarray, rounds: int = 2) -> dict:
+    """fit แนวโน้ม NB2 ให้ทุกแถวของ Y (n_code × n_month) พร้อมกัน"""
+    Y = np.asarray(Y, dtype=float)
+    t = _month_axis(Y.shape[1])
+    a = np.log(np.maximum(Y.mean(1), 1e-3))
+    b = np.zeros(len(Y))
+    alpha = np.zeros(len(Y))
+    a, b, var_b, conv = _irls_batch(Y, t, alpha, a, b)       # Poisson
+    for _ in range(rounds):
+        alpha = _moment_alpha(Y, a, b, t)
+        a, b, var_b, conv = _irls_batch(Y, t, alpha, a, b)   # NB2 ด้วย α ที่ประมาณได้
+    return {"intercept": a, "slope": b, "slope_se": np.sqrt(var_b), "alpha": alpha, "converged": conv}
+
+
+# =========================
+# สูตรปิดสำหรับรหัสที่ข้อมูลบาง
+# =========================
+def flat_trend(Y: np.ndarray) -> dict:
+    """ไม่ประมาณแนวโน้ม: intercept = log อัตราเฉลี่ยต่อเดือน, slope 0, SE ไม่มี (p = 1)"""
+    Y = np.asarray(Y, dtype=float)
+    n = Y.shape[1]
+    with np.errstate(divide="ignore"):
+        intercept = np.log(Y.sum(1) / n) if n else np.full(len(Y), -np.inf)
+    return {"intercept": intercept, "slope": np.zeros(len(Y)), "slope_se": np.full(len(Y), np.nan),
+            "alpha": np.full(len(Y), np.nan), "converged": np.ones(len(Y), dtype=bool)}
+
+
+def closed_form_trend(Y: np.ndarray) -> dict:
+    """log rate ratio ครึ่งหลัง/ครึ่งแรก ÷ ระยะห่างจุดกึ่งกลาง = slope ต่อเดือน (ไม่มีการวนซ้ำ)"""
+    Y = np.asarray(Y, dtype=float)
+    n = Y.shape[1]
+    h = n // 2
+    if h == 0:
+        return flat_trend(Y)  # เดือนเดียว: ครึ่งแรกว่าง เปรียบเทียบไม่ได้
+    n1, n2 = max(h, 1), max(n - h, 1)
+    c1, c2 = Y[:, :h].sum(1) + 0.5, Y[:, h:].sum(1) + 0.5
+    gap = max(n / 2.0, 1.0)
+    slope = np.log((c2 / n2) / (c1 / n1)) / gap
+    return {"intercept": np.log((Y.sum(1) + 0.5) / max(n, 1)), "slope": slope,
+            "slope_se": np.sqrt(1.0 / c1 + 1.0 / c2) / gap, "alpha": np.full(len(Y), np.nan),
+            "converged": np.ones(len(Y), dtype=bool)}
+
+
+# =========================
+# statsmodels GLM ทีละรหัส (process pool)
+# =========================
+def _glm_fit_block(Y_block: np.ndarray, alpha_block: np.ndarray):
+    import statsmodels.api as sm
+    t = _month_axis(Y_block.shape[1])
+    X = np.column_stack([np.ones_like(t), t])
+    out = np.full((len(Y_block), 3), np.nan)
+    for i, (y, alpha) in enumerate(zip(Y_block, alpha_block)):
+        try:
+            res = sm.GLM(y, X, family=sm.families.NegativeBinomial(alpha=max(float(alpha), 1e-8))).fit()
+            out[i] = (res.params[0], res.params[1], res.bse[1])
+        except Exception:
+            pass
+    return out
+
+
+def fit_glm_trend_pool(Y: np.ndarray, max_workers: int = None, block_size: int = 64) -> dict:
+    """
+    fit GLM(NB) ทีละรหัสด้วย statsmodels กระจายงานเป็นก้อนไปยัง ProcessPoolExecutor
+    process แบบ spawn (fork จาก server ที่มีหลาย thread อาจค้าง); pool ล้ม -> fit ก้อนที่เหลือใน process นี้
+    """
+    Y = np.asarray(Y, dtype=float)
+    alpha = fit_nb_trend_batch(Y)["alpha"]  # ใช้ α จาก batch เป็นค่าคงที่ของ family
+    blocks = [(Y[i:i + block_size], alpha[i:i + block_size]) for i in range(0, len(Y), block_size)]
+    workers = max_workers or os.cpu_count() or 1
+    parts = [None] * len(blocks)
+    if workers > 1 and len(blocks) > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=min(workers, len(blocks)),
+                                     mp_context=multiprocessing.get_context("spawn")) as ex:
+                futures = [ex.submit(_glm_fit_block, yb, ab) for yb, ab in blocks]
+                for i, f in enumerate(futures):
+                    parts[i] = f.result()
+        except (BrokenProcessPool, OSError):
+            pass
+    parts = [p if p is not None else _glm_fit_block(yb, ab) for p, (yb, ab) in zip(parts, blocks)]
+    est = np.vstack(parts) if parts else np.empty((0, 3))
+    return {"intercept": est[:, 0], "slope": est[:, 1], "slope_se": est[:, 2], "alpha": alpha,
+            "converged": ~np.isnan(est[:, 1])}
+
+
+# =========================
+# รวมทุกวิธี
+# =========================
+def fit_trends(Y: np.ndarray, method: str = "vectorized", min_total: int = 5, min_active_months: int = 3,
+               max_workers: int = None) -> pd.DataFrame:
+    """
+    แนวโน้มรายรหัสจากเมทริกซ์ Y (n_code × n_month)
+    รหัสที่ total < min_total หรือมีเดือนที่เกิด < min_active_months → สูตรปิด
+    method: "vectorized" (ค่าเริ่มต้น), "glm" (statsmodels ใน process pool) หรือ "flat" (ไม่ประมาณแนวโน้ม)
+    """
+    Y = np.asarray(Y, dtype=float)
+    n = len(Y)
+    cols = ["intercept", "slope", "slope_se", "alpha"]
+    out = pd.DataFrame(np.nan, index=range(n), columns=cols)
+    out["method"] = "closed_form"
+    if n == 0:
+        out["z"] = out["p_value"] = np.nan
+        return out
+    if method == "flat" or Y.shape[1] < 2:
+        flat = flat_trend(Y)
+        out[cols] = np.column_stack([flat[c] for c in cols])
+        out["method"] = "flat"
+        dense = np.zeros(n, dtype=bool)
+    else:
+        dense = (Y.sum(1) >= min_total) & ((Y > 0).sum(1) >= min_active_months) & (Y.shape[1] >= 4)
+        cf = closed_form_trend(Y[~dense])
+        out.loc[~dense, cols] = np.column_stack([cf[c] for c in cols])
+    if dense.any():
+        fit = fit_glm_trend_pool(Y[dense], max_workers=max_workers) if method == "glm" else fit_nb_trend_batch(Y[dense])
+        out.loc[dense, cols] = np.column_stack([fit[c] for c in cols])
+        out.loc[dense, "method"] = "nb_glm" if method == "glm" else "nb"
+        # fit ไม่ลู่เข้า / SE ใช้ไม่ได้ → ถอยไปใช้สูตรปิด
+        bad = dense & ~np.isfinite(out["slope_se"].to_numpy())
+        if bad.any():
+            cf_bad = closed_form_trend(Y[bad])
+            out.loc[bad, cols] = np.column_stack([cf_bad[c] for c in cols])
+            out.loc[bad, "method"] = "closed_form"
+    out["z"] = out["slope"] / out["slope_se"]
+    out["p_value"] = _two_sided_p(out["z"].fillna(0.0).to_numpy())  # ไม่มี SE -> z = 0 -> p = 1
+    return out
+
+
+def forecast_counts(trend: pd.DataFrame, n_month: int, horizon: int) -> np.ndarray:
+    """ผลรวมจำนวนที่คาดว่าจะเกิดใน horizon เดือนถัดไป"""
+    t_future = np.arange(n_month, n_month + max(1, horizon), dtype=float) - (n_month - 1) / 2.0
+    eta = trend["intercept"].to_numpy()[:, None] + trend["slope"].to_numpy()[:, None] * t_future
+    return np.exp(np.clip(eta, -_ETA_CLIP, np.log(1e6))).sum(1)
+
+
+def rank_early_warning(Y: np.ndarray, codes, names, avg_risk, severe_share, horizon: int = 3,
+                       w_freq: float = 0.34, w_sev: float = 0.33, w_trend: float = 0.33,
+                       method: str = "vectorized") -> pd.DataFrame:
+    """
+    จัดลำดับความสำคัญ = w_freq·(คาดการณ์/สูงสุด) + w_sev·(ความเสี่ยงเฉลี่ย/สูงสุด) + w_trend·(1-p ถ้าแนวโน้มขึ้น)
+    คอลัมน์ของ Y ต้องเป็นเดือนต่อเนื่อง — ถ้าไม่ใช่ ให้ใช้ method="flat"
+    """
+    Y = np.asarray(Y, dtype=float)
+    trend = fit_trends(Y, method=method)
+    forecast = forecast_counts(trend, Y.shape[1], horizon)
+    avg_risk = np.asarray(avg_risk, dtype=float)
+    severe_share = np.asarray(severe_share, dtype=float)
+    slope = trend["slope"].to_numpy()
+    trend_component = np.where(slope > 0, 1.0 - trend["p_value"].to_numpy(), 0.0)
+    res = pd.DataFrame({
+        'รหัส': np.asarray(codes), 'ชื่ออุบัติการณ์ความเสี่ยง': np.asarray(names),
+        'total': Y.sum(1).astype(int), 'avg_risk': avg_risk,
+        'trend_irr': np.exp(slope), 'p_value': trend["p_value"].to_numpy(), 'model': trend["method"].to_numpy(),
+        'forecast': forecast, 'forecast_severe': forecast * np.nan_to_num(severe_share),
+    })
+    res['score'] = (w_freq * forecast / max(1e-9, forecast.max())
+                    + w_sev * np.nan_to_num(avg_risk) / max(1e-9, np.nanmax(avg_risk) if len(avg_risk) else 1.0)
+                    + w_trend * trend_component)
+    return res.sort_values('score', ascending=False, kind='stable').reset_index(drop=True)
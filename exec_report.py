@@ -0,0 +1,353 @@
+# exec_report.py
+# -*- coding: utf-8 -*-
+# รายงาน "บทสรุปสำหรับผู้บริหาร" แบบสร้างล่วงหน้า: HTML ไฟล์เดียว (CSS ในตัว) + XLSX หลายชีต (ไม่ใช้ Streamlit)
+#
+#   paths = cached_report(dataset_version, filters, lambda: build_exec_summary(df, REFERENCE, cube_view, tab))
+#   paths.html.read_text(...) / paths.xlsx
+#
+# - คำนวณทุกส่วนของหน้าครั้งเดียวต่อ (เวอร์ชันข้อมูล, ตัวกรอง) แล้วเก็บเป็นไฟล์ใน REPORT_DIR
+#   เปิดหน้าเดิมด้วยตัวกรองเดิมอีกครั้ง = อ่านไฟล์ ไม่ต้องคำนวณ/วาด element ใหม่ทั้งหน้า
+# - schedule_prewarm() สร้างรายงานของปีงบล่าสุดและแต่ละไตรมาสใน thread พื้นหลัง หลังโหลดชุดข้อมูลใหม่
+# - เปลี่ยนรูปแบบรายงานเมื่อไร ให้เพิ่ม REPORT_FORMAT_VERSION (ไฟล์เดิมจะไม่ถูกใช้อีก)
+import hashlib
+import html
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from atomic_files import prune_files, write_atomic
+from export_engine import write_xlsx
+from filter_warmup import ALL, filter_tuple, compute_aggregates, default_filters
+from incident_pipeline import (FLAG_PSG9, FLAG_SENTINEL, FLAG_SEVERE, FLAG_UNRESOLVED, flag_counts, flag_mask,
+                               goal_definitions, create_psg9_summary_table, create_goal_summary_table,
+                               persistence_risk_from_cube, prioritize_incidents_nb_logit_v2)
+from reference_data import normalize_goal_label
+from severity_tab import build_severity_tab
+
+REPORT_DIR = Path(tempfile.gettempdir()) / "hoiarr_reports"
+REPORT_FORMAT_VERSION = 2
+REPORT_MAX_AGE = 7 * 24 * 3600  # วินาที — ไฟล์ที่ไม่ถูกเปิดนานกว่านี้ถูกลบตอนสร้างรายงานใหม่
+HTML_LIST_LIMIT = 200           # รายการ Sentinel / รุนแรงยังไม่แก้ไข ใน HTML (XLSX มีครบทุกแถว)
+
+IMPACT_LABELS = {'5': "5 (Extreme)", '4': "4 (Major)", '3': "3 (Moderate)", '2': "2 (Minor)", '1': "1 (Insignificant)"}
+FREQ_LABELS = {'1': "F1", '2': "F2", '3': "F3", '4': "F4", '5': "F5"}
+LIST_COLUMNS = {'Occurrence Date': "วันที่เกิด", 'Incident': "รหัส", 'Impact': "ระดับ",
+                'รายละเอียดการเกิด_Anonymized': "รายละเอียด"}
+
+
+@dataclass
+class ExecSummary:
+    """ผลคำนวณทุกส่วนของหน้าบทสรุปผู้บริหาร (ตารางเป็น DataFrame ที่ตั้งชื่อคอลัมน์สำหรับแสดงแล้ว)"""
+    title: str
+    period: str                      # "dd/mm/yyyy ถึง dd/mm/yyyy (รวม n เดือน)"
+    metrics: dict                    # ชื่อตัวชี้วัด -> int หรือ "N/A"
+    risk_matrix: pd.DataFrame
+    top10: pd.DataFrame
+    sentinel: pd.DataFrame | None    # None = ไม่มีไฟล์นิยาม Sentinel
+    psg9: pd.DataFrame
+    unresolved: pd.DataFrame | None  # None = ข้อมูลไม่มีคอลัมน์ 'Resulting Actions'
+    goals: dict = field(default_factory=dict)  # ชื่อหมวดที่แสดง -> DataFrame
+    early_warning: pd.DataFrame = None
+    persistence: pd.DataFrame = None
+
+
+class ReportPaths(NamedTuple):
+    html: Path
+    xlsx: Path
+
+
+# =========================
+# ตัวกรอง -> key / ข้อความ / ข้อมูลตามตัวกรอง
+# =========================
+def report_key(dataset_version, filters: dict) -> str:
+    return hashlib.sha1(repr((REPORT_FORMAT_VERSION, dataset_version, filter_tuple(filters))).encode()).hexdigest()
+
+
+def describe_filters(filters: dict) -> str:
+    f = dict(filter_tuple(filters))
+    mode = f["mode"] or "ทั้งหมด"
+    parts = ["ทุกช่วงเวลา" if mode == "ทั้งหมด" or f["fy"] in (None, ALL) else f"ปีงบประมาณ {f['fy']}"]
+    if mode == "รายไตรมาส" and f["fq"] not in (None, ALL):
+        parts.append(f["fq"])
+    if mode == "รายเดือน" and f["m"] not in (None, ALL):
+        parts.append(f"เดือน {f['m']}")
+    if f["group"] not in (None, "", ALL, "-- เลือกกลุ่มงาน --"):
+        parts.append(f"กลุ่มงาน {f['group']}")
+    if f["unit"] not in (None, "", ALL):
+        parts.append(f"หน่วยงาน {f['unit']}")
+    if f["hospital"]:
+        parts.append("โรงพยาบาล " + ", ".join(f["hospital"]))
+    return " · ".join(parts)
+
+
+def filtered_view(df: pd.DataFrame, cube, filters: dict):
+    """ข้อมูล + (cube, series_mask, month_mask) + FilterAggregates ตามตัวกรอง — ผลเดียวกับตัวกรองหลักในแอป"""
+    f = filters
+    aggs = compute_aggregates(df, f)
+    view = (cube, cube.series_mask(f.get("group"), f.get("unit"), f.get("hospital")),
+            cube.month_mask(f.get("mode", "ทั้งหมด"), f.get("fy"), f.get("fq"), f.get("m")))
+    return df.take(aggs.rows), view, aggs
+
+
+# =========================
+# คำนวณเนื้อหารายงาน
+# =========================
+def _period(df: pd.DataFrame) -> tuple:
+    """(ข้อความช่วงข้อมูล, จำนวนเดือน) จาก 'Occurrence Date'"""
+    lo, hi = df['Occurrence Date'].min(), df['Occurrence Date'].max()
+    if pd.isna(lo) or pd.isna(hi):
+        return "N/A ถึง N/A (รวม 0 เดือน)", 0
+    months = max(1, (hi.year - lo.year) * 12 + (hi.month - lo.month) + 1)
+    return f"{lo:%d/%m/%Y} ถึง {hi:%d/%m/%Y} (รวม {months} เดือน)", months
+
+
+def _incident_list(df: pd.DataFrame, rows: np.ndarray) -> pd.DataFrame:
+    cols = [c for c in LIST_COLUMNS if c in df.columns]
+    return df.iloc[rows][cols].rename(columns=LIST_COLUMNS).reset_index(drop=True)
+
+
+def build_exec_summary(df: pd.DataFrame, reference, cube_view=None, tab=None, filters: dict = None,
+                       rollup=None) -> ExecSummary:
+    """
+    คำนวณทุกส่วนของบทสรุปผู้บริหารจากข้อมูลที่กรองแล้ว
+    reference = ReferenceData, cube_view = (cube, series_mask, month_mask) ของตัวกรองเดียวกัน,
+    tab = SeverityTab, rollup = GoalRollup ของ df (ไม่ส่งมาจะนับเอง)
+    """
+    period, total_month = _period(df)
+    n_psg9, n_sentinel, n_severe, n_severe_unresolved = flag_counts(
+        df, FLAG_PSG9, FLAG_SENTINEL, FLAG_SEVERE, FLAG_SEVERE | FLAG_UNRESOLVED)
+    has_actions = 'Resulting Actions' in df.columns
+    metrics = {"อุบัติการณ์ทั้งหมด": len(df), "Sentinel Events": n_sentinel, "มาตรฐานสำคัญฯ 9 ข้อ": n_psg9,
+               "ความรุนแรงสูง (E-I & 3-5)": n_severe,
+               "รุนแรงสูง & ยังไม่แก้ไข": n_severe_unresolved if has_actions else "N/A"}
+
+    # Risk Matrix (Impact 5->1 × Frequency 1->5)
+    impact_keys, freq_keys = list(IMPACT_LABELS), list(FREQ_LABELS)
+    in_matrix = df['Impact Level'].isin(impact_keys) & df['Frequency Level'].isin(freq_keys)
+    matrix = pd.crosstab(df.loc[in_matrix, 'Impact Level'], df.loc[in_matrix, 'Frequency Level'])
+    matrix = matrix.reindex(index=impact_keys, columns=freq_keys, fill_value=0)
+    matrix = matrix.rename(index=IMPACT_LABELS, columns=FREQ_LABELS).rename_axis(index="Impact", columns=None)
+
+    # Top 10 ตามความถี่ (ชื่อ = ชื่อแรกของแต่ละรหัส)
+    top10 = df['Incident'].value_counts().head(10)
+    names = (df.loc[df['Incident'].isin(top10.index)].groupby('Incident', observed=True)['ชื่ออุบัติการณ์ความเสี่ยง']
+             .first() if 'ชื่ออุบัติการณ์ความเสี่ยง' in df.columns else pd.Series(dtype=object))
+    top10 = pd.DataFrame({"รหัส": top10.index.astype(str), "ชื่ออุบัติการณ์": names.reindex(top10.index).to_numpy(),
+                          "จำนวน": top10.to_numpy()})
+
+    sentinel = (_incident_list(df, np.flatnonzero(flag_mask(df, FLAG_SENTINEL)))
+                if reference.sentinel_keys else None)
+    unresolved = (_incident_list(df, np.flatnonzero(flag_mask(df, FLAG_SEVERE | FLAG_UNRESOLVED)))
+                  if has_actions else None)
+
+    tab = tab if tab is not None else build_severity_tab(df)
+    psg9 = create_psg9_summary_table(df, reference.psg9_label_dict, tab=tab)
+
+    goals = {}
+    if {'หมวด', 'ประเภท', 'ระดับความรุนแรง'} <= set(df.columns):
+        tables = create_goal_summary_table(df, reference.code_mapping, reference.goal_type_order, rollup)
+        goals = {display: tables.get(normalize_goal_label(cat), pd.DataFrame())
+                 for display, cat in goal_definitions.items()}
+
+    early = prioritize_incidents_nb_logit_v2(df, horizon=3, cube_view=cube_view)
+    if not early.empty:
+        early = early.head(5).rename(columns={'ชื่ออุบัติการณ์ความเสี่ยง': 'ชื่ออุบัติการณ์',
+                                              'forecast_severe': 'คาดการณ์เหตุรุนแรง (3 ด.)',
+                                              'score': 'คะแนนความสำคัญ'})
+        early = early[['รหัส', 'ชื่ออุบัติการณ์', 'คาดการณ์เหตุรุนแรง (3 ด.)', 'คะแนนความสำคัญ']].reset_index(drop=True)
+
+    persistence = (persistence_risk_from_cube(*cube_view, total_month) if cube_view is not None
+                   else pd.DataFrame())
+    if not persistence.empty:
+        persistence = persistence.head(5).rename(columns={'Persistence_Risk_Score': 'ดัชนีความเรื้อรัง',
+                                                          'Average_Ordinal_Risk_Score': 'คะแนนเสี่ยงเฉลี่ย'})
+        persistence = persistence[['รหัส', 'ชื่ออุบัติการณ์ความเสี่ยง', 'คะแนนเสี่ยงเฉลี่ย',
+                                   'ดัชนีความเรื้อรัง']].reset_index(drop=True)
+
+    title = "รายงานสรุปอุบัติการณ์โรงพยาบาล"
+    if filters is not None:
+        title += f" — {describe_filters(filters)}"
+    return ExecSummary(title=title, period=period, metrics=metrics, risk_matrix=matrix, top10=top10,
+                       sentinel=sentinel, psg9=psg9 if psg9 is not None else pd.DataFrame(), unresolved=unresolved,
+                       goals=goals, early_warning=early, persistence=persistence)
+
+
+# =========================
+# HTML / XLSX
+# =========================
+_CSS = """
+body{font-family:'Sarabun','Tahoma',sans-serif;font-size:14px;color:#1f2937;margin:16px;line-height:1.5}
+h1{font-size:20px;color:#001f3f;margin:0 0 4px} h2{font-size:17px;color:#001f3f;margin:28px 0 8px;
+border-bottom:2px solid #e5e7eb;padding-bottom:4px} h3{font-size:15px;margin:16px 0 6px}
+.meta{color:#4b5563;margin:2px 0} .note{color:#6b7280;font-size:13px;margin:6px 0}
+.cards{display:flex;flex-wrap:wrap;gap:10px} .card{flex:1 1 150px;background:#f0f2f6;border-radius:8px;padding:10px 12px}
+.card .v{font-size:24px;font-weight:bold;color:#001f3f} .card .k{font-size:13px;color:#4b5563}
+.row{display:flex;flex-wrap:wrap;gap:24px} .row>div{flex:1 1 360px;min-width:0}
+table{border-collapse:collapse;width:100%;margin:4px 0 8px} th,td{padding:5px 8px;border-bottom:1px solid #e5e7eb;
+text-align:left;vertical-align:top} th{background:#f0f2f6} td.n{text-align:right;white-space:nowrap}
+@media print{body{margin:0} h2{page-break-after:avoid} table{page-break-inside:auto}}
+"""
+
+
+def _cell(v) -> str:
+    if v is None or (not isinstance(v, str) and pd.isna(v)):
+        return "<td></td>"
+    if isinstance(v, pd.Timestamp):
+        return f"<td>{v:%d/%m/%Y %H:%M}</td>"
+    if isinstance(v, (int, np.integer)):
+        return f"<td class='n'>{v:,}</td>"
+    if isinstance(v, (float, np.floating)):
+        return f"<td class='n'>{v:,.2f}</td>" if v != int(v) else f"<td class='n'>{int(v):,}</td>"
+    return f"<td>{html.escape(str(v))}</td>"
+
+
+def _table(df: pd.DataFrame, limit: int = None) -> str:
+    """ตาราง HTML (escape ข้อความทุกเซลล์) — index ที่ไม่ใช่ RangeIndex แสดงเป็นคอลัมน์แรก"""
+    if not isinstance(df.index, pd.RangeIndex):
+        df = df.reset_index()
+    shown = df if limit is None else df.head(limit)
+    head = "".join(f"<th>{html.escape(str(c))}</th>" for c in shown.columns)
+    body = "".join("<tr>" + "".join(_cell(v) for v in row) + "</tr>"
+                   for row in shown.astype(object).itertuples(index=False, name=None))
+    out = f"<table><thead><tr>{head}</tr></thead><tbody>{body}</tbody></table>"
+    if limit is not None and len(df) > limit:
+        out += f"<p class='note'>แสดง {limit:,} จาก {len(df):,} รายการ — รายการทั้งหมดอยู่ในไฟล์ Excel</p>"
+    return out
+
+
+def _section(title: str, table: pd.DataFrame, empty_text: str, limit: int = None) -> str:
+    body = _table(table, limit) if table is not None and not table.empty else f"<p class='note'>{empty_text}</p>"
+    return f"<h2>{html.escape(title)}</h2>{body}"
+
+
+def render_html(s: ExecSummary) -> str:
+    """เอกสาร HTML ไฟล์เดียว (ไม่มีไฟล์/สคริปต์ภายนอก) เปิดในเบราว์เซอร์หรือพิมพ์ได้โดยตรง"""
+    cards = "".join(f"<div class='card'><div class='v'>{v:,}</div><div class='k'>{html.escape(k)}</div></div>"
+                    if isinstance(v, int) else
+                    f"<div class='card'><div class='v'>{html.escape(str(v))}</div><div class='k'>{html.escape(k)}</div></div>"
+                    for k, v in s.metrics.items())
+    parts = [f"<h1>{html.escape(s.title)}</h1>",
+             f"<p class='meta'><b>ช่วงข้อมูลที่วิเคราะห์:</b> {html.escape(s.period)}</p>",
+             f"<p class='meta'><b>จำนวนอุบัติการณ์ที่พบทั้งหมด:</b> {s.metrics['อุบัติการณ์ทั้งหมด']:,} รายการ</p>",
+             f"<h2>1. แดชบอร์ดสรุปภาพรวม</h2><div class='cards'>{cards}</div>",
+             "<h2>2. Risk Matrix และ Top 10 อุบัติการณ์</h2><div class='row'>"
+             f"<div><h3>Risk Matrix</h3>{_table(s.risk_matrix)}</div>"
+             f"<div><h3>Top 10 อุบัติการณ์ (ตามความถี่)</h3>"
+             f"{_table(s.top10) if not s.top10.empty else '<p class=note>ไม่มีข้อมูล Top 10</p>'}</div></div>"]
+    if s.sentinel is None:
+        parts.append("<h2>3. รายการ Sentinel Events</h2><p class='note'>ตรวจสอบ Sentinel ไม่ได้ (ไม่มีไฟล์นิยาม)</p>")
+    else:
+        parts.append(_section("3. รายการ Sentinel Events", s.sentinel,
+                              "ไม่พบ Sentinel Events ในช่วงเวลาที่เลือก", HTML_LIST_LIMIT))
+    parts.append(_section("4. วิเคราะห์ตามหมวดหมู่ มาตรฐานสำคัญจำเป็นต่อความปลอดภัย 9 ข้อ", s.psg9,
+                          "ไม่พบข้อมูลอุบัติการณ์ที่เกี่ยวข้องกับ PSG9 ในช่วงเวลานี้"))
+    if s.unresolved is not None:
+        parts.append(_section("5. รายการอุบัติการณ์รุนแรง (E-I & 3-5) ที่ยังไม่ถูกแก้ไข", s.unresolved,
+                              "ไม่พบอุบัติการณ์รุนแรงที่ยังไม่ถูกแก้ไขในช่วงเวลานี้", HTML_LIST_LIMIT))
+    parts.append("<h2>6. สรุปอุบัติการณ์ตามเป้าหมาย Safety Goals</h2>")
+    for display, table in s.goals.items():
+        parts.append(f"<h3>{html.escape(display)}</h3>" + (
+            _table(table) if not table.empty else f"<p class='note'>ไม่มีข้อมูลสำหรับ '{html.escape(display)}'</p>"))
+    parts.append(_section("7. Early Warning: อุบัติการณ์ที่มีแนวโน้มสูงขึ้น (Top 5)", s.early_warning,
+                          "ไม่มีข้อมูลเพียงพอสำหรับวิเคราะห์ Early Warning"))
+    parts.append(_section("8. สรุปอุบัติการณ์ที่เป็นปัญหาเรื้อรัง (Persistence Risk - Top 5)", s.persistence,
+                          "ไม่มีข้อมูลเพียงพอสำหรับวิเคราะห์ความเสี่ยงเรื้อรัง"))
+    parts.append(f"<p class='note'>สร้างเมื่อ {time.strftime('%d/%m/%Y %H:%M')}</p>")
+    return ("<!DOCTYPE html><html lang='th'><head><meta charset='utf-8'>"
+            f"<title>{html.escape(s.title)}</title><style>{_CSS}</style></head><body>"
+            + "".join(parts) + "</body></html>")
+
+
+def report_sheets(s: ExecSummary) -> dict:
+    """ชีตของ XLSX: สรุป (ตัวชี้วัด) + ตารางทุกส่วน (รายการ Sentinel / รุนแรงยังไม่แก้ไข ครบทุกแถว)"""
+    overview = pd.DataFrame({"หัวข้อ": ["เรื่อง", "ช่วงข้อมูลที่วิเคราะห์", *s.metrics],
+                             "ค่า": [s.title, s.period, *s.metrics.values()]})
+    sheets = {"สรุป": overview, "Risk Matrix": s.risk_matrix, "Top 10": s.top10}
+    if s.sentinel is not None:
+        sheets["Sentinel Events"] = s.sentinel
+    sheets["PSG9"] = s.psg9
+    if s.unresolved is not None:
+        sheets["รุนแรงยังไม่แก้ไข"] = s.unresolved
+    sheets.update(s.goals)
+    sheets["Early Warning"] = s.early_warning
+    sheets["Persistence"] = s.persistence
+    return sheets
+
+
+# =========================
+# แคชบนดิสก์
+# =========================
+_locks_guard = threading.Lock()
+_build_locks = {}  # report key -> Lock (สองคำขอของ key เดียวกัน สร้างครั้งเดียว)
+
+
+def report_paths(dataset_version, filters: dict, out_dir=REPORT_DIR) -> ReportPaths:
+    key = report_key(dataset_version, filters)
+    return ReportPaths(Path(out_dir) / f"report-{key}.html", Path(out_dir) / f"report-{key}.xlsx")
+
+
+def cached_report(dataset_version, filters: dict, build, out_dir=REPORT_DIR) -> ReportPaths:
+    """
+    คืนไฟล์รายงานของ (dataset_version, filters) — มีอยู่แล้วใช้ไฟล์เดิม, ไม่มีเรียก build() -> ExecSummary แล้วเขียน
+    build เรียกเฉพาะตอนยังไม่มีไฟล์ (ส่ง lambda ที่คำนวณจริงมา)
+    """
+    paths = report_paths(dataset_version, filters, out_dir)
+    with _locks_guard:
+        lock = _build_locks.setdefault(paths.html.name, threading.Lock())
+    with lock:
+        if paths.html.is_file() and paths.xlsx.is_file():
+            now = time.time()
+            for p in paths:
+                os.utime(p, (now, now))  # ถูกเปิดล่าสุด -> ไม่ถูก prune
+            return paths
+        paths.html.parent.mkdir(parents=True, exist_ok=True)
+        prune_files(out_dir, "report-*", REPORT_MAX_AGE)
+        summary = build()
+        write_atomic(paths.xlsx, lambda p: write_xlsx(report_sheets(summary), p))
+        write_atomic(paths.html, lambda p: p.write_text(render_html(summary), encoding="utf-8"))
+    return paths
+
+
+# =========================
+# สร้างล่วงหน้าหลังโหลดข้อมูล
+# =========================
+def prewarm_filters(cube) -> list:
+    """ตัวกรองที่สร้างรายงานรอไว้: ปีงบล่าสุดในข้อมูล (ทั้งปี) + แต่ละไตรมาสของปีนั้นที่มีข้อมูล"""
+    periods = [f for f in default_filters(cube, []) if f["mode"] != "ทั้งหมด"]
+    return [f for f in periods if f["fy"] == periods[0]["fy"]] if periods else []
+
+
+def prewarm_reports(df: pd.DataFrame, reference, cube, dataset_version, out_dir=REPORT_DIR) -> int:
+    """สร้างรายงานของ prewarm_filters() ที่ยังไม่มีในแคช — คืนจำนวนตัวกรองที่ทำสำเร็จ (ข้ามตัวที่ผิดพลาด)"""
+    done = 0
+    for filters in prewarm_filters(cube):
+        try:
+            def build():
+                sub, view, aggs = filtered_view(df, cube, filters)
+                return build_exec_summary(sub, reference, view, aggs.tab, filters, aggs.goals)
+            cached_report(dataset_version, filters, build, out_dir)
+            done += 1
+        except Exception:
+            pass  # งานพื้นหลัง: ตัวกรองที่สร้างไม่ได้ จะคำนวณตอนเปิดหน้าแทน
+    return done
+
+
+_prewarm_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hoiarr-report")
+_prewarmed = set()
+
+
+def schedule_prewarm(df: pd.DataFrame, reference, cube, dataset_version, out_dir=REPORT_DIR):
+    """ส่ง prewarm_reports() เข้า thread พื้นหลัง ครั้งเดียวต่อ dataset_version ต่อ process (คืน Future หรือ None)"""
+    with _locks_guard:
+        if dataset_version is None or dataset_version in _prewarmed:
+            return None
+        _prewarmed.add(dataset_version)
+    return _prewarm_pool.submit(prewarm_reports, df, reference, cube, dataset_version, out_dir)
@@ -0,0 +1,179 @@
+# export_engine.py
+# -*- coding: utf-8 -*-
+# ส่งออกผลลัพธ์ที่กรองแล้วเป็นไฟล์ CSV / Parquet / XLSX หลายชีต (ไม่ใช้ Streamlit)
+#
+# - เขียนลงไฟล์ชั่วคราวทีละช่วงแถว (chunk_rows) — ไม่สร้างสตริง CSV / bytes ของทั้งชุดในหน่วยความจำ
+# - XLSX ใช้ xlsxwriter โหมด constant_memory (เขียนทีละแถว ไม่เก็บทั้งชีตไว้ก่อน)
+#   ชีต: ข้อมูลดิบ + ตาราง PSG9 / รายรหัส / Safety Goals (ตารางสรุปเล็ก คำนวณจาก severity tab ที่มีอยู่แล้ว)
+# - ฝั่งแอปเรียก export_filtered() เมื่อผู้ใช้กดเตรียมไฟล์เท่านั้น ไม่ใช่ทุก rerun
+import os
+import re
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from atomic_files import prune_files
+from incident_pipeline import create_psg9_summary_table, create_summary_table_by_code, create_goal_summary_table
+from incident_store import to_arrow_safe
+
+EXPORT_COLUMNS = [
+    'เลขที่รับ', 'หน่วยงาน', 'วัน-เวลา ที่รายงาน', 'สถานที่เกิดเหตุ',
+    'Occurrence Date', 'Incident', 'ชื่ออุบัติการณ์ความเสี่ยง', 'Impact', 'Impact Level',
+    'Frequency Level', 'Risk Level', 'Category Color', 'กลุ่มงาน', 'หมวด',
+    'รายละเอียดการเกิด', 'Resulting Actions', 'หน่วยงาน_norm',
+    'FY_int', 'FQuarter', 'FY_Quarter',
+    'รหัส',
+]
+# รูปแบบ -> (นามสกุลไฟล์, mime)
+EXPORT_FORMATS = {
+    "csv": (".csv", "text/csv"),
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+    "xlsx": (".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+EXPORT_DIR = Path(tempfile.gettempdir()) / "hoiarr_exports"
+EXPORT_MAX_AGE = 3600  # วินาที
+CHUNK_ROWS = 50_000
+XLSX_MAX_ROWS = 1_048_576  # รวมแถวหัวตาราง
+_SHEET_BAD_CHARS = re.compile(r"[\[\]:*?/\\]")
+
+
+def export_columns(df: pd.DataFrame) -> list:
+    return [c for c in EXPORT_COLUMNS if c in df.columns]
+
+
+def _chunks(df: pd.DataFrame, chunk_rows: int):
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def write_csv(df: pd.DataFrame, path, chunk_rows: int = CHUNK_ROWS) -> int:
+    """CSV แบบ utf-8-sig (Excel เปิดภาษาไทยได้) เขียนทีละช่วงแถว — ผลลัพธ์เหมือน df.to_csv(index=False) ทุกไบต์"""
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        if df.empty:
+            df.to_csv(f, index=False)
+        for i, chunk in enumerate(_chunks(df, chunk_rows)):
+            chunk.to_csv(f, index=False, header=(i == 0))
+    return len(df)
+
+
+def write_parquet(df: pd.DataFrame, path, chunk_rows: int = CHUNK_ROWS) -> int:
+    """Parquet ทีละ row group (คอลัมน์ object ปนชนิดแปลงเป็นข้อความแบบเดียวกับ store)"""
+    writer = None
+    try:
+        for chunk in _chunks(df, chunk_rows) if len(df) else [df]:
+            table = pa.Table.from_pandas(to_arrow_safe(chunk), preserve_index=False)
+            if writer is None:
+                # ช่วงแรกที่คอลัมน์ข้อความว่างทั้งหมดได้ชนิด null -> ใช้ string เพื่อให้ทุก row group schema เดียวกัน
+                schema = pa.schema([f.with_type(pa.string()) if pa.types.is_null(f.type) else f for f in table.schema],
+                                   metadata=table.schema.metadata)
+                writer = pq.ParquetWriter(path, schema)
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+    return len(df)
+
+
+def _sheet_name(name: str, used: set) -> str:
+    """ชื่อชีตที่ Excel รับได้ (ไม่เกิน 31 ตัวอักษร ไม่มี []:*?/\\ ไม่ซ้ำ)"""
+    base = _SHEET_BAD_CHARS.sub(" ", str(name)).strip()[:31] or "Sheet"
+    out, n = base, 2
+    while out.lower() in used:
+        suffix = f" ({n})"
+        out, n = base[:31 - len(suffix)] + suffix, n + 1
+    used.add(out.lower())
+    return out
+
+
+def _cell_rows(chunk: pd.DataFrame):
+    """แถวของ chunk เป็น tuple ค่า Python (ค่าว่าง -> None ให้ xlsxwriter เว้นเซลล์)"""
+    values = chunk.astype(object)
+    return values.where(chunk.notna(), None).itertuples(index=False, name=None)
+
+
+def _new_sheet(workbook, name: str, header: list, header_format):
+    sheet = workbook.add_worksheet(name)
+    sheet.write_row(0, 0, header, header_format)
+    sheet.freeze_panes(1, 0)
+    return sheet
+
+
+def write_xlsx(sheets: dict, path, chunk_rows: int = CHUNK_ROWS) -> int:
+    """
+    sheets: ชื่อชีต -> DataFrame (index ที่ไม่ใช่ RangeIndex เขียนเป็นคอลัมน์แรก)
+    ชีตที่ยาวเกินขีดจำกัดของ Excel แบ่งต่อเป็น "ชื่อ (2)", "ชื่อ (3)" ...  คืนค่าจำนวนแถวข้อมูลที่เขียน
+    """
+    import xlsxwriter
+
+    rows_written, used = 0, set()
+    workbook = xlsxwriter.Workbook(str(path), {"constant_memory": True, "nan_inf_to_errors": True,
+                                               "default_date_format": "dd/mm/yyyy hh:mm", "strings_to_urls": False})
+    header_format = workbook.add_format({"bold": True})
+    try:
+        for name, frame in sheets.items():
+            frame = frame if frame is not None else pd.DataFrame()
+            if not isinstance(frame.index, pd.RangeIndex):
+                frame = frame.reset_index()
+            header = [str(c) for c in frame.columns]
+            sheet, row = None, 0
+            for chunk in _chunks(frame, chunk_rows) if len(frame) else [frame]:
+                for values in _cell_rows(chunk):
+                    if sheet is None or row == XLSX_MAX_ROWS:
+                        sheet, row = _new_sheet(workbook, _sheet_name(name, used), header, header_format), 1
+                    sheet.write_row(row, 0, values)
+                    row += 1
+                rows_written += len(chunk)
+            if sheet is None:  # ตารางว่าง: มีชีตพร้อมหัวตาราง
+                _new_sheet(workbook, _sheet_name(name, used), header, header_format)
+    finally:
+        workbook.close()
+    return rows_written
+
+
+def summary_sheets(df: pd.DataFrame, psg9_label_dict: dict = None, code_mapping: pd.DataFrame = None,
+                   type_order: dict = None, tab=None, rollup=None) -> dict:
+    """ตารางสรุปสำหรับชีตเพิ่มเติมใน XLSX: PSG9, รายรหัส และ Safety Goals 4 หมวด (ข้ามตารางที่ข้อมูลไม่พอ)"""
+    sheets = {}
+    psg9 = create_psg9_summary_table(df, psg9_label_dict, tab=tab)
+    if psg9 is not None and not psg9.empty:
+        sheets["PSG9"] = psg9
+    if {'รหัส', 'ชื่ออุบัติการณ์ความเสี่ยง', 'Impact'} <= set(df.columns):
+        by_code = create_summary_table_by_code(df, tab=tab)
+        if not by_code.empty:
+            sheets["สรุปตามรหัส"] = by_code
+    if code_mapping is not None and {'หมวด', 'ประเภท', 'ระดับความรุนแรง'} <= set(df.columns):
+        for goal, table in create_goal_summary_table(df, code_mapping, type_order, rollup).items():
+            if not table.empty:
+                sheets[goal] = table
+    return sheets
+
+
+def export_filtered(df: pd.DataFrame, fmt: str, out_dir=EXPORT_DIR, summaries: dict = None,
+                    chunk_rows: int = CHUNK_ROWS) -> Path:
+    """
+    เขียนผลลัพธ์ที่กรองแล้ว (เฉพาะ EXPORT_COLUMNS) เป็นไฟล์ชั่วคราวใน out_dir แล้วคืน path
+    fmt: 'csv' / 'parquet' / 'xlsx' (xlsx = ชีตข้อมูล + summaries จาก summary_sheets())
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"ไม่รองรับรูปแบบ '{fmt}' (ใช้ได้: {', '.join(EXPORT_FORMATS)})")
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    prune_files(out_dir, "export-*", EXPORT_MAX_AGE)  # ไฟล์ของ session ที่ปิดไปแล้ว
+    fd, name = tempfile.mkstemp(prefix="export-", suffix=EXPORT_FORMATS[fmt][0], dir=out_dir)
+    os.close(fd)
+    path = Path(name)
+    data = df[export_columns(df)]
+    try:
+        if fmt == "csv":
+            write_csv(data, path, chunk_rows)
+        elif fmt == "parquet":
+            write_parquet(data, path, chunk_rows)
+        else:
+            write_xlsx({"ข้อมูล": data, **(summaries or {})}, path, chunk_rows)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return path
@@ -0,0 +1,237 @@
+# filter_warmup.py
+# -*- coding: utf-8 -*-
+# อุ่นผลของตัวกรองที่ใช้บ่อยไว้ล่วงหน้าหลังโหลดชุดข้อมูล (ไม่ใช้ Streamlit)
+#
+#   warm = FilterWarmup(budget_mb=256, usage_path="data/filter_usage.json")
+#   warm.schedule(dataset_version, df_main, cube, groups)       # ครั้งเดียวต่อชุดข้อมูล ทำใน thread pool
+#   aggs = warm.cache.get(warm_key(dataset_version, filters))   # FilterAggregates หรือ None
+#
+# - FilterAggregates = ตำแหน่งแถวหลังกรอง (filter_positions) + severity tab + goal rollup ของชุดนั้น — ใช้ร่วมทุก session
+# - ลำดับงาน: ตัวกรองที่เลือกบ่อย (UsageStats นับจากการใช้งานจริง เก็บเป็น JSON) มาก่อน ตามด้วยชุดตั้งต้น
+#   ทั้งหมด, ปีงบล่าสุด 3 ปี, แต่ละไตรมาสของปีงบล่าสุด, แต่ละกลุ่มงาน
+# - งบหน่วยความจำ: cache แบบ LRU ตามขนาด (bytes) — งานอุ่นไม่ไล่รายการที่มีอยู่ออก เต็มงบแล้วหยุดอุ่นชุดนั้น
+import json
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from atomic_files import write_atomic
+from goal_rollup import GoalRollup, build_goal_rollup
+from incident_pipeline import filter_positions
+from severity_tab import SeverityTab, build_severity_tab
+
+ALL = "-- ทั้งหมด --"
+FILTER_FIELDS = ("mode", "fy", "fq", "m", "group", "unit", "hospital")
+RECENT_YEARS = 3
+
+
+def filter_tuple(filters: dict) -> tuple:
+    """ตัวกรอง (รูปแบบ st.session_state['cube_filters']) เป็น tuple ที่ไม่ขึ้นกับลำดับ key และชนิดของรายการโรงพยาบาล"""
+    filters = filters or {}
+    values = []
+    for name in FILTER_FIELDS:
+        v = filters.get(name)
+        if name == "hospital":
+            v = tuple(sorted(str(h) for h in v or ()))
+        elif v is not None:
+            v = str(v)
+        values.append((name, v))
+    return tuple(values)
+
+
+def filters_from_tuple(key: tuple) -> dict:
+    f = dict(key)
+    f["hospital"] = list(f.get("hospital") or ())
+    if f.get("m") is not None:
+        f["m"] = int(f["m"])
+    return f
+
+
+def warm_key(dataset_version, filters: dict) -> tuple:
+    return dataset_version, filter_tuple(filters)
+
+
+@dataclass(frozen=True)
+class FilterAggregates:
+    rows: np.ndarray                 # ตำแหน่งแถว (df_main.iloc) หลังกรอง
+    tab: SeverityTab | None = None   # None = ยังไม่ได้นับ (ผลที่คำนวณตอนเปิดหน้า)
+    goals: GoalRollup | None = None
+
+    @property
+    def nbytes(self) -> int:
+        n = self.rows.nbytes
+        if self.tab is not None:
+            n += self.tab.counts.nbytes + int(self.tab.entries.memory_usage(deep=True).sum())
+        if self.goals is not None:
+            n += self.goals.counts.nbytes + self.goals.goals.memory_usage(deep=True) + \
+                self.goals.types.memory_usage(deep=True)
+        return n
+
+
+def compute_aggregates(df: pd.DataFrame, filters: dict) -> FilterAggregates:
+    rows = filter_positions(df, filters.get("mode", "ทั้งหมด"), fy=filters.get("fy"), fq=filters.get("fq"),
+                            m=filters.get("m"), hospitals=filters.get("hospital"),
+                            group_name=filters.get("group"), unit_name=filters.get("unit"))
+    sub = df.take(rows)
+    return FilterAggregates(rows=rows, tab=build_severity_tab(sub), goals=build_goal_rollup(sub))
+
+
+class AggregateCache:
+    """LRU ตามขนาดรวม (bytes) ใช้ได้จากหลาย thread"""
+
+    def __init__(self, budget_bytes: int):
+        self.budget = int(budget_bytes)
+        self.used = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value: FilterAggregates, evict: bool = True) -> bool:
+        """
+        เพิ่ม/แทนที่รายการ — evict=True ไล่รายการที่ใช้ล่าสุดนานที่สุดออกจนพอ,
+        evict=False (งานอุ่น) ไม่ไล่ ถ้าไม่พอคืน False
+        """
+        size = value.nbytes
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.used -= old.nbytes
+            if size > self.budget or (not evict and self.used + size > self.budget):
+                if old is not None:  # คืนรายการเดิม
+                    self._items[key] = old
+                    self.used += old.nbytes
+                return False
+            while self.used + size > self.budget:
+                _, dropped = self._items.popitem(last=False)
+                self.used -= dropped.nbytes
+            self._items[key] = value
+            self.used += size
+            return True
+
+
+class UsageStats:
+    """จำนวนครั้งที่ผู้ใช้เลือกแต่ละตัวกรอง (นับเมื่อตัวกรองของ session เปลี่ยน) — บันทึกลง JSON ไม่เกินทุก save_every วินาที"""
+
+    def __init__(self, path=None, save_every: float = 30.0):
+        self.path = Path(path) if path else None
+        self.save_every = save_every
+        self.counts = Counter()
+        self._saved_at = 0.0
+        self._lock = threading.Lock()
+        if self.path is not None and self.path.is_file():
+            try:
+                for entry in json.loads(self.path.read_text(encoding="utf-8")):
+                    self.counts[tuple((k, tuple(v) if isinstance(v, list) else v) for k, v in entry["filters"])] = \
+                        int(entry["count"])
+            except (OSError, ValueError, KeyError, TypeError):
+                self.counts.clear()  # ไฟล์เสีย: เริ่มนับใหม่
+
+    def record(self, filters: dict):
+        with self._lock:
+            self.counts[filter_tuple(filters)] += 1
+            if self.path is not None and time.time() - self._saved_at >= self.save_every:
+                self._save()
+
+    def _save(self):
+        data = [{"filters": [list(kv) for kv in key], "count": n} for key, n in self.counts.most_common(500)]
+        try:
+            write_atomic(self.path, lambda tmp: tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8"))
+            self._saved_at = time.time()
+        except OSError:
+            pass  # บันทึกไม่ได้ไม่ทำให้แอปล้ม (นับต่อในหน่วยความจำ)
+
+    def count(self, key: tuple) -> int:
+        return self.counts.get(key, 0)
+
+    def most_common(self, n: int = None) -> list:
+        with self._lock:
+            return self.counts.most_common(n)
+
+
+def default_filters(cube, groups) -> list:
+    """ชุดตั้งต้น: ทั้งหมด, ปีงบล่าสุด RECENT_YEARS ปี, แต่ละไตรมาสของปีงบล่าสุด, แต่ละกลุ่มงาน (ทุกช่วงเวลา)"""
+    base = {"mode": "ทั้งหมด", "fy": None, "fq": None, "m": None, "group": ALL, "unit": ALL, "hospital": []}
+    out = [base]
+    month_fy = pd.Series(cube.month_fy if cube is not None else [], dtype=object)
+    years = sorted(month_fy.dropna().astype(str).unique())[-RECENT_YEARS:]
+    out += [{**base, "mode": "รายปี", "fy": fy} for fy in reversed(years)]
+    if years:
+        quarters = sorted(set(cube.month_fq[(month_fy.astype(str) == years[-1]).to_numpy()]))
+        out += [{**base, "mode": "รายไตรมาส", "fy": years[-1], "fq": q} for q in quarters]
+    out += [{**base, "group": g} for g in groups]
+    return out
+
+
+def warmup_plan(cube, groups, usage: UsageStats = None, limit: int = 40) -> list:
+    """
+    ตัวกรองที่จะอุ่น เรียงตามจำนวนครั้งที่ถูกเลือก (มาก -> น้อย) แล้วตามลำดับชุดตั้งต้น
+    ตัวกรองที่เคยถูกเลือกแต่ใช้กับชุดข้อมูลนี้ไม่ได้ (ปีงบ/กลุ่มงานที่ไม่มี) ถูกข้าม
+    """
+    fys = set(pd.Series(cube.month_fy).dropna().astype(str)) if cube is not None else set()
+    known_groups = set(groups)
+
+    def applicable(f: dict) -> bool:
+        return ((f.get("fy") in (None, ALL) or f["fy"] in fys) and
+                (f.get("group") in (None, "", ALL, "-- เลือกกลุ่มงาน --") or f["group"] in known_groups) and
+                not f.get("hospital"))
+
+    ranked = {}
+    for rank, f in enumerate(default_filters(cube, groups)):
+        ranked[filter_tuple(f)] = (usage.count(filter_tuple(f)) if usage else 0, -rank)
+    for key, n in (usage.most_common(limit) if usage else []):
+        if key not in ranked and applicable(filters_from_tuple(key)):
+            ranked[key] = (n, -len(ranked))
+    order = sorted(ranked, key=ranked.get, reverse=True)[:limit]
+    return [filters_from_tuple(key) for key in order]
+
+
+class FilterWarmup:
+    """cache + สถิติการใช้ + thread pool ที่อุ่นตัวกรองของแต่ละชุดข้อมูล (หนึ่งตัวต่อ process)"""
+
+    def __init__(self, budget_mb: float = 256, usage_path=None, max_workers: int = 2):
+        self.cache = AggregateCache(budget_mb * 2**20)
+        self.usage = UsageStats(usage_path)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hoiarr-warmup")
+        self._scheduled = {}  # dataset_version -> threading.Event (ตั้งเมื่อต้องหยุด: งบเต็ม)
+        self._lock = threading.Lock()
+
+    def schedule(self, dataset_version, df: pd.DataFrame, cube, groups) -> list:
+        """ส่งงานอุ่นของชุดข้อมูลนี้เข้า thread pool (ครั้งเดียวต่อ dataset_version) — คืนรายการ Future"""
+        with self._lock:
+            if dataset_version is None or dataset_version in self._scheduled:
+                return []
+            stop = self._scheduled[dataset_version] = threading.Event()
+        return [self._pool.submit(self._warm, dataset_version, df, filters, stop)
+                for filters in warmup_plan(cube, groups, self.usage)]
+
+    def _warm(self, dataset_version, df: pd.DataFrame, filters: dict, stop: threading.Event) -> bool:
+        key = warm_key(dataset_version, filters)
+        if stop.is_set() or key in self.cache:
+            return False
+        try:
+            aggs = compute_aggregates(df, filters)
+        except Exception:
+            return False  # งานพื้นหลัง: ตัวกรองที่คำนวณไม่ได้ จะคำนวณตอนเปิดหน้าแทน
+        if not self.cache.put(key, aggs, evict=False):
+            stop.set()  # งบเต็ม: งานที่เหลือ (ลำดับความสำคัญต่ำกว่า) ไม่ต้องทำ
+            return False
+        return True
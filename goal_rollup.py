@@ -0,0 +1,144 @@
+# goal_rollup.py
+# -*- coding: utf-8 -*-
+# ตาราง Safety Goals 4 หมวด จากผลนับ (หมวด × ประเภท × ระดับความรุนแรง) ชุดเดียวต่อสถานะตัวกรอง
+#
+#   counts[goal, type, sev]  goal = 'หมวด' หลังตัด prefix ("P:xxx" -> "xxx"), type = 'ประเภท' (strip)
+#                            sev  = A..I, 1..5, ค่าอื่น, ค่าว่าง
+#
+# ป้ายของแต่ละมิติแปลงครั้งเดียวต่อค่าไม่ซ้ำ (pd.factorize) แล้วนับด้วย np.bincount ครั้งเดียว
+# ตารางแต่ละหมวดเป็นการตัด counts[goal] — ผลเท่ากับ groupby/pivot เดิมของ create_goal_summary_table ทุกตาราง
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from reference_data import normalize_goal_label
+from stage_profiler import profiled
+
+LETTER_LEVELS = list('ABCDEFGHI')
+LETTER_E_UP = list('EFGHI')
+NUMBER_LEVELS = ['1', '2', '3', '4', '5']
+NUMBER_3_UP = ['3', '4', '5']
+SEV_BINS = LETTER_LEVELS + NUMBER_LEVELS + ['_other', '_missing']
+OTHER_BIN, MISSING_BIN = len(SEV_BINS) - 2, len(SEV_BINS) - 1
+
+# ชื่อหมวด (แบบในรายงาน NRLS = 'หมวด' หลังตัด prefix) -> ระดับความรุนแรงที่ใช้
+GOAL_SEVERITY_MODE = {
+    "Patient Safety Goals หรือ Common Clinical Risk Incident": "letter",
+    "Specific Clinical Risk Incident": "letter",
+    "Personnel Safety Goals": "letter",
+    "Organization Safety Goals": "number",
+}
+
+
+def _codes(values: pd.Series, label_of) -> tuple:
+    """(รหัสป้ายต่อแถว, ป้ายไม่ซ้ำ) — label_of เรียกครั้งเดียวต่อค่าไม่ซ้ำ (ค่าว่างแยกตามชนิด None / nan แบบ astype(str))"""
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    labels = [label_of(u) for u in uniques]
+    na = codes < 0
+    if na.any():
+        na_values = values[na]
+        na_codes, na_kinds = pd.factorize(na_values.astype(str))
+        _, first = np.unique(na_codes, return_index=True)
+        codes = codes.copy()
+        codes[na] = len(labels) + na_codes
+        labels += [label_of(na_values.iloc[i]) for i in first]
+    label_codes, label_uniques = pd.factorize(pd.Index(labels, dtype=object))
+    return (label_codes[codes] if len(codes) else codes), pd.Index(label_uniques, dtype=object)
+
+
+def _severity_bin(value) -> int:
+    """ระดับความรุนแรงดิบ -> ช่อง: A..I ตรงตัว (แบบ groupby เดิม), 1..5 หลัง str().strip(), ค่าอื่น, ค่าว่าง"""
+    if isinstance(value, str) and value in LETTER_LEVELS:
+        return LETTER_LEVELS.index(value)
+    if pd.isna(value):
+        return MISSING_BIN
+    s = str(value).strip()
+    return len(LETTER_LEVELS) + NUMBER_LEVELS.index(s) if s in NUMBER_LEVELS else OTHER_BIN
+
+
+def _empty_table(mode: str) -> pd.DataFrame:
+    if mode == "letter":
+        cols = ["E", "F", "G", "H", "I", "รวม E-Up", "รวม(ระดับ A-I)", "ร้อยละ E-Up"]
+    else:
+        cols = ["1", "2", "3", "4", "5", "รวม 3-5", "รวม", "ร้อยละ 3-5"]
+    return pd.DataFrame(columns=["Incident Type"] + cols)
+
+
+@dataclass(frozen=True)
+class GoalRollup:
+    goals: pd.Index      # หมวด_key
+    types: pd.Index      # ประเภท_norm
+    counts: np.ndarray   # (n_goal, n_type, len(SEV_BINS)) int64
+
+    def table(self, goal: str, type_order: list = None) -> pd.DataFrame:
+        """
+        ตารางของหมวดเดียว: แถว = ประเภท (ตาม type_order ถ้ามี — ทุกประเภทในรายการ แม้ไม่มีข้อมูล,
+        ประเภทนอกรายการไม่แสดง; ไม่มีรายการ = ประเภทที่พบ เรียงตามตัวอักษร) + แถว "รวม" ท้ายตาราง
+        """
+        mode = GOAL_SEVERITY_MODE.get(goal, "letter")
+        g = self.goals.get_indexer([goal])[0]
+        if g < 0 or self.counts[g].sum() == 0:
+            return _empty_table(mode)
+        c = self.counts[g]
+        if mode == "letter" and not c[:, :MISSING_BIN].any():
+            # เดิม: groupby ตัดแถวที่ระดับความรุนแรงว่าง — ไม่เหลือแถวเลยได้ตารางว่าง (แม้มีลำดับจาก Code2024)
+            c, labels = c[:0], []
+        elif type_order is not None:
+            order = list(dict.fromkeys(type_order))
+            pos = self.types.get_indexer(order)
+            c = np.where((pos >= 0)[:, None], c[np.maximum(pos, 0)], 0)
+            labels = order
+        else:
+            # เดิม: groupby ตัดแถวที่ระดับความรุนแรงว่าง (หมวดแบบตัวอักษร); หมวดแบบตัวเลขใช้ข้อความ 'nan' จึงนับทุกแถว
+            seen = c[:, :MISSING_BIN].sum(axis=1) > 0 if mode == "letter" else c.sum(axis=1) > 0
+            order = np.argsort(self.types[seen].astype(str).to_numpy(), kind="stable")
+            c, labels = c[seen][order], list(self.types[seen][order])
+
+        if mode == "letter":
+            names, shown, up_cols = LETTER_LEVELS, LETTER_E_UP, LETTER_E_UP
+            up_name, total_name, pct_name = "รวม E-Up", "รวม(ระดับ A-I)", "ร้อยละ E-Up"
+            levels = c[:, :len(LETTER_LEVELS)]
+        else:
+            names, shown, up_cols = NUMBER_LEVELS, NUMBER_LEVELS, NUMBER_3_UP
+            up_name, total_name, pct_name = "รวม 3-5", "รวม", "ร้อยละ 3-5"
+            levels = c[:, len(LETTER_LEVELS):len(LETTER_LEVELS) + len(NUMBER_LEVELS)]
+        by_level = dict(zip(names, levels.T))
+        up = sum(by_level[s] for s in up_cols)
+        total = levels.sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pct = np.round(np.where(total > 0, up / total * 100, np.nan), 2)
+
+        result = pd.DataFrame({"Incident Type": pd.Series(labels, dtype=object),
+                               **{s: by_level[s] for s in shown},
+                               up_name: up, total_name: total, pct_name: pct.astype(float)})
+        if len(result):
+            sums = {col: result[col].sum() for col in result.columns[1:-1]}
+            up_sum, total_sum = sums[up_name], sums[total_name]
+            total_row = {"Incident Type": "รวม", **sums,
+                         pct_name: round(up_sum / total_sum * 100, 2) if total_sum else 0.0}
+            result = pd.concat([result, pd.DataFrame([total_row])[result.columns]], ignore_index=True)
+        return result
+
+    def tables(self, type_order: dict = None) -> dict:
+        """ตารางทั้ง 4 หมวด (ลำดับตาม GOAL_SEVERITY_MODE) — type_order = หมวด -> [ประเภท ตามลำดับใน Code2024]"""
+        type_order = type_order or {}
+        return {goal: self.table(goal, type_order.get(goal)) for goal in GOAL_SEVERITY_MODE}
+
+
+@profiled()
+def build_goal_rollup(df: pd.DataFrame) -> GoalRollup:
+    """นับ (หมวด × ประเภท × ระดับความรุนแรง) ของทุกแถวในรอบเดียว — คอลัมน์ที่ไม่มีถือเป็นค่าว่าง"""
+    def column(name):
+        return df[name] if name in df.columns else pd.Series(np.nan, index=df.index, dtype=object)
+
+    goal_id, goals = _codes(column("หมวด"), normalize_goal_label)
+    type_id, types = _codes(column("ประเภท"), lambda v: str(v).strip())
+    sev_codes, sev_uniques = pd.factorize(column("ระดับความรุนแรง"), use_na_sentinel=True)
+    # รหัส -1 (ค่าว่าง) ชี้ช่องสุดท้ายของ array = MISSING_BIN
+    sev_bin = np.array([_severity_bin(u) for u in sev_uniques] + [MISSING_BIN], dtype=np.int64)[sev_codes]
+
+    n_bins = len(SEV_BINS)
+    flat = (goal_id.astype(np.int64) * len(types) + type_id) * n_bins + sev_bin
+    counts = np.bincount(flat, minlength=len(goals) * len(types) * n_bins)
+    return GoalRollup(goals=goals, types=types, counts=counts.reshape(len(goals), len(types), n_bins))
@@ -0,0 +1,140 @@
+# hoiarr_batch.py
+# -*- coding: utf-8 -*-
+"""
+ประมวลผลไฟล์อุบัติการณ์แบบไม่ใช้ Streamlit (สำหรับงาน nightly / cron)
+ใช้ขั้นตอนเดียวกับแอป (massage_schema -> add_time_parts_fiscal) แล้วเขียนผลลัพธ์ทุกตารางลงโฟลเดอร์
+
+    python hoiarr_batch.py jib.xlsx hospital_b.csv -o output/ --workers 4
+"""
+import argparse
+import json
+import sys
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from incident_cube import build_incident_cube
+from stage_profiler import begin_run, end_run
+from incident_store import to_arrow_safe, write_incident_store, write_arrow_snapshot
+from incident_pipeline import (PipelineWarning, SchemaError, load_reference_tables, load_code_mapping,
+                               read_incident_file, ingest_incident_files, hospital_name_from_file,
+                               process_incident_frame, build_risk_matrix, find_sentinel_events,
+                               create_psg9_summary_table, create_summary_table_by_code,
+                               create_summary_table_by_category, create_goal_summary_table,
+                               persistence_risk_from_cube, prioritize_incidents_nb_logit_v2)
+
+GOAL_FILE_NAMES = {
+    "Patient Safety Goals หรือ Common Clinical Risk Incident": "goal_patient_safety",
+    "Specific Clinical Risk Incident": "goal_specific_clinical",
+    "Personnel Safety Goals": "goal_personnel_safety",
+    "Organization Safety Goals": "goal_organization_safety",
+}
+
+
+def _total_months(df: pd.DataFrame) -> int:
+    if df.empty: return 1
+    max_p = df['Occurrence Date'].max().to_period('M'); min_p = df['Occurrence Date'].min().to_period('M')
+    return max(1, (max_p.year - min_p.year) * 12 + (max_p.month - min_p.month) + 1)
+
+
+def output_tasks(df: pd.DataFrame, refs: dict, code_mapping: pd.DataFrame) -> dict:
+    """ชื่อไฟล์ผลลัพธ์ -> ฟังก์ชันที่คืน DataFrame (หรือ dict ชื่อ -> DataFrame)"""
+    cube = build_incident_cube(df)
+    total_months = _total_months(df)
+    return {
+        "psg9_summary": lambda: create_psg9_summary_table(df, refs["PSG9_label_dict"]),
+        "summary_by_code": lambda: create_summary_table_by_code(df),
+        "summary_by_category": lambda: create_summary_table_by_category(df, 'หมวด'),
+        "goal_summary": lambda: {GOAL_FILE_NAMES.get(k, k): v
+                                 for k, v in create_goal_summary_table(df, code_mapping).items()},
+        "risk_matrix": lambda: build_risk_matrix(df).rename_axis(index='Impact Level', columns='Frequency Level'),
+        "sentinel_events": lambda: find_sentinel_events(df, refs["sentinel_composite_keys"], refs["Sentinel2024_df"]),
+        "persistence": lambda: persistence_risk_from_cube(cube, None, None, total_months),
+        "early_warning": lambda: prioritize_incidents_nb_logit_v2(df, horizon=3, cube_view=(cube, None, None)),
+    }
+
+
+def _write_csv(out_dir: Path, name: str, frame: pd.DataFrame) -> dict:
+    path = out_dir / f"{name}.csv"
+    frame = frame if frame is not None else pd.DataFrame()
+    keep_index = not isinstance(frame.index, pd.RangeIndex)
+    frame.to_csv(path, index=keep_index, encoding="utf-8-sig")  # utf-8-sig ให้ Excel เปิดภาษาไทยได้
+    return {"file": path.name, "rows": int(len(frame))}
+
+
+def run_task(out_dir: Path, name: str, fn) -> list:
+    result = fn()
+    if isinstance(result, dict):
+        return [_write_csv(out_dir, sub_name, frame) for sub_name, frame in result.items()]
+    return [_write_csv(out_dir, name, result)]
+
+
+def write_processed(out_dir: Path, df: pd.DataFrame) -> list:
+    path = out_dir / "processed_incident_data.parquet"
+    out = to_arrow_safe(df)
+    out.to_parquet(path, index=False)
+    return [{"file": path.name, "rows": int(len(out))}]
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("files", nargs="+",
+                    help="ไฟล์อุบัติการณ์ .xlsx / .xls / .csv (หลายไฟล์ = หลายโรงพยาบาล ชื่อตามชื่อไฟล์ รวมเป็นชุดเดียว)")
+    ap.add_argument("-o", "--output", default="output", help="โฟลเดอร์ผลลัพธ์")
+    ap.add_argument("--ref-dir", default=str(Path(__file__).resolve().parent),
+                    help="โฟลเดอร์ไฟล์อ้างอิง (PSG9code.xlsx, Sentinel2024.xlsx, Code2024.xlsx)")
+    ap.add_argument("--ref-cache", help="โฟลเดอร์ snapshot ไฟล์นิยาม (ไม่ต้องอ่าน Excel ซ้ำทุกรอบ เช่น data/ref_cache)")
+    ap.add_argument("--store", help="เขียน Parquet แบ่งพาร์ทิชันสำหรับแอปด้วย (เช่น data/incident_store)")
+    ap.add_argument("--arrow", help="เขียน Arrow snapshot ให้ worker ของแอป memory-map ร่วมกัน (ดู HOIARR_ARROW_SNAPSHOT)")
+    ap.add_argument("--workers", type=int, default=4, help="จำนวน process อ่านไฟล์ / thread สร้างและเขียนผลลัพธ์")
+    args = ap.parse_args(argv)
+
+    warnings.simplefilter("always", PipelineWarning)
+    _default_format = warnings.formatwarning
+    warnings.formatwarning = lambda msg, cat, *a, **k: (
+        f"[{msg.level}] {msg}\n" if isinstance(msg, PipelineWarning) else _default_format(msg, cat, *a, **k))
+
+    t0 = time.perf_counter()
+    begin_run("hoiarr_batch")  # HOIARR_PROFILE=1: เวลาแต่ละขั้นของการอ่าน/ประมวลผล -> stderr + log JSON
+    refs = load_reference_tables(args.ref_dir, args.ref_cache)
+    code_mapping = load_code_mapping(args.ref_dir, args.ref_cache)
+    try:
+        if len(args.files) == 1:
+            df = process_incident_frame(read_incident_file(args.files[0]), refs["PSG9code_df_master"])
+        else:
+            sources = [(hospital_name_from_file(f), Path(f).name, f) for f in args.files]
+            df = ingest_incident_files(sources, refs["PSG9code_df_master"], max_workers=args.workers)
+    except (SchemaError, ValueError, OSError) as e:
+        print(f"[error] {e}", file=sys.stderr)
+        return 1
+    t_process = time.perf_counter() - t0
+
+    out_dir = Path(args.output); out_dir.mkdir(parents=True, exist_ok=True)
+    tasks = output_tasks(df, refs, code_mapping)
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as ex:
+        futures = {"processed": ex.submit(write_processed, out_dir, df)}
+        if args.store:
+            futures["store"] = ex.submit(lambda: [{"store": args.store, "rows": write_incident_store(df, args.store)["rows"]}])
+        if args.arrow:
+            futures["arrow"] = ex.submit(lambda: [{"arrow": args.arrow, "rows": write_arrow_snapshot(df, args.arrow)}])
+        futures.update({name: ex.submit(run_task, out_dir, name, fn) for name, fn in tasks.items()})
+        written = {name: fut.result() for name, fut in futures.items()}
+
+    manifest = {"inputs": [str(f) for f in args.files], "rows": int(len(df)),
+                "process_seconds": round(t_process, 3), "total_seconds": round(time.perf_counter() - t0, 3),
+                "outputs": written}
+    (out_dir / "manifest.json").write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"{len(df):,} รายการ -> {out_dir} ({manifest['total_seconds']:.2f}s)")
+    run = end_run(inputs=manifest["inputs"])
+    if run is not None:
+        for rec in run["stages"]:
+            print(f"{'  ' * rec['depth']}{rec['stage']:<40} {rec['seconds'] * 1000:>9.1f} ms  "
+                  f"rows {rec['rows_in']} -> {rec['rows_out']}  ΔRSS {rec['mem_delta_mb']} MB", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+# incident_cube.py
+# -*- coding: utf-8 -*-
+# Count cube: นับอุบัติการณ์ครั้งเดียวต่อชุดข้อมูล แล้วให้หน้าต่างๆ ตัด/รวมจาก array แทนการ groupby/pivot ข้อมูลดิบซ้ำ
+#
+#   counts[series, severity, month]
+#     series   = คู่ (รายการอุบัติการณ์, หน่วยงาน) ที่พบจริงในข้อมูล (ไม่สร้างช่องว่างของคู่ที่ไม่เคยเกิด)
+#                หน่วยงาน = (โรงพยาบาล, หน่วยงาน) เมื่อข้อมูลรวมหลายโรงพยาบาล
+#     severity = ค่า 'Impact' (A-I ฯลฯ)
+#     month    = เดือนต่อเนื่องตั้งแต่เดือนแรกถึงเดือนสุดท้ายของข้อมูล (มี FY/ไตรมาส/เดือนปฏิทินกำกับ)
+#
+# "รายการอุบัติการณ์" (entry) = (รหัส, ชื่ออุบัติการณ์ความเสี่ยง, หมวด, Frequency Level)
+# เพื่อให้ป้าย 'รหัส | ชื่อ', การแยกตาม Safety Goal และระดับความเสี่ยง ได้ผลตรงกับการคำนวณจากข้อมูลดิบ
+import hashlib
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from stage_profiler import profiled
+
+# ค่าคงที่ใช้ร่วมกับ incident_pipeline (ซึ่ง import จากที่นี่ — incident_pipeline import โมดูลนี้อยู่แล้ว จึงกลับทางไม่ได้)
+HOSPITAL_COL = "โรงพยาบาล"
+TH_MONTH_TINY = {1: "ม.ค.", 2: "ก.พ.", 3: "มี.ค.", 4: "เม.ย.", 5: "พ.ค.", 6: "มิ.ย.", 7: "ก.ค.", 8: "ส.ค.",
+                 9: "ก.ย.", 10: "ต.ค.", 11: "พ.ย.", 12: "ธ.ค."}
+_FQ_OF_MONTH = np.array(["", "Q2", "Q2", "Q2", "Q3", "Q3", "Q3", "Q4", "Q4", "Q4", "Q1", "Q1", "Q1"])
+_NO_GROUP = (None, "", "-- เลือกกลุ่มงาน --", "-- ทั้งหมด --")
+_NO_UNIT = (None, "", "-- ทั้งหมด --")
+
+ENTRY_COLS = ['รหัส', 'ชื่ออุบัติการณ์ความเสี่ยง', 'หมวด', 'Frequency Level']
+
+
+def dataset_fingerprint(df: pd.DataFrame) -> str:
+    """hash เนื้อหาของชุดข้อมูลที่ประมวลผลแล้ว (ใช้เป็น 'เวอร์ชัน' สำหรับ cache)"""
+    key_cols = [c for c in ['Incident', 'Occurrence Date', 'Impact', 'หน่วยงาน', 'หมวด', HOSPITAL_COL] if c in df.columns]
+    h = hashlib.sha1(str(df.shape).encode())
+    if key_cols:
+        h.update(pd.util.hash_pandas_object(df[key_cols], index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+@dataclass(frozen=True)
+class IncidentCube:
+    counts: np.ndarray            # (n_series, n_severity, n_month) int32
+    series_entry: np.ndarray      # series -> entry index
+    series_unit: np.ndarray       # series -> unit index
+    entries: pd.DataFrame         # ENTRY_COLS + 'incident_label'
+    units: pd.DataFrame           # 'หน่วยงาน', 'กลุ่มงาน', 'โรงพยาบาล'
+    severities: list              # ค่า Impact ตามลำดับแกน severity
+    months: pd.PeriodIndex        # เดือนต่อเนื่อง (freq='M')
+    month_fy: np.ndarray          # ปีงบประมาณของแต่ละเดือน
+    month_fq: np.ndarray          # 'Q1'..'Q4' (ไตรมาสปีงบ)
+    month_cal: np.ndarray         # เดือนปฏิทิน 1..12
+
+    # ---------- ตัวกรอง (ความหมายเดียวกับ filter_by_period_fiscal / filter_by_group_and_unit) ----------
+    def month_mask(self, mode: str = "ทั้งหมด", fy=None, fq=None, m=None) -> np.ndarray:
+        mask = np.ones(len(self.months), dtype=bool)
+        if mode == "ทั้งหมด":
+            return mask
+        fy_str = str(fy) if fy not in (None, "", "-- ทั้งหมด --") else None
+        if mode in ("รายปี", "รายไตรมาส", "รายเดือน") and fy_str:
+            mask &= self.month_fy.astype(str) == fy_str
+        if mode == "รายไตรมาส" and fq and fq != "-- ทั้งหมด --":
+            mask &= self.month_fq == fq
+        if mode == "รายเดือน" and m and m != "-- ทั้งหมด --":
+            mask &= self.month_cal == int(m)
+        return mask
+
+    def series_mask(self, group_name=None, unit_name=None, hospitals=None) -> np.ndarray:
+        unit_ok = np.ones(len(self.units), dtype=bool)
+        if hospitals:
+            unit_ok &= self.units[HOSPITAL_COL].isin([str(h) for h in hospitals]).to_numpy()
+        if group_name not in _NO_GROUP:
+            unit_ok &= self.units['กลุ่มงาน'].to_numpy() == str(group_name).strip()
+        if unit_name not in _NO_UNIT:
+            unit_ok &= self.units['หน่วยงาน'].to_numpy() == str(unit_name).strip()
+        return unit_ok[self.series_unit]
+
+    def goal_entry_mask(self, search_term: str) -> np.ndarray:
+        """entry ที่ 'หมวด' มีคำค้น (ไม่สนตัวพิมพ์) — เทียบเท่า df['หมวด'].str.contains(term, case=False)"""
+        return self.entries['หมวด'].astype(str).str.contains(search_term, case=False, regex=False).to_numpy()
+
+    # ---------- มุมมองที่ได้จากการตัด/รวม cube ----------
+    def entry_month(self, series_mask=None, month_mask=None) -> np.ndarray:
+        """(n_entry, n_month_selected) จำนวนรวมทุกระดับความรุนแรง"""
+        sel = slice(None) if series_mask is None else series_mask
+        cm = self.counts[sel].sum(axis=1)
+        if month_mask is not None:
+            cm = cm[:, month_mask]
+        out = np.zeros((len(self.entries), cm.shape[1]), dtype=np.int64)
+        np.add.at(out, self.series_entry[sel], cm)
+        return out
+
+    def entry_severity(self, series_mask=None, month_mask=None) -> np.ndarray:
+        """(n_entry, n_severity)"""
+        sel = slice(None) if series_mask is None else series_mask
+        c = self.counts[sel]
+        if month_mask is not None:
+            c = c[:, :, month_mask]
+        cs = c.sum(axis=2)
+        out = np.zeros((len(self.entries), len(self.severities)), dtype=np.int64)
+        np.add.at(out, self.series_entry[sel], cs)
+        return out
+
+    def entry_severity_month(self, series_mask=None, month_mask=None) -> np.ndarray:
+        """(n_entry, n_severity, n_month_selected)"""
+        sel = slice(None) if series_mask is None else series_mask
+        c = self.counts[sel]
+        if month_mask is not None:
+            c = c[:, :, month_mask]
+        out = np.zeros((len(self.entries),) + c.shape[1:], dtype=np.int64)
+        np.add.at(out, self.series_entry[sel], c)
+        return out
+
+    def monthly_totals(self, series_mask=None, month_mask=None) -> pd.Series:
+        """จำนวนรวมต่อเดือน 'YYYY-MM' (เฉพาะเดือนที่มีข้อมูล เหมือน groupby บนข้อมูลดิบ)"""
+        sel = slice(None) if series_mask is None else series_mask
+        tot = self.counts[sel].sum(axis=(0, 1))
+        keep = tot > 0
+        if month_mask is not None:
+            keep &= month_mask
+        return pd.Series(tot[keep], index=self.months[keep].strftime('%Y-%m'), name='จำนวนอุบัติการณ์')
+
+    def grouped_month(self, by=('รหัส',), series_mask=None, month_mask=None):
+        """
+        (keys, matrix) จำนวนต่อเดือนรวมตามคอลัมน์ใน by ('รหัส', 'หน่วยงาน', 'โรงพยาบาล')
+        keys = Index/MultiIndex ของ series ที่มีข้อมูลในช่วงที่เลือก, matrix = (n_key, n_month_selected)
+        """
+        sel = np.ones(len(self.series_entry), dtype=bool) if series_mask is None else series_mask
+        cm = self.counts[sel].sum(axis=1)
+        if month_mask is not None:
+            cm = cm[:, month_mask]
+        parts = {'รหัส': self.entries['รหัส'].to_numpy()[self.series_entry[sel]],
+                 'หน่วยงาน': self.units['หน่วยงาน'].to_numpy()[self.series_unit[sel]],
+                 HOSPITAL_COL: self.units[HOSPITAL_COL].to_numpy()[self.series_unit[sel]]}
+        key_frame = pd.DataFrame({c: parts[c] for c in by})
+        key_id = key_frame.groupby(list(by), sort=True).ngroup().to_numpy()
+        n_key = int(key_id.max()) + 1 if len(key_id) else 0
+        out = np.zeros((n_key, cm.shape[1]), dtype=np.int64)
+        np.add.at(out, key_id, cm)
+        keys = key_frame.drop_duplicates().assign(_id=key_id[~key_frame.duplicated().to_numpy()]).sort_values('_id')
+        keys = pd.MultiIndex.from_frame(keys[list(by)]) if len(by) > 1 else pd.Index(keys[by[0]], name=by[0])
+        keep = out.sum(axis=1) > 0
+        return keys[keep], out[keep]
+
+    def label_by_calendar_month(self, series_mask=None, month_mask=None, entry_mask=None) -> pd.DataFrame:
+        """
+        ตาราง 'รหัส | ชื่อ' × ชื่อเดือนปฏิทิน (รวมทุกปี) — แทน pivot_table(index=incident_label, columns='เดือน')
+        เรียงแถวตามจำนวนรวมมาก -> น้อย, คอลัมน์ ม.ค. -> ธ.ค. เฉพาะเดือนที่มีข้อมูล
+        """
+        em = self.entry_month(series_mask, month_mask)
+        cal = self.month_cal if month_mask is None else self.month_cal[month_mask]
+        by_cal = np.zeros((em.shape[0], 13), dtype=np.int64)
+        np.add.at(by_cal.T, cal, em.T)
+        if entry_mask is not None:
+            by_cal = np.where(entry_mask[:, None], by_cal, 0)
+        table = pd.DataFrame(by_cal[:, 1:], columns=[TH_MONTH_TINY[i] for i in range(1, 13)])
+        table['incident_label'] = self.entries['incident_label'].to_numpy()
+        table = table.groupby('incident_label', sort=False).sum()
+        table = table.loc[table.sum(axis=1) > 0]
+        table = table.loc[:, table.sum(axis=0) > 0]
+        return table.loc[table.sum(axis=1).sort_values(ascending=False, kind='stable').index]
+
+
+@profiled()
+def build_incident_cube(df: pd.DataFrame) -> IncidentCube:
+    """สร้าง cube จากข้อมูลที่ผ่าน massage_schema + add_time_parts_fiscal แล้ว (ไม่ผ่านตัวกรอง)"""
+    data = df[df['Occurrence Date'].notna()]
+    entry_keys = pd.DataFrame({c: (data[c].astype(str) if c in data.columns else "N/A") for c in ENTRY_COLS})
+    entry_id = entry_keys.groupby(ENTRY_COLS, sort=False, dropna=False).ngroup().to_numpy()
+    first_row = pd.Series(np.arange(len(entry_id))).groupby(entry_id).first().to_numpy()
+    entries = entry_keys.iloc[first_row].reset_index(drop=True)
+    entries['incident_label'] = entries['รหัส'] + " | " + entries['ชื่ออุบัติการณ์ความเสี่ยง']
+
+    unit_raw = data['หน่วยงาน'].astype(str).str.strip() if 'หน่วยงาน' in data.columns else pd.Series("N/A", index=data.index)
+    group_raw = data['กลุ่มงาน'].astype(str).str.strip() if 'กลุ่มงาน' in data.columns else pd.Series("N/A", index=data.index)
+    hosp_raw = data[HOSPITAL_COL].astype(str) if HOSPITAL_COL in data.columns else pd.Series("", index=data.index)
+    hosp_code, hosp_names = pd.factorize(hosp_raw, sort=False)
+    name_code, unit_names = pd.factorize(unit_raw, sort=False)
+    unit_id, unit_uniques = pd.factorize(hosp_code.astype(np.int64) * len(unit_names) + name_code, sort=False)
+    unit_uniques = np.asarray(unit_uniques)
+    units = pd.DataFrame({'หน่วยงาน': np.asarray(unit_names)[unit_uniques % max(1, len(unit_names))],
+                          HOSPITAL_COL: np.asarray(hosp_names)[unit_uniques // max(1, len(unit_names))]})
+    units['กลุ่มงาน'] = group_raw.groupby(unit_id).first().to_numpy()
+
+    series_key = entry_id.astype(np.int64) * len(units) + unit_id
+    series_id, series_uniques = pd.factorize(series_key, sort=False)
+    series_uniques = np.asarray(series_uniques)
+
+    sev_id, sev_names = pd.factorize(data['Impact'].astype(str), sort=True)
+
+    occ = data['Occurrence Date']
+    month_abs = (occ.dt.year.to_numpy() * 12 + occ.dt.month.to_numpy() - 1).astype(np.int64)
+    m0 = int(month_abs.min()) if len(month_abs) else 2000 * 12
+    n_month = int(month_abs.max()) - m0 + 1 if len(month_abs) else 0
+    months = pd.period_range(pd.Period(year=m0 // 12, month=m0 % 12 + 1, freq='M'), periods=n_month, freq='M')
+    month_cal = np.asarray(months.month)
+    month_fy = np.where(month_cal >= 10, np.asarray(months.year) + 1, np.asarray(months.year))
+
+    n_series, n_sev = len(series_uniques), len(sev_names)
+    flat = (series_id.astype(np.int64) * n_sev + sev_id) * n_month + (month_abs - m0)
+    counts = np.bincount(flat, minlength=n_series * n_sev * n_month).astype(np.int32)
+
+    return IncidentCube(
+        counts=counts.reshape(n_series, n_sev, n_month),
+        series_entry=(series_uniques // len(units)).astype(np.int64),
+        series_unit=(series_uniques % len(units)).astype(np.int64),
+        entries=entries, units=units, severities=list(sev_names), months=months,
+        month_fy=month_fy, month_fq=_FQ_OF_MONTH[month_cal], month_cal=month_cal,
+    )
@@ -0,0 +1,998 @@
+# incident_pipeline.py
+# -*- coding: utf-8 -*-
+# ส่วนประมวลผลข้อมูลอุบัติการณ์ที่ไม่พึ่ง Streamlit (ใช้ร่วมกันระหว่าง app.py และ hoiarr_batch.py)
+#   - ข้อผิดพลาดที่ทำต่อไม่ได้  -> raise SchemaError
+#   - ข้อความเตือน/แจ้งผู้ใช้    -> warnings.warn(PipelineWarning(...)) ให้ฝั่ง UI/CLI เลือกแสดงเอง
+import io
+import multiprocessing
+import os
+import re
+import unicodedata
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from incident_cube import HOSPITAL_COL, TH_MONTH_TINY, build_incident_cube
+from early_warning import rank_early_warning
+from persistence_index import RollingPersistence
+from severity_tab import (SeverityTab, SEVERITY_DIMS, build_severity_tab, psg9_table, code_table,
+                          category_table)
+from goal_rollup import GoalRollup, build_goal_rollup
+from stage_profiler import profiled, laps
+from reference_data import (CODE_MAPPING_FILE, WORKBOOKS, load_reference_data, read_workbook,
+                            goal_type_order)
+
+
+class SchemaError(ValueError):
+    """ข้อมูลนำเข้าไม่มีคอลัมน์/ค่าที่จำเป็น ประมวลผลต่อไม่ได้"""
+
+
+class PipelineWarning(UserWarning):
+    """ข้อความแจ้งเตือนจาก pipeline (level = 'warning' หรือ 'error' สำหรับการแสดงผล)"""
+    def __init__(self, message: str, level: str = "warning"):
+        super().__init__(message)
+        self.level = level
+
+
+def _warn(message: str, level: str = "warning"):
+    warnings.warn(PipelineWarning(message, level), stacklevel=3)
+
+# =========================
+# 0) อ้างอิง กลุ่มงาน ↔ หน่วยงาน
+# =========================
+SERVICE_MAP = [
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "งานการแพทย์สาขากุมารเวชศาสตร์"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "งานการแพทย์สาขาจักษุวิทยา"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "งานการแพทย์สาขาจิตเวชศาสตร์"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "งานนิติเวช"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "งานพยาธิวิทยากายวิภาค (PATHO)"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "งานพยาธิวิทยาคลินิก"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "งานธนาคารเลือด"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "งานรังสีวิทยา"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "งานการพยาบาลวิสัญญี"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "งานการแพทย์สาขาวิสัญญีวิทยา"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "งานเวชกรรมสังคม"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "งานการแพทย์สาขาเวชศาสตร์ฉุกเฉิน"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "งานกายภาพบําบัด"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "หน่วยตรวจเวชศาสตร์ฟื้นฟู"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "งานการแพทย์สาขาศัลยศาสตร์"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "งานการแพทย์สาขาออร์โธปิดิกส์"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "งานการแพทย์สาขาสูติศาสตร์และนรีเวชวิทยา"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "งานการแพทย์สาขาโสต ศอ นาสิก"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "งานการแพทย์สาขาอายุรศาสตร์"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "งานการแพทย์"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "คลินิกพิเศษเฉพาะทางนอกเวลา (SMC)"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "คลินิกแพทย์แผนไทย"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "คลินิกแพทย์แผนจีน"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "คลินิกแพทย์บูรณาการ"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "แผนกห้องยาสมุนไพร"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "งานเภสัชกรรม"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "คลังเวชภัณฑ์ที่มิใช่ยา"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "งานโภชนาการ"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "ศูนย์เครื่องมือแพทย์"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "หน่วยโลจิสติกส์และเคลื่อนย้ายผู้ป้วย"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "งานเวชภัณฑ์ปลอดเชื้อ(CSSD)"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "งานบริการผ้า"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "หน่วยสังคมสงเคราะห์"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "Admission center"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "หน่วยประสานสิทธิ์การแพทย์"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "หน่วยเวชสถิติ"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "หน่วยเวชระเบียน"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "หน่วยจ่ายยาผู้ป่วย 11B"},
+    {"กลุ่มงาน": "กลุ่มงานการแพทย์", "หน่วยงาน": "งานสนับสนุนทางการแพทย์"},
+    {"กลุ่มงาน": "กลุ่มงานพัฒนาคุณภาพและการศึกษา", "หน่วยงาน": "งานพัฒนาคุณภาพ"},
+    {"กลุ่มงาน": "กลุ่มงานพัฒนาคุณภาพและการศึกษา", "หน่วยงาน": "งานส่งเสริมวิจัยและนวัตกรรม"},
+    {"กลุ่มงาน": "กลุ่มงานพัฒนาคุณภาพและการศึกษา", "หน่วยงาน": "ศูนย์รับเรื่องร้องเรียนและศูนย์ธรรมจริยธรรม"},
+    {"กลุ่มงาน": "กลุ่มงานพัฒนาคุณภาพและการศึกษา", "หน่วยงาน": "ศูนย์บริการจัดการเรื่องร้องเรียนและยุติธรรมเชิงสมานฉันท์"},
+    {"กลุ่มงาน": "กลุ่มงานนโยบายและยุทธศาสตร์", "หน่วยงาน": "งานวางแผนและบริหารยุทธศาสตร์"},
+    {"กลุ่มงาน": "กลุ่มงานนโยบายและยุทธศาสตร์", "หน่วยงาน": "งานเทคโนโลยีสารสนเทศ"},
+    {"กลุ่มงาน": "กลุ่มงานบริหาร", "หน่วยงาน": "งานสารบรรณและอำนวยการ"},
+    {"กลุ่มงาน": "กลุ่มงานบริหาร", "หน่วยงาน": "งานโครงสร้างพื้นฐานและวิศวกรรม (งานอาคารสถานที่)"},
+    {"กลุ่มงาน": "กลุ่มงานบริหาร", "หน่วยงาน": "งานทรัพยากรบุคคล"},
+    {"กลุ่มงาน": "กลุ่มงานบริหาร", "หน่วยงาน": "หน่วยประชาสัมพันธ์และการตลาด"},
+    {"กลุ่มงาน": "กลุ่มงานบริหาร", "หน่วยงาน": "งานการเงินบัญชีและงบประมาณ"},
+    {"กลุ่มงาน": "กลุ่มงานบริหาร", "หน่วยงาน": "งานพัสดุ"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หน่วยบริการผู้ป่วยฉุกเฉิน (ER)"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หน่วยตรวจรักษาทั่วไป"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หน่วยตรวจตา"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หน่วยตรวจหู คอ จมูก"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หน่วยตรวจหัวใจและหลอดเลือด ( OPD Heart )"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หน่วยตรวจสวนหัวใจและหลอดเลือด ( Cath Lab )"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หน่วยตรวจสูตินรีเวชศาสตร์"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "ห้องคลอด"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หอผู้ป่วยสูตินรีเวชศาสตร์และกุมารเวชศาสตร์ 12 B"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หน่วยตรวจผู้ป่วยนอกศัลยศาสตร์"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หน่วยตรวจผู้ป่วยนอกออร์โธปิดิกส์"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หอผู้ป่วย 8B"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หอผู้ป่วยสามัญรวม 9A"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หอผู้ป่วยพิเศษศัลยศาสตร์ 10A"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หอผู้ป่วยพิเศษศัลยศาสตร์ 11A"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หอผู้ป่วยพิเศษศัลยศาสตร์และออร์โธปิดิกส์ 12A"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หน่วยตรวจผู้ป่วยนอกอายุรศาสตร์"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หอผู้ป่วย CCU"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หอผู้ป่วยไอซียูอายุรศาสตร์"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หอผู้ป่วยสามัญอายุรศาสตร์หญิง 7A"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หอผู้ป่วยสามัญอายุรศาสตร์ชาย 7B"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หอผู้ป่วยพิเศษรวม 10B"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หน่วยเคมีบำบัด 11B"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "ห้องไตเทียม"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หน่วยบำบัดทดแทนไต"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หน่วยตรวจเด็กสุขภาพดี"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หน่วยตรวจรักษาเด็กป่วย"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หออภิบาลทารกแรกเกิด (Nursery)"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หน่วยตรวจสุขภาพจิต"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หอผู้ป่วยสามัญจิตเวช (8A)"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "งานการพยาบาลผ่าตัด"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "ศูนย์ส่องกล้องระบบทางเดินอาหาร"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หน่วยส่งเสริมสุขภาพ"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หน่วยตรวจสุขภาพ (Check-up)"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "งานศูนย์ความเป็นเลิศทางการพยาบาล"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "งานป้องกันและควบคุมการติดเชื้อในโรงพยาบาล"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หน่วยผู้ป่วยวิกฤตอายุรกรรม"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "งานการพยาบาลห้องคลอดและทารกแรกเกิด (งานอาสาสมัคร)"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "หอผู้ป่วยสามัญเด็ก ชั้น 9B"},
+    {"กลุ่มงาน": "กลุ่มงานการพยาบาล", "หน่วยงาน": "300503"},
+]
+REF_DF = pd.DataFrame(SERVICE_MAP)
+REF_COL = "หน่วยงาน"  # Column name in the main data file for department
+
+def list_units(group_name: str) -> list:
+    if not group_name or group_name in ("-- เลือกกลุ่มงาน --", "-- ทั้งหมด --"):
+        return []
+    if group_name in REF_DF["กลุ่มงาน"].unique():
+        return sorted(REF_DF.loc[REF_DF["กลุ่มงาน"] == group_name, "หน่วยงาน"].unique().tolist())
+    return []
+
+# =========================
+# A) Normalization & Mapping
+# =========================
+INVIS_CHARS = {"\u200b": "", "\u200c": "", "\u200d": "", "\ufeff": ""}
+PARENS = {"（": "(", "）": ")", "﹙": "(", "﹚": ")", "“": '"', "”": '"', "‘": "'", "’": "'"}
+TRANS_INVIS = str.maketrans(INVIS_CHARS)
+TRANS_PARENS = str.maketrans(PARENS)
+ALIASES = {
+    "หน่วยโลจิสติกส์และเคลื่อนย้ายผู้ป้วย": "หน่วยโลจิสติกส์และเคลื่อนย้ายผู้ป่วย",
+}
+
+def normalize_unit(text: str) -> str:
+    if pd.isna(text): return ""
+    s = str(text)
+    s = unicodedata.normalize("NFKC", s)
+    s = s.replace("\xa0", " ").translate(TRANS_INVIS).translate(TRANS_PARENS)
+    s = re.sub(r"\s+", " ", s.strip()).strip('\'"')
+    return ALIASES.get(s, s)
+
+service_map_norm = {normalize_unit(r["หน่วยงาน"]): r["กลุ่มงาน"] for r in SERVICE_MAP}
+
+# === Safety Goals definitions (global) ===
+goal_definitions = {
+    "Patient Safety/ Common Clinical Risk": "P:Patient Safety Goals หรือ Common Clinical Risk Incident",
+    "Specific Clinical Risk": "S:Specific Clinical Risk Incident",
+    "Personnel Safety": "P:Personnel Safety Goals",
+    "Organization Safety": "O:Organization Safety Goals",
+}
+
+# =========================
+# 1) แปลงวันที่/เวลาไทย → Timestamp
+# =========================
+THAI_MONTHS = {
+    "ม.ค.":1, "ก.พ.":2, "มี.ค.":3, "เม.ย.":4, "พ.ค.":5, "มิ.ย.":6,
+    "ก.ค.":7, "ส.ค.":8, "ก.ย.":9, "ต.ค.":10, "พ.ย.":11, "ธ.ค.":12,
+    "มกราคม":1, "กุมภาพันธ์":2, "มีนาคม":3, "เมษายน":4, "พฤษภาคม":5, "มิถุนายน":6,
+    "กรกฎาคม":7, "สิงหาคม":8, "กันยายน":9, "ตุลาคม":10, "พฤศจิกายน":11, "ธันวาคม":12,
+}
+THAI_DIGITS = "๐๑๒๓๔๕๖๗๘๙"; ARABIC_DIGITS = "0123456789"
+DIGIT_MAP = str.maketrans({t: a for t, a in zip(THAI_DIGITS, ARABIC_DIGITS)})
+
+def normalize_raw_datetime_text(x):
+    if x is None or (isinstance(x, float) and pd.isna(x)) or (isinstance(x, str) and x.strip() == ""): return None
+    s = str(x).strip().translate(DIGIT_MAP)
+    s = re.sub(r"\bเวลา\b", "", s); s = re.sub(r"\s*น\.?\b", "", s); s = re.sub(r"\s+", " ", s).strip()
+    return s if s else None
+
+def _timestamp_or_nat(yyyy: int, mm: int, dd: int, hhmmss: str):
+    # เหมือน pd.to_datetime("yyyy-mm-dd HH:MM:SS", format=..., errors="coerce") แต่สร้าง Timestamp ตรงๆ (เร็วกว่ามาก)
+    try:
+        h, mi, sec = (int(x) for x in hhmmss.split(":"))
+        return pd.Timestamp(yyyy, mm, dd, h, mi, sec)
+    except ValueError:
+        return pd.NaT
+
+def parse_incident_datetime(value):
+    # Handle direct Timestamp or datetime objects
+    if isinstance(value, (pd.Timestamp, datetime)):
+        ts = pd.Timestamp(value)
+        if ts.year >= 2400:
+            ts = ts - pd.DateOffset(years=543)
+        return ts
+
+    # Handle Excel numeric date format (days since 1899-12-30)
+    try:
+        if isinstance(value, (int, float)) and not pd.isna(value):
+            return pd.to_datetime(value, unit="d", origin="1899-12-30", errors="coerce")
+        # numeric string like "45678.0"
+        v = str(value)
+        if re.fullmatch(r"\d+(\.\d+)?", v):
+            return pd.to_datetime(float(v), unit="d", origin="1899-12-30", errors="coerce")
+    except Exception:
+        pass
+
+    # Handle string formats
+    s = normalize_raw_datetime_text(value)
+    if not s:
+        return pd.NaT
+
+    # Thai month: dd Mon yyyy [HH:MM[:SS]]
+    # --- สำคัญ: ทำให้วงเล็บชั้นในเป็น non-capturing ด้วย (?::\d{2})? ---
+    m_th = re.search(r"(\d{1,2})\s*([ก-๙\.]+)\s*(\d{4})\s*(\d{1,2}:\d{2}(?::\d{2})?)?", s)
+    if m_th:
+        dd_str = m_th.group(1)
+        mon_txt = m_th.group(2)
+        yyyy_str = m_th.group(3)
+        hhmmss_str = m_th.group(4)  # อาจเป็น None
+        dd = int(dd_str)
+        yyyy = int(yyyy_str)
+        hhmmss = hhmmss_str or "00:00:00"
+        # เติมวินาทีถ้ายังไม่มี
+        if len(hhmmss) == 5:
+            hhmmss = hhmmss + ":00"
+        mm = THAI_MONTHS.get(mon_txt.strip()) or THAI_MONTHS.get(mon_txt.strip() + ".")
+        if mm:
+            if yyyy >= 2400:
+                yyyy -= 543
+            return _timestamp_or_nat(yyyy, mm, dd, hhmmss)
+
+    # dd/mm/yyyy or dd-mm-yyyy [HH:MM[:SS]]
+    m_sep = re.search(r"(\d{1,2})[/-](\d{1,2})[/-](\d{4})(?:\s+(\d{1,2}:\d{2}(?::\d{2})?))?", s)
+    if m_sep:
+        dd_str = m_sep.group(1)
+        mm_str = m_sep.group(2)
+        yyyy_str = m_sep.group(3)
+        hhmmss_str = m_sep.group(4)  # อาจเป็น None
+        dd = int(dd_str)
+        mm = int(mm_str)
+        yyyy = int(yyyy_str)
+        hhmmss = hhmmss_str or "00:00:00"
+        if len(hhmmss) == 5:
+            hhmmss = hhmmss + ":00"
+        if yyyy >= 2400:
+            yyyy -= 543
+        return _timestamp_or_nat(yyyy, mm, dd, hhmmss)
+
+    # Fallback: แปลงปี พ.ศ. เป็น ค.ศ. ถ้าพบ
+    yr = re.search(r"\b(2\d{3})\b", s)
+    if yr:
+        y = int(yr.group(1))
+        if y >= 2400:
+            s = s.replace(str(y), str(y - 543), 1)
+
+    # Final fallback
+    return pd.to_datetime(s, dayfirst=True, errors="coerce")
+
+
+# =========================
+# 2) Risk / สี
+# =========================
+def map_impact_level_func(val):
+    s = str(val).strip().upper()
+    if s in ("A", "B", "1"): return "1"
+    if s in ("C", "D", "2"): return "2"
+    if s in ("E", "F", "3"): return "3"
+    if s in ("G", "H", "4"): return "4"
+    if s in ("I", "5"): return "5"
+    return "N/A"
+
+RISK_COLOR_TABLE = {
+    "11":"Low","12":"Low","13":"Low","14":"Medium","15":"Medium",
+    "21":"Low","22":"Low","23":"Medium","24":"Medium","25":"High",
+    "31":"Low","32":"Medium","33":"Medium","34":"High","35":"High",
+    "41":"Medium","42":"Medium","43":"High","44":"High","45":"Extreme",
+    "51":"Medium","52":"High","53":"High","54":"Extreme","55":"Extreme",
+}
+
+def compute_frequency_level(df: pd.DataFrame) -> pd.DataFrame:
+    if df.empty or 'Occurrence Date' not in df.columns or df['Occurrence Date'].isna().all():
+        return df.assign(**{'count':0, 'Incident Rate/mth':0.0, 'Frequency Level':'N/A'})
+    max_p = df['Occurrence Date'].max().to_period('M'); min_p = df['Occurrence Date'].min().to_period('M')
+    total_month_calc = max(1, (max_p.year - min_p.year) * 12 + (max_p.month - min_p.month) + 1)
+    counts = df['Incident'].value_counts(); out = df.copy()
+    out['count'] = out['Incident'].map(counts).fillna(0).astype(int)
+    out['Incident Rate/mth'] = (out['count'] / total_month_calc).round(1)
+    cond = [(out['Incident Rate/mth']<2.0), (out['Incident Rate/mth']<3.9), (out['Incident Rate/mth']<6.9), (out['Incident Rate/mth']<29.9)]
+    out['Frequency Level'] = np.select(cond, ['1','2','3','4'], default='5')
+    return out
+
+def summarize_max_risk_per_incident(df: pd.DataFrame) -> pd.DataFrame:
+    cols=['Incident','ชื่ออุบัติการณ์ความเสี่ยง','Max Risk','Category Color']
+    if df.empty or 'Risk Level' not in df.columns: return pd.DataFrame(columns=cols)
+    order={'1':1,'2':2,'3':3,'4':4,'5':5}; d2 = df[df['Risk Level'] != 'N/A'].copy()
+    if d2.empty: return pd.DataFrame(columns=cols)
+    d2['I_num'] = d2['Impact Level'].map(order).fillna(0).astype(int); d2['F_num'] = d2['Frequency Level'].map(order).fillna(0).astype(int)
+    d2['score'] = d2['I_num']*10 + d2['F_num']
+    idx = d2.groupby(['Incident','ชื่ออุบัติการณ์ความเสี่ยง'], observed=True)['score'].idxmax()
+    agg = d2.loc[idx, ['Incident','ชื่ออุบัติการณ์ความเสี่ยง','Risk Level','Category Color','Incident Rate/mth']].copy()
+    agg = agg.rename(columns={'Risk Level':'Max Risk', 'Incident Rate/mth':'rate'})
+    return agg.sort_values('rate', ascending=False).drop(columns='rate')
+
+# =========================
+# 3) จัดสคีมา
+# =========================
+def map_unique(values: pd.Series, fn) -> pd.Series:
+    """
+    เหมือน values.apply(fn) แต่เรียก fn ครั้งเดียวต่อค่าไม่ซ้ำ แล้วกระจายผลกลับด้วยรหัสจำนวนเต็ม (pd.factorize)
+    ใช้กับคอลัมน์ข้อความที่ค่าซ้ำกันมาก (หน่วยงาน, ระดับความรุนแรง, รหัส ...)
+    """
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    mapped = [fn(u) for u in uniques]
+    na = codes < 0
+    if na.any():
+        mapped.append(fn(values[na].iloc[0]))  # ค่าว่างทั้งหมดได้ผลเดียวกัน -> ช่องสุดท้าย
+        codes = np.where(na, len(mapped) - 1, codes)
+    out = pd.Series(mapped).take(codes)   # pd.Series(list) อนุมาน dtype แบบเดียวกับ apply
+    out.index, out.name = values.index, values.name
+    return out
+
+
+def _strip_str(values: pd.Series) -> pd.Series:
+    # เท่ากับ values.astype(str).str.strip() (astype(str) ก่อน factorize: 1 กับ 1.0 จะไม่ถูกรวมเป็นค่าเดียว)
+    return map_unique(values.astype(str), str.strip)
+
+
+def _resulting_action(x: str) -> str:
+    return 'None' if x.strip() == '' or x.strip().lower() == 'none' or pd.isna(x) else x
+
+
+@profiled()
+def massage_schema(df: pd.DataFrame, psg9_master: pd.DataFrame = None) -> pd.DataFrame:
+    required = ["รหัสหัวข้อ","หัวข้อ","วัน-เวลา ที่เกิดเหตุ","ระดับความรุนแรง", REF_COL]
+    missing = [c for c in required if c not in df.columns]
+    if missing:
+        raise SchemaError("ไม่พบคอลัมน์จำเป็น: " + ", ".join(missing))
+
+    lap = laps("massage_schema", df)
+    df = df.copy()
+    # Strip whitespace from all string columns first for consistency
+    for col in df.select_dtypes(include='object').columns:
+        if col not in ['Occurrence Date']:
+            df[col] = _strip_str(df[col])
+
+    df["รหัส: เรื่องอุบัติการณ์"] = df["รหัสหัวข้อ"] + ": " + df["หัวข้อ"]
+    df["Incident"] = df["รหัสหัวข้อ"]
+    df = df[df["Incident"] != ""].copy()
+    df["รหัส"] = df["Incident"].astype(str).str.slice(0,6)
+    df["ชื่ออุบัติการณ์ความเสี่ยง"] = df["หัวข้อ"]
+    lap("strip", df)
+
+    df.rename(columns={"วัน-เวลา ที่เกิดเหตุ": "Occurrence Date"}, inplace=True)
+    converted = map_unique(df["Occurrence Date"], parse_incident_datetime)
+    bad = converted.isna().sum()
+    
+    df["Occurrence Date"] = converted
+    df.dropna(subset=["Occurrence Date"], inplace=True)
+    if df.empty: raise SchemaError("ไม่พบข้อมูลที่มีวันที่ถูกต้อง")
+    lap("dates", df)
+
+    df["Impact"] = map_unique(df["ระดับความรุนแรง"].astype(str), str.upper)
+    df['Sentinel code for check'] = df['รหัส'].astype(str).str.strip() + '-' + df['Impact'].astype(str).str.strip()
+    df['Impact Level'] = map_unique(df['Impact'], map_impact_level_func)
+    df = compute_frequency_level(df)
+    df['Risk Level'] = np.where((df['Impact Level']!='N/A') & (df['Frequency Level'].notna()), df['Impact Level']+df['Frequency Level'], 'N/A')
+    df['Category Color'] = df['Risk Level'].map(RISK_COLOR_TABLE).fillna('Undefined')
+
+    df['Incident Type'] = df['Incident'].astype(str).str[:3]
+    lap("impact+frequency", df)
+    # เดือน/ปีปฏิทิน + ปีงบ/ไตรมาส คำนวณรอบเดียว (add_time_parts_fiscal จึงไม่ต้องทำซ้ำ)
+    for col, values in time_dimension(df['Occurrence Date']).items():
+        df[col] = values
+    lap("time", df)
+
+    # Normalize unit names before mapping
+    df["หน่วยงาน_norm"] = map_unique(df[REF_COL], normalize_unit)
+    df["กลุ่มงาน"] = df["หน่วยงาน_norm"].map(service_map_norm).fillna("N/A")
+    lap("units", df)
+
+    action_col_original = "การดำเนินการ/การแก้ไขที่ได้ดำเนินการไปแล้ว"
+    if "Resulting Actions" not in df.columns:
+        if action_col_original in df.columns:
+            df['Resulting Actions'] = map_unique(df[action_col_original].astype(str), _resulting_action).fillna('None')
+        else:
+            df["Resulting Actions"] = "None"
+
+        # --- PSG9 & หมวด Mapping ---
+        # (psg9_master = ตาราง PSG9code.xlsx จาก load_reference_tables)
+        if psg9_master is not None and not psg9_master.empty and 'รหัส' in psg9_master.columns:
+
+            # เตรียมไฟล์ PSG9 สำหรับ merge
+            cols_to_merge = ['รหัส']
+            if 'หมวดหมู่PSG' in psg9_master.columns:
+                cols_to_merge.append('หมวดหมู่PSG')
+            if 'หมวด' in psg9_master.columns:
+                cols_to_merge.append('หมวด')
+
+            psg9_to_merge = psg9_master[cols_to_merge].drop_duplicates(subset=['รหัส'])
+
+            # ทำให้คอลัมน์ 'รหัส' เป็น str ทั้งคู่เพื่อ merge
+            df['รหัส'] = df['รหัส'].astype(str)
+            psg9_to_merge['รหัส'] = psg9_to_merge['รหัส'].astype(str)
+
+            # --- ทำการ Merge ---
+            df = df.merge(psg9_to_merge, on='รหัส', how='left')
+
+            # --- 1. จัดการคอลัมน์ 'หมวดหมู่มาตรฐานสำคัญ' ---
+            if 'หมวดหมู่PSG' in df.columns:
+                # ถ้า merge สำเร็จ, ใช้ค่าที่ได้มา, ถ้าไม่ (ได้ค่า NaN) ให้เติม "ไม่จัดอยู่ใน..."
+                df['หมวดหมู่มาตรฐานสำคัญ'] = df['หมวดหมู่PSG'].fillna("ไม่จัดอยู่ใน PSG9 Catalog")
+                df = df.drop(columns=['หมวดหมู่PSG'])  # ลบคอลัมน์ที่ merge มาทิ้ง
+            else:
+                # ถ้าไฟล์ PSG9code.xlsx ไม่มีคอลัมน์ 'หมวดหมู่PSG'
+                df["หมวดหมู่มาตรฐานสำคัญ"] = "ไม่สามารถระบุ (ไม่มี 'หมวดหมู่PSG' ใน PSG9code.xlsx)"
+
+            # --- 2. จัดการคอลัมน์ 'หมวด' (สำหรับ Safety Goals / C,G analysis) ---
+            if 'หมวด' in df.columns:
+                # ถ้า merge สำเร็จ, ใช้ค่าที่ได้มา, ถ้าไม่ (ได้ค่า NaN) ให้เติม "N/A"
+                df['หมวด'] = df['หมวด'].fillna("N/A")
+            else:
+                # ถ้าไฟล์ PSG9code.xlsx ไม่มีคอลัมน์ 'หมวด'
+                df["หมวด"] = "N/A"
+                _warn("⚠️ ไม่พบคอลัมน์ 'หมวด' ใน PSG9code.xlsx - การวิเคราะห์ Safety Goals และ C/G อาจไม่แสดงผล")
+
+        else:
+            # ถ้าโหลดไฟล์ PSG9code.xlsx ไม่สำเร็จตั้งแต่แรก
+            _warn("❌ PSG9 mapping ล้มเหลว: ไม่พบ 'PSG9code.xlsx' หรือไฟล์มีปัญหา", level="error")
+            df["หมวดหมู่มาตรฐานสำคัญ"] = "ไม่สามารถระบุ (PSG9code.xlsx ไม่ได้โหลด/ข้อมูลไม่ครบถ้วน)"
+            df["หมวด"] = "N/A"
+
+        # --- END Mapping ---
+    lap("psg9_merge", df)
+
+    detail_col_original = "สรุปปัญหา/เหตุการณ์โดยย่อ"
+    if detail_col_original in df.columns:
+        df["รายละเอียดการเกิด_Anonymized"] = df[detail_col_original].fillna('')
+    else:
+        df["รายละเอียดการเกิด_Anonymized"] = ''
+    df.rename(columns={detail_col_original: "รายละเอียดการเกิด"}, inplace=True, errors='ignore')
+
+    cols_to_convert = ['self_report', 'potential_harm']
+    for col in cols_to_convert:
+        if col in df.columns:
+            df[col] = df[col].replace(['None', ''], np.nan)
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    if REF_COL not in df.columns: df[REF_COL] = "N/A"
+    df[REF_COL] = df[REF_COL].astype(str).fillna("N/A")
+    df['Resolved'] = resolved_mask(df)  # คำนวณครั้งเดียวตอนประมวลผล หน้าต่างๆ ใช้ร่วมกัน
+    lap("finish", df)
+    return df
+
+
+UNRESOLVED_ACTIONS = ['None', '', 'nan']
+
+
+def resolved_mask(df: pd.DataFrame) -> pd.Series:
+    """True = มีการดำเนินการแก้ไขแล้ว (ใช้คอลัมน์ 'Resolved' ถ้ามี, ไม่มีคำนวณจาก 'Resulting Actions')"""
+    if 'Resolved' in df.columns:
+        return df['Resolved'].astype(bool)
+    if 'Resulting Actions' not in df.columns:
+        return pd.Series(False, index=df.index)
+    return ~df['Resulting Actions'].astype(str).isin(UNRESOLVED_ACTIONS)
+
+
+# --- ธงรายแถว: คำนวณครั้งเดียวต่อชุดข้อมูล หน้า KPI ใช้ bitwise mask แทนการเทียบข้อความทุก rerun ---
+FLAG_COL = 'Flags'
+FLAG_PSG9, FLAG_SENTINEL, FLAG_SEVERE, FLAG_UNRESOLVED = 1, 2, 4, 8
+SEVERE_IMPACT_LEVELS = ['3', '4', '5']
+
+
+def incident_flags(df: pd.DataFrame, psg9_codes=None, sentinel_keys=None) -> np.ndarray:
+    """
+    uint8 ต่อแถว: FLAG_PSG9 (รหัสอยู่ใน PSG9code), FLAG_SENTINEL ('รหัส-Impact' อยู่ใน Sentinel2024),
+    FLAG_SEVERE (Impact Level 3-5), FLAG_UNRESOLVED (ยังไม่มีการแก้ไข ตาม resolved_mask)
+    """
+    flags = np.zeros(len(df), dtype=np.uint8)
+    if df.empty:
+        return flags
+    if psg9_codes and 'รหัส' in df.columns:
+        flags[df['รหัส'].astype(str).isin(list(psg9_codes)).to_numpy()] |= FLAG_PSG9
+    if sentinel_keys and {'รหัส', 'Impact'} <= set(df.columns):
+        keys = df['Sentinel code for check'] if 'Sentinel code for check' in df.columns else \
+            df['รหัส'].astype(str).str.strip() + '-' + df['Impact'].astype(str).str.strip()
+        flags[keys.isin(list(sentinel_keys)).to_numpy()] |= FLAG_SENTINEL
+    if 'Impact Level' in df.columns:
+        flags[df['Impact Level'].isin(SEVERE_IMPACT_LEVELS).to_numpy()] |= FLAG_SEVERE
+    flags[~resolved_mask(df).to_numpy()] |= FLAG_UNRESOLVED
+    return flags
+
+
+def flag_mask(df: pd.DataFrame, bits: int) -> np.ndarray:
+    """True เมื่อแถวมีครบทุกบิตใน bits (เช่น FLAG_SEVERE | FLAG_UNRESOLVED)"""
+    return (df[FLAG_COL].to_numpy() & bits) == bits
+
+
+def flag_counts(df: pd.DataFrame, *bit_sets) -> list:
+    """จำนวนแถวของแต่ละชุดบิต — bincount ค่าธงรอบเดียว (16 ค่า) แล้วรวมค่าที่มีบิตครบ"""
+    hist = np.bincount(df[FLAG_COL].to_numpy(), minlength=16) if len(df) else np.zeros(16, dtype=np.int64)
+    values = np.arange(len(hist))
+    return [int(hist[(values & bits) == bits].sum()) for bits in bit_sets]
+
+
+def status_index(df: pd.DataFrame, column: str, row_mask=None) -> dict:
+    """
+    ค่าในคอลัมน์ (เรียงตามค่า) -> {'rows': ตำแหน่งแถว, 'total': จำนวน, 'resolved': แก้ไขแล้ว}
+    ใช้ factorize + bincount ครั้งเดียว แทนการกรองข้อมูลทีละหมวด
+    """
+    if df.empty or column not in df.columns:
+        return {}
+    codes, uniques = pd.factorize(df[column], sort=True)
+    if row_mask is not None:
+        codes = np.where(np.asarray(row_mask, dtype=bool), codes, -1)
+    keep = codes >= 0
+    total = np.bincount(codes[keep], minlength=len(uniques))
+    resolved = np.bincount(codes[keep], weights=resolved_mask(df).to_numpy()[keep], minlength=len(uniques))
+    order = np.argsort(codes, kind='stable')[len(codes) - int(keep.sum()):]
+    bounds = np.concatenate([[0], np.cumsum(total)])
+    return {uniques[i]: {'rows': order[bounds[i]:bounds[i + 1]], 'total': int(total[i]), 'resolved': int(resolved[i])}
+            for i in range(len(uniques)) if total[i] > 0}
+
+# =========================
+# 4) Time parts (Fiscal Year) + ฟิลเตอร์
+# =========================
+FISCAL_QUARTERS = ['Q1', 'Q2', 'Q3', 'Q4']
+TIME_COLUMNS = ['Month', 'เดือน', 'Year', 'Year_int', 'Month_int', 'FY_int', 'FQuarter', 'FY_Quarter']
+
+
+def time_dimension(dates: pd.Series) -> dict:
+    """
+    คอลัมน์เวลาทั้งหมดจาก datetime64 (ต้องไม่มี NaT) ด้วยเลขจำนวนเต็มล้วน ไม่มีการเรียก Python ต่อแถว
+      Month / Month_int / Year_int / FY_int  -> จำนวนเต็ม (ปีงบเริ่ม ต.ค.)
+      เดือน / FQuarter                       -> categorical ค่าคงที่ (ม.ค...ธ.ค. / Q1..Q4)
+      Year / FY_Quarter                      -> categorical จากค่าที่พบ ('2024' / '2024-Q1')
+    """
+    months = dates.to_numpy(dtype='datetime64[M]').astype(np.int64)  # เดือนนับจาก 1970-01
+    year = months // 12 + 1970
+    month = months % 12 + 1
+    fy = year + (month >= 10)
+    fq = (month + 2) % 12 // 3  # ต.ค.-ธ.ค. -> 0 (Q1), ม.ค.-มี.ค. -> 1 ...
+    year_u, year_code = np.unique(year, return_inverse=True)
+    fyq_u, fyq_code = np.unique(fy * 4 + fq, return_inverse=True)
+    parts = {
+        'Month': month.astype(np.int32),
+        'เดือน': pd.Categorical.from_codes(month - 1, [TH_MONTH_TINY[i] for i in range(1, 13)]),
+        'Year': pd.Categorical.from_codes(year_code, year_u.astype(str)),
+        'Year_int': year,
+        'Month_int': month,
+        'FY_int': fy,
+        'FQuarter': pd.Categorical.from_codes(fq, FISCAL_QUARTERS),
+        'FY_Quarter': pd.Categorical.from_codes(fyq_code, [f"{k // 4}-{FISCAL_QUARTERS[k % 4]}" for k in fyq_u]),
+    }
+    return {col: pd.Series(values, index=dates.index, name=col) for col, values in parts.items()}
+
+
+@profiled()
+def add_time_parts_fiscal(df: pd.DataFrame) -> pd.DataFrame:
+    """เติมคอลัมน์เวลา (TIME_COLUMNS) — ข้อมูลจาก massage_schema มีครบแล้วคืนค่าเดิม, ไม่ copy ข้อมูลทั้งตาราง"""
+    if df.empty or 'Occurrence Date' not in df.columns: return df
+    if all(c in df.columns for c in TIME_COLUMNS): return df
+    out = df.copy(deep=False)  # เพิ่มคอลัมน์ใน shallow copy ไม่กระทบ df ของผู้เรียก
+    for col, values in time_dimension(out['Occurrence Date']).items():
+        out[col] = values
+    return out
+
+@profiled("filter: period")
+def filter_by_period_fiscal(df: pd.DataFrame, mode: str, fy: str|int|None=None, fq: str|None=None, m: int|None=None) -> pd.DataFrame:
+    if df.empty or mode == "ทั้งหมด": return df
+    out = df.copy()
+    fy_str = str(fy) if fy not in (None, "", "-- ทั้งหมด --") else None
+    if mode == "รายปี" and fy_str and 'FY_int' in out.columns: out = out[out['FY_int'].astype(str) == fy_str]
+    elif mode == "รายไตรมาส":
+        if fy_str and 'FY_int' in out.columns: out = out[out['FY_int'].astype(str) == fy_str]
+        if fq and fq != "-- ทั้งหมด --" and 'FQuarter' in out.columns: out = out[out['FQuarter'] == fq]
+    elif mode == "รายเดือน":
+        if fy_str and 'FY_int' in out.columns: out = out[out['FY_int'].astype(str) == fy_str]
+        if m and m != "-- ทั้งหมด --" and 'Month_int' in out.columns: out = out[out['Month_int'].astype(int) == int(m)]
+    return out
+def _normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    new_cols = []
+    for c in df.columns:
+        if isinstance(c, tuple):
+            c = " ".join([str(x) for x in c if x not in (None, "")])
+        c = str(c).replace("\ufeff", "").strip()
+        new_cols.append(c)
+    df.columns = new_cols
+    return df
+
+def _rename_to_standard(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    candidates = {
+        "กลุ่มงาน": ["กลุ่มงาน", "กลุ่ม", "Group", "กลุ่มงาน/ฝ่าย", "กลุ่มงาน (Group)"],
+        "หน่วยงาน": [
+            "หน่วยงาน", "หน่วย", "Unit", "Department",
+            "หน่วยงาน/แผนก", "ฝ่าย/หน่วยงาน", "หน่วยงานที่เกิดเหตุ",
+            "ชื่อหน่วยงาน", "หน่วยที่เกี่ยวข้อง", "ภาควิชา/หน่วยงาน"
+        ],
+    }
+    for target, cands in candidates.items():
+        if target not in df.columns:
+            for c in cands:
+                if c in df.columns:
+                    df = df.rename(columns={c: target})
+                    break
+    return df
+
+@profiled("filter: group/unit")
+def filter_by_group_and_unit(df: pd.DataFrame, group_name: str, unit_name: str) -> pd.DataFrame:
+    if df.empty:
+        return df
+
+    out = _normalize_columns(df)
+    out = _rename_to_standard(out)
+
+    required = ["กลุ่มงาน", REF_COL]  # REF_COL = "หน่วยงาน"
+    missing = [c for c in required if c not in out.columns]
+    if missing:
+        _warn(f"ไม่พบคอลัมน์ที่ต้องใช้ในการกรอง: {', '.join(missing)} — จะแสดงข้อมูลทั้งหมดแทน")
+        return out
+
+    def _norm(x): return str(x).strip().lower()
+
+    if group_name not in (None, "", "-- เลือกกลุ่มงาน --", "-- ทั้งหมด --"):
+        out = out[out["กลุ่มงาน"].astype(str).str.strip() == str(group_name).strip()]
+
+    if unit_name not in (None, "", "-- ทั้งหมด --"):
+        out = out[out[REF_COL].astype(str).str.strip() == str(unit_name).strip()]
+
+    return out
+
+
+# =========================
+# 5) ไฟล์อ้างอิง (PSG9 / Sentinel / Risk mitigation / Code2024)
+# =========================
+def load_reference_tables(base_dir=".", cache_dir=None) -> dict:
+    """
+    โหลดไฟล์นิยามทั้งหมดจาก base_dir (ผ่าน snapshot ใน cache_dir ถ้ากำหนด — ดู reference_data)
+    คืนค่า dict: PSG9code_df_master, psg9_r_codes_for_counting, PSG9_label_dict,
+                 Sentinel2024_df, sentinel_composite_keys, df_mitigation
+    """
+    ref = load_reference_data(base_dir, cache_dir)
+    for level, msg in ref.messages:
+        if CODE_MAPPING_FILE not in msg:
+            _warn(msg, level=level)
+    return ref.as_tables()
+
+
+def load_code_mapping(base_dir=".", cache_dir=None) -> pd.DataFrame:
+    """Code2024.xlsx (Sheet1) สำหรับตารางสรุปตาม Safety Goals — ไม่พบไฟล์คืน DataFrame ว่าง"""
+    path = Path(base_dir) / CODE_MAPPING_FILE
+    if not path.is_file():
+        _warn(f"ไม่พบ '{CODE_MAPPING_FILE}'")
+        return pd.DataFrame(columns=['หมวด', 'ประเภท'])
+    return read_workbook(path, WORKBOOKS[CODE_MAPPING_FILE], cache_dir)
+
+
+@profiled()
+def read_incident_file(path, name: str = None) -> pd.DataFrame:
+    """อ่านไฟล์อุบัติการณ์ .csv / .xlsx / .xls จาก path, URL หรือ buffer (ระบุ name เพื่อดูนามสกุล)"""
+    name = str(name if name is not None else path).lower()
+    if name.endswith(".csv"): return pd.read_csv(path)
+    if name.endswith((".xlsx", ".xls")): return pd.read_excel(path, engine="openpyxl")
+    raise ValueError("รองรับ .csv, .xlsx, .xls")
+
+
+def process_incident_frame(raw_df: pd.DataFrame, psg9_master: pd.DataFrame = None) -> pd.DataFrame:
+    """ขั้นตอนเดียวกับแอป: massage_schema -> add_time_parts_fiscal"""
+    return add_time_parts_fiscal(massage_schema(raw_df, psg9_master))
+
+
+# --- นำเข้าหลายไฟล์ / หลายโรงพยาบาล (คอลัมน์ HOSPITAL_COL นิยามใน incident_cube) ---
+
+
+def hospital_name_from_file(name) -> str:
+    """ชื่อโรงพยาบาลตั้งต้นจากชื่อไฟล์ (ไม่รวมนามสกุล)"""
+    return Path(str(name)).stem.strip() or "N/A"
+
+
+def _ingest_one(hospital: str, name: str, data, psg9_master: pd.DataFrame):
+    """
+    งานของแต่ละ process: อ่าน + จัดสคีมาไฟล์เดียว
+    คืน (df หรือ None, [(level, ข้อความ)], ข้อความ error หรือ None) — ไม่ส่ง warning ข้าม process
+    """
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always", PipelineWarning)
+        try:
+            src = io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data
+            df = process_incident_frame(read_incident_file(src, name), psg9_master)
+            df[HOSPITAL_COL] = hospital
+            error = None
+        except Exception as e:
+            df, error = None, str(e)
+    messages = [(w.message.level, str(w.message)) for w in caught if isinstance(w.message, PipelineWarning)]
+    return df, messages, error
+
+
+@profiled()
+def ingest_incident_files(sources, psg9_master: pd.DataFrame = None, max_workers: int = None) -> pd.DataFrame:
+    """
+    sources = [(โรงพยาบาล, ชื่อไฟล์, bytes หรือ path), ...]
+    แต่ละไฟล์อ่าน/จัดสคีมาพร้อมกันใน ProcessPoolExecutor (เวลารวม ≈ ไฟล์ที่ช้าที่สุด)
+    process ใหม่แบบ spawn (fork จาก server ที่มีหลาย thread อาจค้าง); pool ล้ม (เช่น worker ถูก OOM kill)
+    -> ประมวลผลไฟล์ที่เหลือทีละไฟล์ใน process นี้แทน
+    แล้วต่อกันเป็นชุดเดียว แบ่งส่วนตามคอลัมน์ 'โรงพยาบาล' (category, เรียงตามลำดับไฟล์)
+    ไฟล์ที่ประมวลผลไม่ได้แจ้งเป็น PipelineWarning(level='error'); ถ้าไม่สำเร็จเลยสักไฟล์ -> SchemaError
+    """
+    sources = list(sources)
+    if not sources:
+        return pd.DataFrame()
+    workers = min(len(sources), max_workers or os.cpu_count() or 1)
+    results = [None] * len(sources)
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as ex:
+                futures = [ex.submit(_ingest_one, h, n, d, psg9_master) for h, n, d in sources]
+                for i, f in enumerate(futures):
+                    results[i] = f.result()
+        except (BrokenProcessPool, OSError) as e:
+            _warn(f"ประมวลผลหลายไฟล์พร้อมกันไม่สำเร็จ ({e or type(e).__name__}) — ประมวลผลทีละไฟล์แทน")
+    results = [r if r is not None else _ingest_one(h, n, d, psg9_master) for r, (h, n, d) in zip(results, sources)]
+
+    frames, errors = [], []
+    for (hospital, name, _), (df, messages, error) in zip(sources, results):
+        for level, msg in messages:
+            _warn(f"[{name}] {msg}", level=level)
+        if error is not None:
+            errors.append(f"{name}: {error}")
+            _warn(f"ประมวลผล '{name}' ไม่สำเร็จ: {error}", level="error")
+        elif not df.empty:
+            frames.append(df)
+    if not frames:
+        raise SchemaError("ไม่มีไฟล์ที่ประมวลผลสำเร็จ" + (f" ({'; '.join(errors)})" if errors else ""))
+
+    out = pd.concat(frames, ignore_index=True)
+    for col, values in time_dimension(out['Occurrence Date']).items():
+        out[col] = values  # categorical ต่างไฟล์มีหมวดไม่เท่ากัน concat แล้วกลายเป็น object -> สร้างใหม่จากชุดรวม
+    hospitals = list(dict.fromkeys(h for h, _, _ in sources))
+    out[HOSPITAL_COL] = pd.Categorical(out[HOSPITAL_COL], categories=hospitals)
+    return out
+
+
+@profiled("filter: hospital")
+def filter_by_hospital(df: pd.DataFrame, hospitals) -> pd.DataFrame:
+    """กรองตามรายชื่อโรงพยาบาล (ว่าง/None = ทั้งหมด)"""
+    if df.empty or not hospitals or HOSPITAL_COL not in df.columns:
+        return df
+    return df[df[HOSPITAL_COL].isin(list(hospitals))]
+
+
+def _text_equals(values: pd.Series, target, strip: bool = False) -> np.ndarray:
+    """values.astype(str) (.str.strip()) == target — เปรียบเทียบต่อค่าไม่ซ้ำแล้วกระจายผลด้วยรหัส"""
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    labels, target = pd.Index(uniques).astype(str), str(target)
+    if strip:
+        labels, target = labels.str.strip(), target.strip()
+    return np.asarray(labels == target)[codes]
+
+
+@profiled("filter: positions")
+def filter_positions(df: pd.DataFrame, mode: str = "ทั้งหมด", fy=None, fq=None, m=None, hospitals=None,
+                     group_name=None, unit_name=None) -> np.ndarray:
+    """
+    ตำแหน่งแถว (df.iloc) ที่ผ่านตัวกรองชุดเดียวกับ filter_by_period_fiscal -> filter_by_hospital
+    -> filter_by_group_and_unit โดยไม่ copy ข้อมูลระหว่างขั้น (ผลเทียบเท่า df.iloc[ตำแหน่ง])
+    """
+    keep = np.ones(len(df), dtype=bool)
+    if df.empty:
+        return np.flatnonzero(keep)
+    fy_str = str(fy) if fy not in (None, "", "-- ทั้งหมด --") else None
+    if mode in ("รายปี", "รายไตรมาส", "รายเดือน") and fy_str and 'FY_int' in df.columns:
+        keep &= _text_equals(df['FY_int'], fy_str)
+    if mode == "รายไตรมาส" and fq and fq != "-- ทั้งหมด --" and 'FQuarter' in df.columns:
+        keep &= (df['FQuarter'] == fq).to_numpy()
+    if mode == "รายเดือน" and m and m != "-- ทั้งหมด --" and 'Month_int' in df.columns:
+        keep &= (pd.to_numeric(df['Month_int'], errors='coerce') == int(m)).to_numpy()
+    if hospitals and HOSPITAL_COL in df.columns:
+        keep &= df[HOSPITAL_COL].isin(list(hospitals)).to_numpy()
+    missing = [c for c in ("กลุ่มงาน", REF_COL) if c not in df.columns]
+    if missing:
+        _warn(f"ไม่พบคอลัมน์ที่ต้องใช้ในการกรอง: {', '.join(missing)} — จะแสดงข้อมูลทั้งหมดแทน")
+        return np.flatnonzero(keep)
+    if group_name not in (None, "", "-- เลือกกลุ่มงาน --", "-- ทั้งหมด --"):
+        keep &= _text_equals(df["กลุ่มงาน"], group_name, strip=True)
+    if unit_name not in (None, "", "-- ทั้งหมด --"):
+        keep &= _text_equals(df[REF_COL], unit_name, strip=True)
+    return np.flatnonzero(keep)
+
+
+# =========================
+# 6) ตารางผลลัพธ์ที่ไม่ขึ้นกับ UI
+# =========================
+@profiled()
+def build_risk_matrix(df: pd.DataFrame) -> pd.DataFrame:
+    idx = list("54321"); cols = list("12345"); empty_mat = pd.DataFrame(0, index=idx, columns=cols)
+    if df.empty or 'Risk Level' not in df.columns: return empty_mat
+    valid_df = df[(df['Risk Level'] != 'N/A') & df['Impact Level'].isin(idx) & df['Frequency Level'].isin(cols)]
+    if valid_df.empty: return empty_mat
+    mat = pd.crosstab(valid_df['Impact Level'], valid_df['Frequency Level'])
+    return mat.reindex(index=idx, columns=cols, fill_value=0)
+
+
+@profiled()
+def find_sentinel_events(df: pd.DataFrame, sentinel_composite_keys: set, sentinel_df: pd.DataFrame = None) -> pd.DataFrame:
+    """แถวที่ 'รหัส-Impact' ตรงกับ Sentinel2024 พร้อมชื่อ Sentinel Event (ถ้ามี)"""
+    if df.empty or 'Sentinel code for check' not in df.columns: return pd.DataFrame()
+    events = df[df['Sentinel code for check'].isin(sentinel_composite_keys)].copy()
+    if events.empty or sentinel_df is None or sentinel_df.empty or 'ชื่ออุบัติการณ์ความเสี่ยง' not in sentinel_df.columns:
+        return events
+    names = sentinel_df[['รหัส', 'Impact', 'ชื่ออุบัติการณ์ความเสี่ยง']].rename(
+        columns={'ชื่ออุบัติการณ์ความเสี่ยง': 'Sentinel Event Name'}).drop_duplicates(['รหัส', 'Impact'])
+    return pd.merge(events, names, on=['รหัส', 'Impact'], how='left')
+
+
+# --- START: Helper Functions for Incident Analysis ---
+
+@profiled()
+def create_psg9_summary_table(input_df, psg9_label_dict: dict = None, tab: SeverityTab = None):
+    if not isinstance(input_df,
+                      pd.DataFrame) or 'หมวดหมู่มาตรฐานสำคัญ' not in input_df.columns or 'Impact' not in input_df.columns: return None
+    # (psg9_label_dict = PSG_ID -> หมวดหมู่PSG จาก load_reference_tables)
+    return psg9_table(tab if tab is not None else build_severity_tab(input_df), psg9_label_dict)
+
+
+@profiled()
+def create_summary_table_by_code(dataframe, tab: SeverityTab = None):
+    """
+    สร้างตารางสรุปจำนวนอุบัติการณ์ตาม 'รหัส' และระดับความรุนแรง
+    โดยในแถวจะแสดงทั้งรหัสและชื่อของอุบัติการณ์
+    """
+    required_cols = ['รหัส', 'ชื่ออุบัติการณ์ความเสี่ยง', 'Impact']
+    if not all(col in dataframe.columns for col in required_cols):
+        missing_cols = [col for col in required_cols if col not in dataframe.columns]
+        _warn(f"ไม่สามารถสร้างตารางได้ เนื่องจากขาดคอลัมน์: {', '.join(missing_cols)}")
+        return pd.DataFrame()
+    return code_table(tab if tab is not None else build_severity_tab(dataframe))
+
+
+@profiled()
+def create_summary_table_by_category(dataframe, category_column_name, tab: SeverityTab = None, code_prefix: str = None):
+    """
+    สร้างตารางสรุปจำนวนอุบัติการณ์ตามหมวดหมู่และระดับความรุนแรง
+    (code_prefix = 'C' / 'G' เลือกเฉพาะรหัสที่ขึ้นต้นด้วยอักษรนั้น)
+    """
+    if category_column_name not in dataframe.columns or 'Impact' not in dataframe.columns:
+        _warn(f"ไม่พบคอลัมน์ '{category_column_name}' หรือ 'Impact' ในข้อมูล", level="error")
+        return pd.DataFrame()
+    if tab is None or category_column_name not in tab.entries.columns:
+        dims = SEVERITY_DIMS if category_column_name in SEVERITY_DIMS else SEVERITY_DIMS + (category_column_name,)
+        tab = build_severity_tab(dataframe, dims)
+    return category_table(tab, category_column_name, code_prefix)
+
+
+# --- END: Helper Functions for Incident Analysis ---
+
+@profiled()
+def create_goal_summary_table(df_incident: pd.DataFrame, code_mapping: pd.DataFrame, type_order: dict = None,
+                              rollup: GoalRollup = None):
+    """
+    สร้างตารางสรุปเหตุการณ์ตาม Safety Goals ทั้ง 4 หมวด
+    - ใช้ Code2024.xlsx (code_mapping) เป็นตัวกำหนดลำดับ Incident Type
+      (type_order = ReferenceData.goal_type_order ที่คำนวณไว้แล้ว ถ้าส่งมาไม่ต้องคำนวณจาก code_mapping ใหม่)
+    - df_incident ต้องมีคอลัมน์: 'หมวด', 'ประเภท', 'ระดับความรุนแรง'
+    - rollup = GoalRollup ของ df_incident ที่นับไว้แล้ว (ไม่ส่งมาจะนับเอง — ดู goal_rollup.py)
+    คืนค่า: dict ชื่อหมวด (แบบในรายงาน NRLS) -> DataFrame สรุป
+    """
+    if type_order is None:
+        type_order = goal_type_order(code_mapping)
+    return (rollup if rollup is not None else build_goal_rollup(df_incident)).tables(type_order)
+
+
+
+RISK_LEVEL_ORDINAL_SCORE = {"51": 21, "52": 22, "53": 23, "54": 24, "55": 25, "41": 16, "42": 17, "43": 18, "44": 19,
+                            "45": 20, "31": 11, "32": 12, "33": 13, "34": 14, "35": 15, "21": 6, "22": 7, "23": 8,
+                            "24": 9, "25": 10, "11": 1, "12": 2, "13": 3, "14": 4, "15": 5}
+
+def _finish_persistence_metrics(persistence_metrics: pd.DataFrame, incident_names: pd.DataFrame, total_months: int):
+    total_months = max(1, total_months)
+    persistence_metrics['Incident_Rate_Per_Month'] = persistence_metrics['Total_Occurrences'] / total_months
+    max_rate = max(1, persistence_metrics['Incident_Rate_Per_Month'].max()) if not persistence_metrics.empty else 1
+    persistence_metrics['Frequency_Score'] = persistence_metrics['Incident_Rate_Per_Month'] / max_rate
+    persistence_metrics['Avg_Severity_Score'] = persistence_metrics['Average_Ordinal_Risk_Score'] / 25.0
+    persistence_metrics['Persistence_Risk_Score'] = persistence_metrics['Frequency_Score'] + persistence_metrics[
+        'Avg_Severity_Score']
+    final_df = pd.merge(persistence_metrics, incident_names, on='รหัส', how='left')
+    return final_df.sort_values(by='Persistence_Risk_Score', ascending=False)
+
+def calculate_persistence_risk_score(_df: pd.DataFrame, total_months: int):
+    risk_level_map_to_score = RISK_LEVEL_ORDINAL_SCORE
+    if _df.empty or 'รหัส' not in _df.columns or 'Risk Level' not in _df.columns: return pd.DataFrame()
+    analysis_df = _df[['รหัส', 'ชื่ออุบัติการณ์ความเสี่ยง', 'Risk Level']].copy()
+    analysis_df['Ordinal_Risk_Score'] = analysis_df['Risk Level'].astype(str).map(risk_level_map_to_score)
+    analysis_df.dropna(subset=['Ordinal_Risk_Score'], inplace=True)
+    if analysis_df.empty: return pd.DataFrame()
+    persistence_metrics = analysis_df.groupby('รหัส').agg(Average_Ordinal_Risk_Score=('Ordinal_Risk_Score', 'mean'),
+                                                          Total_Occurrences=('รหัส', 'size')).reset_index()
+    incident_names = _df[['รหัส', 'ชื่ออุบัติการณ์ความเสี่ยง']].drop_duplicates()
+    return _finish_persistence_metrics(persistence_metrics, incident_names, total_months)
+
+def _cube_entry_risk_scores(cube):
+    """(score, impact_levels): คะแนน ordinal ของช่อง (entry, severity) = map(Impact Level + Frequency Level), NaN = ไม่มีระดับ"""
+    impact_levels = np.array([map_impact_level_func(s) for s in cube.severities], dtype=object)
+    risk_keys = impact_levels[None, :] + cube.entries['Frequency Level'].to_numpy(dtype=object)[:, None]
+    score = pd.Series(risk_keys.ravel()).map(RISK_LEVEL_ORDINAL_SCORE).to_numpy(dtype=float).reshape(risk_keys.shape)
+    return score, impact_levels
+
+@profiled()
+def persistence_risk_from_cube(cube, series_mask, month_mask, total_months: int):
+    """เหมือน calculate_persistence_risk_score แต่รวมจาก count cube (entry × severity) แทนการวนข้อมูลดิบ"""
+    if cube is None: return pd.DataFrame()
+    es = cube.entry_severity(series_mask, month_mask)
+    if es.sum() == 0: return pd.DataFrame()
+    entries = cube.entries
+    score, _ = _cube_entry_risk_scores(cube)
+    valid = ~np.isnan(score)
+    valid_counts = np.where(valid, es, 0)
+    by_code = pd.DataFrame({'รหัส': entries['รหัส'].to_numpy(),
+                            'n': valid_counts.sum(axis=1),
+                            'weighted': np.where(valid, es * np.nan_to_num(score), 0).sum(axis=1)})
+    by_code = by_code.groupby('รหัส', sort=True)[['n', 'weighted']].sum()
+    by_code = by_code[by_code['n'] > 0]
+    if by_code.empty: return pd.DataFrame()
+    persistence_metrics = pd.DataFrame({'รหัส': by_code.index,
+                                        'Average_Ordinal_Risk_Score': (by_code['weighted'] / by_code['n']).to_numpy(),
+                                        'Total_Occurrences': by_code['n'].to_numpy()})
+    seen = es.sum(axis=1) > 0
+    incident_names = entries.loc[seen, ['รหัส', 'ชื่ออุบัติการณ์ความเสี่ยง']].drop_duplicates()
+    return _finish_persistence_metrics(persistence_metrics, incident_names, total_months)
+
+
+@profiled()
+def rolling_persistence_from_cube(cube, series_mask=None, month_mask=None) -> RollingPersistence:
+    """prefix sum รายเดือนต่อรหัส (จำนวนครั้งที่มีคะแนน + ผลรวมคะแนน ordinal) สำหรับ Persistence แบบ rolling"""
+    esm = cube.entry_severity_month(series_mask, month_mask)
+    score, _ = _cube_entry_risk_scores(cube)
+    valid = ~np.isnan(score)
+    n_entry = (esm * valid[:, :, None]).sum(axis=1)
+    w_entry = (esm * np.nan_to_num(score)[:, :, None]).sum(axis=1)
+    code_id, codes = pd.factorize(cube.entries['รหัส'], sort=True)
+    n = np.zeros((len(codes), esm.shape[2])); np.add.at(n, code_id, n_entry)
+    w = np.zeros((len(codes), esm.shape[2])); np.add.at(w, code_id, w_entry)
+    months = cube.months if month_mask is None else cube.months[month_mask]
+    return RollingPersistence.from_monthly(codes, months, n, w)
+
+@profiled()
+def prioritize_incidents_nb_logit_v2(_df: pd.DataFrame, horizon: int = 3,
+                                     w_freq: float = 0.34, w_sev: float = 0.33, w_trend: float = 0.33,
+                                     cube_view=None, method: str = "vectorized") -> pd.DataFrame:
+    """
+    Early Warning: fit แนวโน้ม Negative Binomial รายรหัส (ดู early_warning.py) บนเมทริกซ์ รหัส × เดือน
+    cube_view = (cube, series_mask, month_mask) จาก cube_selection(); ถ้าไม่ส่งมาจะสร้าง cube จาก _df
+    """
+    if _df.empty: return pd.DataFrame()
+    cube, series_mask, month_mask = cube_view if cube_view is not None else (build_incident_cube(_df), None, None)
+    em = cube.entry_month(series_mask, month_mask)
+    es = cube.entry_severity(series_mask, month_mask)
+    if em.shape[1] == 0 or em.sum() == 0: return pd.DataFrame()
+
+    # รวม entry -> รหัส
+    code_id, codes = pd.factorize(cube.entries['รหัส'], sort=True)
+    Y = np.zeros((len(codes), em.shape[1]), dtype=np.int64); np.add.at(Y, code_id, em)
+    sev = np.zeros((len(codes), es.shape[1]), dtype=np.int64); np.add.at(sev, code_id, es)
+    score, impact_levels = _cube_entry_risk_scores(cube)
+    valid = ~np.isnan(score)
+    weighted = np.zeros(len(codes)); np.add.at(weighted, code_id, np.where(valid, es * np.nan_to_num(score), 0).sum(1))
+    n_valid = np.zeros(len(codes)); np.add.at(n_valid, code_id, np.where(valid, es, 0).sum(1))
+    severe = np.isin(impact_levels, ["3", "4", "5"])
+    names = cube.entries.loc[es.sum(1) > 0].groupby('รหัส')['ชื่ออุบัติการณ์ความเสี่ยง'].first().reindex(codes)
+
+    keep = Y.sum(1) > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_risk = np.where(n_valid > 0, weighted / n_valid, np.nan)
+        severe_share = sev[:, severe].sum(1) / sev.sum(1)
+    # เดือนที่เลือกไม่ต่อเนื่อง (เช่น รายเดือน/รายไตรมาสโดยไม่เลือกปีงบ = เดือนเดียวกันของหลายปี) -> ไม่ fit แนวโน้ม
+    if month_mask is not None and np.any(np.diff(np.flatnonzero(month_mask)) != 1):
+        method = "flat"
+    return rank_early_warning(Y[keep], np.asarray(codes)[keep], names.to_numpy()[keep], avg_risk[keep],
+                              severe_share[keep], horizon=horizon, w_freq=w_freq, w_sev=w_sev, w_trend=w_trend,
+                              method=method)
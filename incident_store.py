@@ -0,0 +1,155 @@
+# incident_store.py
+# -*- coding: utf-8 -*-
+# ที่เก็บข้อมูลอุบัติการณ์ที่ประมวลผลแล้ว: Parquet แบ่งพาร์ทิชันแบบ hive ตาม โรงพยาบาล / FY_int / FQuarter
+#
+#   data/incident_store/โรงพยาบาล=A/FY_int=2024/FQuarter=Q1/part-0.parquet
+#
+# ตัวกรองช่วงเวลา (ความหมายเดียวกับ filter_by_period_fiscal) แปลงเป็น pyarrow expression:
+#   ปีงบ / ไตรมาส / โรงพยาบาล -> ตัดทิ้งทั้งโฟลเดอร์พาร์ทิชัน (ไม่เปิดไฟล์)
+#   เดือน                   -> ข้าม row group ด้วยสถิติ min/max ของ Month_int (ในไฟล์เรียงตาม Month_int)
+# read_incident_store(root, mode, fy, ...) อ่านจากดิสก์เฉพาะช่วงที่เลือก (งาน batch / วิเคราะห์นอกแอป)
+# ฝั่งแอปอ่านทั้ง store ครั้งเดียวเข้าทะเบียนชุดข้อมูล (ใช้ร่วมทุก session, key = store_version) แล้วกรองในหน่วยความจำ
+# เพราะ cube / Persistence / SPC ใช้ทั้งประวัติอยู่แล้ว — หน่วยความจำของแอปจึงเท่ากับข้อมูลทั้งชุด ไม่ใช่ช่วงที่เลือก
+#
+# Arrow snapshot (write_arrow_snapshot / map_arrow_snapshot): ข้อมูลทั้งชุดเป็นไฟล์ Arrow IPC ไฟล์เดียวที่ memory-map
+#   หลาย worker process เปิดไฟล์เดียวกัน -> ใช้หน้าหน่วยความจำชุดเดียวกันใน page cache ของ OS
+#   คอลัมน์ตัวเลข/วันที่ (ไม่มีค่าว่าง) และข้อความ (string[pyarrow_numpy]) ชี้ไปที่ buffer ของไฟล์โดยตรง ไม่ copy
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from atomic_files import write_atomic
+from incident_pipeline import HOSPITAL_COL, FISCAL_QUARTERS
+from stage_profiler import profiled
+
+PERIOD_PARTITIONS = ['FY_int', 'FQuarter']
+ROW_GROUP_ROWS = 16_384
+_ROW_COL = '__row'
+_META_FILE = "_store.json"   # ขึ้นต้นด้วย '_' pyarrow.dataset จึงไม่นับเป็นไฟล์ข้อมูล
+_PARTITION_TYPES = {HOSPITAL_COL: pa.string(), 'FY_int': pa.int64(), 'FQuarter': pa.string()}
+
+
+def to_arrow_safe(df: pd.DataFrame) -> pd.DataFrame:
+    """คอลัมน์ object ที่ปนชนิดข้อมูล (ตัวเลข/ข้อความ/วันที่) แปลงเป็น str ก่อนเขียน Parquet (ค่าว่างคงเป็นค่าว่าง)"""
+    out = df.copy()
+    for col in out.select_dtypes(include='object').columns:
+        s = out[col]
+        out[col] = s.where(s.isna(), s.astype(str))
+    return out
+
+
+def _partitioning(parts: list):
+    return ds.partitioning(pa.schema([(c, _PARTITION_TYPES[c]) for c in parts]), flavor="hive")
+
+
+def store_info(root) -> dict | None:
+    """ข้อมูลสรุปของ store (คอลัมน์, ปีงบ, โรงพยาบาล, จำนวนแถว) โดยไม่อ่านข้อมูล — None ถ้ายังไม่มี store"""
+    path = Path(root) / _META_FILE
+    if not path.is_file():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def store_version(root) -> tuple:
+    """(โฟลเดอร์, เวลาแก้ไขไฟล์สรุป) — เปลี่ยนทุกครั้งที่ write_incident_store เขียนทับ ใช้เป็น key ของชุดข้อมูล"""
+    root = Path(root).resolve()
+    return str(root), (root / _META_FILE).stat().st_mtime_ns
+
+
+def write_incident_store(df: pd.DataFrame, root) -> dict:
+    """
+    เขียนข้อมูล (ผ่าน massage_schema + add_time_parts_fiscal แล้ว) ทับ store เดิมทั้งหมด
+    เขียนลงโฟลเดอร์ชั่วคราวก่อนแล้วจึงสลับ เพื่อไม่ให้ผู้อ่านเห็น store ที่เขียนไม่ครบ
+    """
+    root = Path(root)
+    parts = ([HOSPITAL_COL] if HOSPITAL_COL in df.columns else []) + PERIOD_PARTITIONS
+    hospitals = []
+    data = to_arrow_safe(df)
+    if HOSPITAL_COL in data.columns:
+        hospitals = [str(h) for h in (data[HOSPITAL_COL].cat.categories if isinstance(data[HOSPITAL_COL].dtype, pd.CategoricalDtype)
+                                      else pd.unique(data[HOSPITAL_COL].dropna()))]
+        data[HOSPITAL_COL] = data[HOSPITAL_COL].astype(str)
+    data['FQuarter'] = data['FQuarter'].astype(str)  # คอลัมน์พาร์ทิชันต้องเป็นข้อความ (ไม่ใช่ categorical)
+    # เก็บลำดับแถว/index เดิมไว้ แล้วเรียงตามพาร์ทิชัน + Month_int ให้สถิติ row group ใช้ตัดเดือนได้
+    data[_ROW_COL] = df.index.to_numpy() if pd.api.types.is_integer_dtype(df.index) else np.arange(len(df))
+    data = data.sort_values(parts + ['Month_int', _ROW_COL], kind='stable')
+
+    meta = {"columns": list(df.columns), "partitions": parts, "hospitals": hospitals,
+            "fiscal_years": sorted(int(y) for y in pd.unique(df['FY_int'])) if len(df) else [],
+            "rows": int(len(df))}
+
+    def write(tmp: Path):
+        ds.write_dataset(pa.Table.from_pandas(data, preserve_index=False), tmp, format="parquet",
+                         partitioning=_partitioning(parts), max_rows_per_group=ROW_GROUP_ROWS,
+                         min_rows_per_group=min(ROW_GROUP_ROWS, 1024), existing_data_behavior="overwrite_or_ignore")
+        (tmp / _META_FILE).write_text(json.dumps(meta, ensure_ascii=False, indent=1), encoding="utf-8")
+
+    write_atomic(root, write, directory=True)
+    return meta
+
+
+def period_filter(mode: str = "ทั้งหมด", fy=None, fq=None, m=None, hospitals=None):
+    """pyarrow expression ของตัวกรองช่วงเวลา + โรงพยาบาล (None = ไม่กรอง)"""
+    conds = []
+    fy_str = str(fy) if fy not in (None, "", "-- ทั้งหมด --") else None
+    if mode in ("รายปี", "รายไตรมาส", "รายเดือน") and fy_str:
+        conds.append(ds.field('FY_int') == int(fy_str))
+    if mode == "รายไตรมาส" and fq and fq != "-- ทั้งหมด --":
+        conds.append(ds.field('FQuarter') == fq)
+    if mode == "รายเดือน" and m and m != "-- ทั้งหมด --":
+        conds.append(ds.field('Month_int') == int(m))
+    if hospitals:
+        conds.append(ds.field(HOSPITAL_COL).isin([str(h) for h in hospitals]))
+    expr = None
+    for c in conds:
+        expr = c if expr is None else expr & c
+    return expr
+
+
+@profiled()
+def read_incident_store(root, mode: str = "ทั้งหมด", fy=None, fq=None, m=None, hospitals=None, columns=None) -> pd.DataFrame:
+    """อ่านเฉพาะช่วงที่เลือกจาก store — ผลเท่ากับ filter_by_period_fiscal(ข้อมูลทั้งหมด, ...) (ลำดับแถว/index เดิม)"""
+    meta = store_info(root)
+    if meta is None:
+        return pd.DataFrame()
+    if hospitals and HOSPITAL_COL not in meta["partitions"]:
+        hospitals = None
+    dataset = ds.dataset(Path(root), format="parquet", partitioning=_partitioning(meta["partitions"]))
+    cols = [c for c in meta["columns"] if columns is None or c in columns]
+    table = dataset.to_table(columns=cols + [_ROW_COL], filter=period_filter(mode, fy, fq, m, hospitals))
+    df = table.to_pandas().sort_values(_ROW_COL, kind='stable').set_index(_ROW_COL)
+    df.index.name = None
+    if HOSPITAL_COL in df.columns:
+        df[HOSPITAL_COL] = pd.Categorical(df[HOSPITAL_COL], categories=meta["hospitals"])
+    if 'FQuarter' in df.columns:
+        df['FQuarter'] = pd.Categorical(df['FQuarter'], categories=FISCAL_QUARTERS)
+    return df[cols]
+
+
+# ข้อความ -> string[pyarrow_numpy]: ชี้ buffer ของ Arrow ตรงๆ แต่ค่าว่างเป็น NaN และการเปรียบเทียบคืน bool ของ numpy เหมือน object
+_ZERO_COPY_TYPES = {pa.string(): pd.StringDtype("pyarrow_numpy"), pa.large_string(): pd.StringDtype("pyarrow_numpy")}
+
+
+def write_arrow_snapshot(df: pd.DataFrame, path) -> int:
+    """เขียนข้อมูลทั้งชุดเป็น Arrow IPC (ไม่บีบอัด เพื่อ memory-map ได้) — เขียนไฟล์ชั่วคราวแล้วสลับ คืนจำนวนแถว"""
+    table = pa.Table.from_pandas(to_arrow_safe(df))
+    # ข้อความเก็บเป็น large_string: ชนิดที่ string[pyarrow_numpy] ใช้ภายใน (string ธรรมดาต้อง cast = copy ทุก worker)
+    table = table.cast(pa.schema([f.with_type(pa.large_string()) if f.type == pa.string() else f for f in table.schema],
+                                 metadata=table.schema.metadata))
+
+    def write(tmp: Path):
+        with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+    write_atomic(path, write)  # worker ที่ map ไฟล์เดิมอยู่ยังอ่านของเดิมได้ (inode เดิม)
+    return table.num_rows
+
+
+def map_arrow_snapshot(path) -> pd.DataFrame:
+    """memory-map ไฟล์จาก write_arrow_snapshot เป็น DataFrame (คอลัมน์อ่านอย่างเดียว ไม่ copy ข้อมูลถ้าเป็นไปได้)"""
+    table = pa.ipc.open_file(pa.memory_map(str(path), "r")).read_all()
+    return table.to_pandas(split_blocks=True, types_mapper=_ZERO_COPY_TYPES.get)
@@ -0,0 +1,52 @@
+# lazy_modules.py
+# -*- coding: utf-8 -*-
+# โหลดไลบรารีหนัก (plotly.express, google.generativeai, transformers ...) เมื่อถูกใช้ครั้งแรก ไม่ใช่ตอนเปิดแอป
+#
+#   px = lazy_module("plotly.express")                       # import จริงตอนเรียก px.bar(...) ครั้งแรก
+#   genai = lazy_module("google.generativeai", optional=True)
+#   if genai: ...                                            # ตรวจว่าติดตั้งไว้หรือไม่ โดยยังไม่ import
+#
+# ตัวแทน (proxy) ไม่ถูกใส่ใน sys.modules — file watcher ของ Streamlit จึงไม่ไปกระตุ้นการ import ก่อนเวลา
+import importlib
+import importlib.util
+
+
+def is_available(name: str) -> bool:
+    """ติดตั้งโมดูลไว้หรือไม่ (หา spec อย่างเดียว ไม่รันโค้ดของโมดูล)"""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+class LazyModule:
+    """ตัวแทนโมดูลที่ import จริงเมื่อเข้าถึง attribute ครั้งแรก"""
+
+    def __init__(self, name: str, optional: bool = False):
+        self._name = name
+        self._optional = optional
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __bool__(self):
+        # optional: เป็นเท็จเมื่อไม่ได้ติดตั้ง (แทนรูปแบบ try: import ... except ImportError: mod = None)
+        return self._module is not None or not self._optional or is_available(self._name)
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __repr__(self):
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_module(name: str, optional: bool = False) -> LazyModule:
+    return LazyModule(name, optional)
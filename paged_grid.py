@@ -0,0 +1,127 @@
+# paged_grid.py
+# -*- coding: utf-8 -*-
+# ตารางรายการอุบัติการณ์แบบแบ่งหน้าฝั่งเซิร์ฟเวอร์ (แทน st.dataframe ของทั้งชุด)
+#
+#   paged_grid(df, key="sentinel", columns=[...], column_config={...})
+#   paged_grid(df, key="unresolved", rows=np.flatnonzero(mask))   # ส่งตำแหน่งแถว ไม่ต้อง copy df[mask]
+#
+# - ชุดแถวเก็บเป็น array ตำแหน่ง (int) ใน session_state หลังกรอง/เรียง — เปลี่ยนหน้าไม่ต้องเรียงใหม่
+# - ส่งไปเบราว์เซอร์ครั้งละหนึ่งหน้า (df.iloc[ตำแหน่งของหน้านั้น, คอลัมน์ที่แสดง])
+# - เรียงและกรองบนเซิร์ฟเวอร์: คอลัมน์ข้อความกรองทีละค่าไม่ซ้ำ (pd.factorize) แล้วกระจายผลด้วยรหัส
+# - ชุดที่สั้นกว่าหน้าเล็กสุดแสดงด้วย st.dataframe ตามปกติ ไม่มีตัวควบคุม
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+PAGE_SIZES = (25, 50, 100, 250)
+CHOICE_LIMIT = 60  # คอลัมน์ที่มีค่าไม่ซ้ำไม่เกินนี้ กรองแบบเลือกค่า; มากกว่านี้กรองแบบ "มีข้อความ"
+NO_FILTER = "-- ไม่กรอง --"
+
+
+def _is_text(values: pd.Series) -> bool:
+    return values.dtype == object or isinstance(values.dtype, (pd.CategoricalDtype, pd.StringDtype))
+
+
+def filter_choices(values: pd.Series) -> list | None:
+    """ค่าที่เลือกกรองได้ของคอลัมน์ (None = ค่ามากเกินไป ใช้กรองแบบข้อความ)"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return [str(c) for c in values.cat.categories]
+    uniques = pd.unique(values.dropna().astype(str))
+    return sorted(uniques) if len(uniques) <= CHOICE_LIMIT else None
+
+
+def filter_mask(values: pd.Series, selected=None, contains: str = None) -> np.ndarray:
+    """mask ของแถวที่ค่าอยู่ใน selected และ/หรือมีข้อความ contains — คำนวณต่อค่าไม่ซ้ำ"""
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    labels = pd.Index(uniques).astype(str)
+    keep = np.ones(len(uniques), dtype=bool)
+    if selected:
+        keep &= labels.isin(list(selected))
+    if contains:
+        keep &= labels.str.contains(contains, case=False, regex=False)
+    keep = np.append(keep, False)  # รหัส -1 (ค่าว่าง) -> ตำแหน่งสุดท้าย ไม่ผ่านตัวกรอง
+    return keep[codes]
+
+
+def grid_positions(df: pd.DataFrame, rows: np.ndarray = None, sort_by: str = None, descending: bool = False,
+                   filter_column: str = None, selected=None, contains: str = None) -> np.ndarray:
+    """ตำแหน่งแถว (ตาม df.iloc) หลังกรองและเรียง — ไม่ copy ข้อมูลของ df"""
+    rows = np.arange(len(df)) if rows is None else np.asarray(rows, dtype=np.intp)
+    if filter_column and (selected or contains):
+        rows = rows[filter_mask(df[filter_column].iloc[rows], selected, contains)]
+    if sort_by and len(rows) > 1:
+        values = df[sort_by].iloc[rows].reset_index(drop=True)
+        if isinstance(values.dtype, pd.CategoricalDtype) and not values.cat.ordered:
+            values = values.astype(str).where(values.notna())
+        try:
+            order = values.sort_values(ascending=not descending, kind="stable", na_position="last").index.to_numpy()
+        except TypeError:  # object ปนชนิด (ตัวเลข/ข้อความ) -> เรียงแบบข้อความ
+            values = values.astype(str).where(values.notna())
+            order = values.sort_values(ascending=not descending, kind="stable", na_position="last").index.to_numpy()
+        rows = rows[order]
+    return rows
+
+
+def _data_token(df: pd.DataFrame, rows) -> tuple:
+    """ตัวแทนชุดข้อมูลแบบถูก (ไม่ hash ทั้งตาราง): ขนาด + hash ของ index และตำแหน่งแถว"""
+    index_hash = int(pd.util.hash_array(df.index.to_numpy()).sum()) if len(df) else 0
+    rows_hash = int(pd.util.hash_array(np.asarray(rows)).sum()) if rows is not None else None
+    return len(df), index_hash, rows_hash
+
+
+def paged_grid(df: pd.DataFrame, key: str, columns: list = None, rows: np.ndarray = None, column_config: dict = None,
+               page_size: int = 50):
+    """แสดง df (เฉพาะ rows ถ้ากำหนด) ทีละหน้า พร้อมเรียง/กรองฝั่งเซิร์ฟเวอร์ — key ต้องไม่ซ้ำกันในหน้า"""
+    columns = [c for c in (columns if columns is not None else df.columns) if c in df.columns]
+    n_total = len(df) if rows is None else len(rows)
+    if n_total <= PAGE_SIZES[0]:
+        view = df if rows is None else df.iloc[rows]
+        st.dataframe(view[columns], use_container_width=True, hide_index=True, column_config=column_config)
+        return
+
+    c1, c2, c3, c4 = st.columns([2, 1, 2, 2])
+    with c1:
+        sort_by = st.selectbox("เรียงตาม", [None] + columns, key=f"{key}_sort",
+                               format_func=lambda c: "-- ลำดับเดิม --" if c is None else c)
+    with c2:
+        descending = st.toggle("มาก→น้อย", key=f"{key}_desc", disabled=sort_by is None)
+    with c3:
+        filter_column = st.selectbox("กรองคอลัมน์", [NO_FILTER] + [c for c in columns if _is_text(df[c])],
+                                     key=f"{key}_fcol")
+    selected, contains = None, None
+    with c4:
+        if filter_column != NO_FILTER:
+            source = df[filter_column] if rows is None else df[filter_column].iloc[rows]
+            choices = filter_choices(source)
+            if choices is not None:
+                selected = st.multiselect("ค่า", choices, key=f"{key}_fsel_{filter_column}")
+            else:
+                contains = st.text_input("มีข้อความ", key=f"{key}_ftext_{filter_column}").strip()
+
+    # ชุดแถวหลังกรอง/เรียง เก็บใน session_state — เปลี่ยนหน้า/ขนาดหน้า ใช้ array เดิม
+    view_key = (_data_token(df, rows), sort_by, descending, filter_column, tuple(selected or ()), contains)
+    memo = st.session_state.get(f"{key}_rows")
+    if memo is None or memo[0] != view_key:
+        memo = (view_key, grid_positions(df, rows, sort_by, descending,
+                                         None if filter_column == NO_FILTER else filter_column, selected, contains))
+        st.session_state[f"{key}_rows"] = memo
+        st.session_state[f"{key}_page"] = 1  # ชุดแถวเปลี่ยน -> กลับหน้าแรก
+    positions = memo[1]
+
+    size = st.session_state.get(f"{key}_size", page_size if page_size in PAGE_SIZES else PAGE_SIZES[1])
+    n_pages = max(1, -(-len(positions) // size))
+    page = min(max(1, int(st.session_state.get(f"{key}_page", 1))), n_pages)
+    start = (page - 1) * size
+    page_rows = positions[start:start + size]
+    st.dataframe(df.iloc[page_rows][columns], use_container_width=True, hide_index=True, column_config=column_config)
+
+    p1, p2, p3 = st.columns([1, 1, 3])
+    with p1:
+        st.session_state[f"{key}_page"] = page
+        st.number_input("หน้า", min_value=1, max_value=n_pages, step=1, key=f"{key}_page")
+    with p2:
+        st.selectbox("แถว/หน้า", PAGE_SIZES, index=PAGE_SIZES.index(size), key=f"{key}_size")
+    with p3:
+        shown = f"{start + 1:,}–{start + len(page_rows):,}" if len(page_rows) else "0"
+        suffix = f" (กรองจาก {n_total:,})" if len(positions) != n_total else ""
+        st.caption(f"แถว {shown} จาก {len(positions):,} รายการ{suffix} · หน้า {page}/{n_pages}")
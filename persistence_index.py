@@ -0,0 +1,82 @@
+# persistence_index.py
+# -*- coding: utf-8 -*-
+# Persistence Risk Index แบบ rolling window (3/6/12 เดือน) ของทุกรหัสพร้อมกัน
+#
+# เก็บผลรวมสะสม (prefix sum) รายเดือนต่อรหัส 2 ชุด:
+#   cum_n[c, t] = จำนวนครั้ง (ที่มีคะแนนความเสี่ยง) ตั้งแต่เดือนแรกถึงก่อนเดือน t
+#   cum_w[c, t] = ผลรวมคะแนน ordinal ความเสี่ยง (1-25) ช่วงเดียวกัน
+# ค่าของหน้าต่าง [t-L, t) = cum[:, t] - cum[:, t-L]  → O(1) ต่อรหัสต่อหน้าต่าง
+#
+# สูตรคะแนนเหมือน calculate_persistence_risk_score ในแต่ละหน้าต่าง:
+#   Persistence = (อัตราต่อเดือน / max(1, อัตราสูงสุดในหน้าต่างนั้น)) + (คะแนนเฉลี่ย / 25)
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class RollingPersistence:
+    codes: pd.Index
+    months: pd.PeriodIndex
+    cum_n: np.ndarray   # (n_code, n_month + 1)
+    cum_w: np.ndarray   # (n_code, n_month + 1)
+
+    @classmethod
+    def from_monthly(cls, codes, months, occurrences: np.ndarray, score_sums: np.ndarray) -> "RollingPersistence":
+        """occurrences / score_sums: (n_code, n_month) จำนวนครั้งและผลรวมคะแนนรายเดือน"""
+        pad = lambda a: np.concatenate([np.zeros((a.shape[0], 1)), np.cumsum(a, axis=1, dtype=float)], axis=1)
+        return cls(codes=pd.Index(codes), months=months, cum_n=pad(np.asarray(occurrences)),
+                   cum_w=pad(np.asarray(score_sums)))
+
+    def window_sums(self, window: int, end: int = None):
+        """(n, w) ของหน้าต่างยาว window เดือนที่สิ้นสุดก่อนเดือนลำดับ end (ค่าเริ่มต้น = เดือนสุดท้าย)"""
+        end = self.cum_n.shape[1] - 1 if end is None else end
+        start = max(0, end - window)
+        return self.cum_n[:, end] - self.cum_n[:, start], self.cum_w[:, end] - self.cum_w[:, start]
+
+    def scores(self, window: int) -> pd.DataFrame:
+        """
+        คะแนนทุกหน้าต่างที่ครบ window เดือน (long format: เดือนสิ้นสุด, รหัส, ตัวชี้วัด)
+        ทั้งหมดคำนวณจากผลต่าง prefix sum ครั้งเดียว: (n_code, n_month - window + 1)
+        """
+        if window > len(self.months) or len(self.codes) == 0:
+            return pd.DataFrame(columns=['month', 'รหัส', 'Total_Occurrences', 'Average_Ordinal_Risk_Score',
+                                         'Incident_Rate_Per_Month', 'Persistence_Risk_Score'])
+        n = self.cum_n[:, window:] - self.cum_n[:, :-window]
+        w = self.cum_w[:, window:] - self.cum_w[:, :-window]
+        rate = n / window
+        max_rate = np.maximum(1.0, rate.max(axis=0, initial=0.0))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            avg = np.where(n > 0, w / n, np.nan)
+        score = rate / max_rate + np.nan_to_num(avg) / 25.0
+        score = np.where(n > 0, score, np.nan)
+        end_months = self.months[window - 1:].strftime('%Y-%m')
+        code_idx, month_idx = np.nonzero(n > 0)
+        return pd.DataFrame({
+            'month': end_months[month_idx], 'รหัส': self.codes[code_idx],
+            'Total_Occurrences': n[code_idx, month_idx].astype(int),
+            'Average_Ordinal_Risk_Score': avg[code_idx, month_idx],
+            'Incident_Rate_Per_Month': rate[code_idx, month_idx],
+            'Persistence_Risk_Score': score[code_idx, month_idx],
+        })
+
+    def change(self, window: int) -> pd.DataFrame:
+        """
+        เทียบหน้าต่างล่าสุดกับหน้าต่างก่อนหน้า (ยาวเท่ากัน ไม่ซ้อนกัน) — ค่าลบ = ดีขึ้น
+        ข้อมูลไม่ถึง 2 × window เดือน (หน้าต่างก่อนหน้าไม่ครบ) คืนตารางว่าง
+        """
+        T = self.cum_n.shape[1] - 1
+        if T < 2 * window:
+            return pd.DataFrame(columns=['รหัส', 'previous', 'current', 'delta'])
+        out = {}
+        for label, end in (('current', T), ('previous', T - window)):
+            n, w = self.window_sums(window, end)
+            rate = n / window
+            with np.errstate(invalid='ignore', divide='ignore'):
+                avg = np.where(n > 0, w / n, np.nan)
+            out[label] = rate / max(1.0, rate.max(initial=0.0)) + np.nan_to_num(avg) / 25.0
+            out[label] = np.where(n > 0, out[label], 0.0)
+        res = pd.DataFrame({'รหัส': self.codes, 'previous': out['previous'], 'current': out['current']})
+        res['delta'] = res['current'] - res['previous']
+        return res[(res['previous'] > 0) | (res['current'] > 0)].sort_values('delta', ascending=False)
@@ -0,0 +1,157 @@
+# reference_data.py
+# -*- coding: utf-8 -*-
+# ไฟล์นิยาม (PSG9code / Sentinel2024 / Code2024 / risk_mitigations) โหลดครั้งเดียว พร้อม lookup ที่คำนวณไว้แล้ว
+#
+# อ่าน Excel (openpyxl) ครั้งแรกแล้วเก็บ snapshot แบบ pickle ใน cache_dir
+# ครั้งต่อไปอ่าน snapshot แทน ตราบใดที่ mtime และขนาดไฟล์ต้นทางยังตรงกัน (แก้ไฟล์ Excel = สร้าง snapshot ใหม่เอง)
+# ฝั่งแอปเก็บ ReferenceData ไว้ใน st.cache_resource โดยใช้ source_version() เป็น key -> rerun ไม่มีการอ่าน Excel
+import pickle
+from dataclasses import dataclass
+from pathlib import Path
+
+import pandas as pd
+
+from atomic_files import write_atomic
+
+PSG9_FILE_PATH = "PSG9code.xlsx"
+SENTINEL_FILE_PATH = "Sentinel2024.xlsx"
+RISK_MITIGATION_FILE = "risk_mitigations.xlsx"
+CODE_MAPPING_FILE = "Code2024.xlsx"
+WORKBOOKS = {PSG9_FILE_PATH: 0, SENTINEL_FILE_PATH: 0, RISK_MITIGATION_FILE: 0, CODE_MAPPING_FILE: "Sheet1"}
+MITIGATION_FIELDS = ['มาตรการป้องกันและถ่ายโอนความเสี่ยง', 'การติดตาม']
+
+
+@dataclass(frozen=True)
+class ReferenceData:
+    psg9_master: pd.DataFrame
+    sentinel_df: pd.DataFrame
+    mitigation_df: pd.DataFrame
+    code_mapping: pd.DataFrame
+    psg9_codes: frozenset          # รหัสที่อยู่ใน PSG9 (สำหรับนับ)
+    psg9_label_dict: dict          # PSG_ID -> หมวดหมู่PSG
+    code_to_psg9: dict             # รหัส -> หมวดหมู่PSG
+    sentinel_keys: frozenset       # 'รหัส-Impact' ที่เป็น Sentinel event
+    mitigation_by_code: dict       # รหัส -> {มาตรการป้องกันฯ, การติดตาม} (แถวแรกของแต่ละรหัส)
+    goal_type_order: dict          # หมวด Safety Goals -> [ประเภท ตามลำดับใน Code2024]
+    messages: tuple = ()           # (level, ข้อความ) ระหว่างโหลด ให้ UI/CLI แสดงเอง
+
+    def as_tables(self) -> dict:
+        """dict รูปแบบเดิมของ load_reference_tables()"""
+        return {"PSG9code_df_master": self.psg9_master, "psg9_r_codes_for_counting": set(self.psg9_codes),
+                "PSG9_label_dict": self.psg9_label_dict, "Sentinel2024_df": self.sentinel_df,
+                "sentinel_composite_keys": set(self.sentinel_keys), "df_mitigation": self.mitigation_df}
+
+
+def source_version(base_dir=".") -> tuple:
+    """(ชื่อไฟล์, mtime_ns, ขนาด) ของทุก workbook — เปลี่ยนเมื่อมีการแก้ไฟล์ ใช้เป็น key ของ cache"""
+    out = []
+    for name in WORKBOOKS:
+        path = Path(base_dir) / name
+        try:
+            s = path.stat()
+            out.append((name, s.st_mtime_ns, s.st_size))
+        except OSError:
+            out.append((name, None, None))
+    return tuple(out)
+
+
+def read_workbook(path, sheet=0, cache_dir=None) -> pd.DataFrame:
+    """อ่าน Excel ผ่าน snapshot ใน cache_dir (ถ้ากำหนด) — snapshot ใช้ได้เมื่อ mtime/ขนาดไฟล์ต้นทางตรงกัน"""
+    path = Path(path)
+    stat = path.stat()
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    snap = Path(cache_dir) / f"{path.stem}.{sheet}.pkl" if cache_dir else None
+    if snap is not None and snap.is_file():
+        try:
+            with open(snap, "rb") as f:
+                saved = pickle.load(f)
+            if saved.get("stamp") == stamp:
+                return saved["frame"]
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, KeyError):
+            pass  # snapshot เสีย/ต่างเวอร์ชัน -> อ่าน Excel ใหม่
+    df = pd.read_excel(path, sheet_name=sheet)
+    if snap is not None:
+        try:
+            def write(tmp: Path):
+                with open(tmp, "wb") as f:
+                    pickle.dump({"stamp": stamp, "frame": df}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            write_atomic(snap, write)  # หลาย worker process เขียน snapshot เดียวกันพร้อมกันได้
+        except OSError:
+            pass  # เขียน cache ไม่ได้ไม่ใช่ข้อผิดพลาด
+    return df
+
+
+def normalize_goal_label(s) -> str:
+    """แปลง "P:xxx" หรือ "D:Something" -> "xxx" / "Something" """
+    if pd.isna(s):
+        return ""
+    s = str(s).strip()
+    if ":" in s:
+        return s.split(":", 1)[1].strip()
+    return s
+
+
+def goal_type_order(code_mapping: pd.DataFrame) -> dict:
+    """หมวด (ตัด prefix แล้ว) -> รายชื่อประเภทตามลำดับที่ปรากฏใน Code2024"""
+    if code_mapping.empty or not {'หมวด', 'ประเภท'} <= set(code_mapping.columns):
+        return {}
+    keys = pd.DataFrame({"หมวด_key": code_mapping["หมวด"].map(normalize_goal_label),
+                         "ประเภท_key": code_mapping["ประเภท"].map(normalize_goal_label)})
+    return {cat: list(dict.fromkeys(g["ประเภท_key"])) for cat, g in keys.groupby("หมวด_key")}
+
+
+def load_reference_data(base_dir=".", cache_dir=None) -> ReferenceData:
+    """โหลดไฟล์นิยามทั้งหมดจาก base_dir (ไฟล์ที่ไม่พบได้ตารางว่าง + ข้อความใน messages)"""
+    base = Path(base_dir)
+    messages = []
+    psg9, sentinel_df, mitigation = pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+    code_mapping = pd.DataFrame(columns=['หมวด', 'ประเภท'])
+    psg9_codes, sentinel_keys, psg9_label_dict, code_to_psg9, mitigation_by_code = set(), set(), {}, {}, {}
+    try:
+        if (base / PSG9_FILE_PATH).is_file():
+            psg9 = read_workbook(base / PSG9_FILE_PATH, WORKBOOKS[PSG9_FILE_PATH], cache_dir)
+            if 'รหัส' in psg9.columns:
+                psg9_codes = set(psg9['รหัส'].astype(str).str.strip().unique())
+            if 'PSG_ID' in psg9.columns and 'หมวดหมู่PSG' in psg9.columns:
+                psg9_label_dict = pd.Series(psg9['หมวดหมู่PSG'].values, index=psg9.PSG_ID).to_dict()
+            else:
+                messages.append(("warning", f"'{PSG9_FILE_PATH}' ไม่มี PSG_ID หรือ หมวดหมู่PSG"))
+            if 'รหัส' in psg9.columns and 'หมวดหมู่PSG' in psg9.columns:
+                first = psg9.drop_duplicates(subset=['รหัส'])
+                code_to_psg9 = dict(zip(first['รหัส'].astype(str), first['หมวดหมู่PSG']))
+        else:
+            messages.append(("warning", f"ไม่พบ '{PSG9_FILE_PATH}'"))
+
+        if (base / SENTINEL_FILE_PATH).is_file():
+            sentinel_df = read_workbook(base / SENTINEL_FILE_PATH, WORKBOOKS[SENTINEL_FILE_PATH], cache_dir).copy()
+            if 'รหัส' in sentinel_df.columns and 'Impact' in sentinel_df.columns:
+                sentinel_df['รหัส'] = sentinel_df['รหัส'].astype(str).str.strip()
+                sentinel_df['Impact'] = sentinel_df['Impact'].astype(str).str.strip()
+                sentinel_df.dropna(subset=['รหัส', 'Impact'], inplace=True)
+                sentinel_keys = set((sentinel_df['รหัส'] + '-' + sentinel_df['Impact']).unique())
+        else:
+            messages.append(("warning", f"ไม่พบ '{SENTINEL_FILE_PATH}'"))
+
+        if (base / RISK_MITIGATION_FILE).is_file():
+            mitigation = read_workbook(base / RISK_MITIGATION_FILE, WORKBOOKS[RISK_MITIGATION_FILE], cache_dir)
+            if 'รหัส' in mitigation.columns:
+                fields = [c for c in MITIGATION_FIELDS if c in mitigation.columns]
+                first = mitigation.drop_duplicates(subset=['รหัส'])
+                mitigation_by_code = {code: dict(zip(fields, values))
+                                      for code, values in zip(first['รหัส'], first[fields].itertuples(index=False))}
+        else:
+            messages.append(("warning", f"ไม่พบ '{RISK_MITIGATION_FILE}'"))
+
+        if (base / CODE_MAPPING_FILE).is_file():
+            code_mapping = read_workbook(base / CODE_MAPPING_FILE, WORKBOOKS[CODE_MAPPING_FILE], cache_dir)
+        else:
+            messages.append(("warning", f"ไม่พบ '{CODE_MAPPING_FILE}'"))
+    except Exception as e:
+        messages.append(("error", f"โหลดไฟล์นิยาม/หน่วยงานผิดพลาด: {e}"))
+
+    return ReferenceData(
+        psg9_master=psg9, sentinel_df=sentinel_df, mitigation_df=mitigation, code_mapping=code_mapping,
+        psg9_codes=frozenset(psg9_codes), psg9_label_dict=psg9_label_dict, code_to_psg9=code_to_psg9,
+        sentinel_keys=frozenset(sentinel_keys), mitigation_by_code=mitigation_by_code,
+        goal_type_order=goal_type_order(code_mapping), messages=tuple(messages),
+    )
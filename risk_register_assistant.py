@@ -2,7 +2,8 @@ import pandas as pd
 def get_risk_register_consultation(
         query: str,
         df: pd.DataFrame,
-        risk_mitigation_df: pd.DataFrame
+        risk_mitigation_df: pd.DataFrame,
+        mitigation_lookup: dict = None
 ):
     """
     ค้นหาข้อมูลอุบัติการณ์ที่ระบุ และดึงข้อมูลที่เกี่ยวข้องออกมา    
@@ -31,10 +32,16 @@ def get_risk_register_consultation(
     risk_level_code = f"{max_impact_level}{frequency_level}"
 
     # --- 2.1. ดึงข้อมูลมาตรการป้องกันและการติดตาม ---
-    mitigation_info = risk_mitigation_df[risk_mitigation_df['รหัส'] == incident_code]
-    prevention_measure = mitigation_info['มาตรการป้องกันและถ่ายโอนความเสี่ยง'].iloc[
-        0] if not mitigation_info.empty else "ไม่มีข้อมูลระบุไว้"
-    monitoring_metric = mitigation_info['การติดตาม'].iloc[0] if not mitigation_info.empty else "ไม่มีข้อมูลระบุไว้"
+    if mitigation_lookup is not None:
+        # lookup รหัส -> มาตรการ ที่สร้างไว้ตอนโหลดไฟล์นิยาม (reference_data) ไม่ต้องกรองตารางทุกครั้ง
+        mitigation = mitigation_lookup.get(incident_code, {})
+        prevention_measure = mitigation.get('มาตรการป้องกันและถ่ายโอนความเสี่ยง', "ไม่มีข้อมูลระบุไว้")
+        monitoring_metric = mitigation.get('การติดตาม', "ไม่มีข้อมูลระบุไว้")
+    else:
+        mitigation_info = risk_mitigation_df[risk_mitigation_df['รหัส'] == incident_code]
+        prevention_measure = mitigation_info['มาตรการป้องกันและถ่ายโอนความเสี่ยง'].iloc[
+            0] if not mitigation_info.empty else "ไม่มีข้อมูลระบุไว้"
+        monitoring_metric = mitigation_info['การติดตาม'].iloc[0] if not mitigation_info.empty else "ไม่มีข้อมูลระบุไว้"
 
     # --- 3. คืนค่าผลลัพธ์ (ไม่มีการเรียก AI) ---
     return {
@@ -0,0 +1,354 @@
+# risk_views.py
+# -*- coding: utf-8 -*-
+# ส่วนแสดงผล Risk Matrix / Risk level (แยกออกจาก app.py เพื่อให้เรียกใช้/วัดผลได้โดยไม่ต้องรันทั้งแอป)
+import numpy as np
+import pandas as pd
+import streamlit as st
+import streamlit.components.v1 as components
+
+from incident_pipeline import build_risk_matrix
+from lazy_modules import lazy_module
+from paged_grid import paged_grid
+
+go = lazy_module("plotly.graph_objects")  # import จริงเมื่อสร้างกราฟ heatmap ครั้งแรก
+
+# ========= สี/ฟังก์ชันสำหรับ Risk Matrix (Global Helpers) =========
+HEADER_TOPLEFT = "#E6F5FF";
+HEADER_SIDE = "#F3C7B1";
+HEADER_FREQ = "#EED0BE"
+GREEN = "#00D26A";
+YELLOW = "#FFE900";
+ORANGE = "#FF9800";
+RED = "#FF2D2D"
+PALETTE_FROM_IMAGE = {
+    "11": GREEN, "12": GREEN, "13": GREEN, "14": YELLOW, "15": YELLOW,
+    "21": GREEN, "22": YELLOW, "23": YELLOW, "24": ORANGE, "25": ORANGE,
+    "31": YELLOW, "32": YELLOW, "33": YELLOW, "34": ORANGE, "35": ORANGE,
+    "41": ORANGE, "42": ORANGE, "43": RED, "44": RED, "45": RED,
+    "51": RED, "52": RED, "53": RED, "54": RED, "55": RED,
+}
+
+IMPACT_LEVEL_KEYS = ['5', '4', '3', '2', '1']
+FREQ_LEVEL_KEYS = ['1', '2', '3', '4', '5']
+
+
+def _text_color_for(bg_hex: str) -> str:
+    h = bg_hex.lstrip("#");
+    r, g, b = int(h[0:2], 16) / 255, int(h[2:4], 16) / 255, int(h[4:6], 16) / 255
+    return "#000000" if (0.2126 * r + 0.7152 * g + 0.0722 * b) > 0.6 else "#FFFFFF"
+
+
+# ========= จบส่วนสี Risk Matrix =========
+
+
+def render_risk_matrix_interactive(df: pd.DataFrame, key_prefix: str = "main_rmx"):
+    st.subheader("Risk Matrix (Interactive)")
+    impact_level_keys = ['5', '4', '3', '2', '1'];
+    freq_level_keys = ['1', '2', '3', '4', '5']
+    matrix_df = df[
+        df['Impact Level'].astype(str).isin(impact_level_keys) &
+        df['Frequency Level'].astype(str).isin(freq_level_keys)
+        ].copy()
+    matrix_data_counts = np.zeros((5, 5), dtype=int)
+    if not matrix_df.empty:
+        risk_counts_df = matrix_df.groupby(['Impact Level', 'Frequency Level']).size().reset_index(name='counts')
+        for _, row in risk_counts_df.iterrows():
+            r = impact_level_keys.index(str(row['Impact Level']))
+            c = freq_level_keys.index(str(row['Frequency Level']))
+            matrix_data_counts[r, c] = int(row['counts'])
+
+    impact_labels_display = {
+        '5': "I / 5<br>Extreme / Death", '4': "G-H / 4<br>Major / Severe", '3': "E-F / 3<br>Moderate",
+        '2': "C-D / 2<br>Minor / Low", '1': "A-B / 1<br>Insignificant / No Harm",
+    }
+    freq_labels_display_short = {"1": "F1", "2": "F2", "3": "F3", "4": "F4", "5": "F5"}
+    freq_labels_display_long = {
+        "1": "Remote<br>(<2/mth)", "2": "Uncommon<br>(2-3/mth)", "3": "Occasional<br>(4-6/mth)",
+        "4": "Probable<br>(7-29/mth)", "5": "Frequent<br>(>=30/mth)",
+    }
+
+    cols_header = st.columns([2.2, 1, 1, 1, 1, 1])
+    with cols_header[0]:
+        st.markdown(
+            f"<div style='background-color:{HEADER_TOPLEFT}; color:{_text_color_for(HEADER_TOPLEFT)}; "
+            f"padding:8px; text-align:center; font-weight:bold; border-radius:3px; margin:1px; height:60px; "
+            f"display:flex; align-itemsV:center; justify-content:center;'>Impact / Frequency</div>",
+            unsafe_allow_html=True
+        )
+    for i, fl in enumerate(freq_level_keys):
+        with cols_header[i + 1]:
+            st.markdown(
+                f"<div style='background-color:{HEADER_FREQ}; color:{_text_color_for(HEADER_FREQ)}; "
+                f"padding:8px; text-align:center; font-weight:bold; border-radius:3px; margin:1px; height:60px; "
+                f"display:flex; flex-direction:column; align-items:center; justify-content:center;'>"
+                f"<div>{freq_labels_display_short[fl]}</div>"
+                f"<div style='font-size:0.7em;'>{freq_labels_display_long[fl]}</div></div>",
+                unsafe_allow_html=True
+            )
+    for r, il in enumerate(impact_level_keys):
+        row_cols = st.columns([2.2, 1, 1, 1, 1, 1])
+        with row_cols[0]:
+            st.markdown(
+                f"<div style='background-color:{HEADER_SIDE}; color:{_text_color_for(HEADER_SIDE)}; "
+                f"padding:8px; text-align:center; font-weight:bold; border-radius:3px; margin:1px; height:70px; "
+                f"display:flex; align-items:center; justify-content:center;'>{impact_labels_display[il]}</div>",
+                unsafe_allow_html=True
+            )
+        for c, fl in enumerate(freq_level_keys):
+            with row_cols[c + 1]:
+                code = f'{il}{fl}'
+                cell_bg = PALETTE_FROM_IMAGE.get(code, "#808080")
+                cnt = int(matrix_data_counts[r, c])
+                st.markdown(
+                    f"<div style='background-color:{cell_bg}; color:{_text_color_for(cell_bg)}; "
+                    f"padding:5px; margin:1px; border-radius:3px; text-align:center; font-weight:bold; "
+                    f"min-height:40px; display:flex; align-items:center; justify-content:center;'>{cnt}</div>",
+                    unsafe_allow_html=True
+                )
+                if cnt > 0:
+                    if st.button("👁️", key=f"{key_prefix}_view_{code}", help=f"ดูรายการ - {cnt} รายการ",
+                                 use_container_width=True):
+                        st.session_state[f"{key_prefix}_il"] = il
+                        st.session_state[f"{key_prefix}_fl"] = fl
+                        st.session_state[f"{key_prefix}_show"] = True
+                        st.rerun()
+                else:
+                    st.markdown("<div style='height:38px; margin-top:5px;'></div>", unsafe_allow_html=True)
+
+    if st.session_state.get(f"{key_prefix}_show", False):
+        il_selected = st.session_state.get(f"{key_prefix}_il")
+        fl_selected = st.session_state.get(f"{key_prefix}_fl")
+        rows = np.flatnonzero((df['Impact Level'].astype(str) == str(il_selected)) &
+                              (df['Frequency Level'].astype(str) == str(fl_selected)))
+        disp_cols_default = ['รหัส', 'ชื่ออุบัติการณ์ความเสี่ยง', 'Impact Level', 'Frequency Level', 'Risk Level',
+                             'Occurrence Date', 'หน่วยงาน', 'กลุ่มงาน']
+        display_cols = [c for c in disp_cols_default if c in df.columns]
+        with st.expander(
+                f"รายการอุบัติการณ์: Impact {il_selected} × Frequency {fl_selected} – {len(rows)} รายการ",
+                expanded=True):
+            paged_grid(df, f"{key_prefix}_rows_{il_selected}{fl_selected}", columns=display_cols, rows=rows)
+            if st.button("ปิดรายการ", key=f"{key_prefix}_close"):
+                st.session_state[f"{key_prefix}_show"] = False
+                st.session_state[f"{key_prefix}_il"] = None
+                st.session_state[f"{key_prefix}_fl"] = None
+                st.rerun()
+
+
+def render_risk_level_summary(df: pd.DataFrame):
+    st.subheader("ตารางสรุปสีตามระดับความเสี่ยงสูงสุดของแต่ละอุบัติการณ์")
+    st.info("สีและป้ายกำกับ (I: Impact, F: Frequency) มาจากช่องที่มีความเสี่ยงสูงสุดของอุบัติการณ์ประเภทนั้นๆ")
+
+    required = {'Impact Level', 'Frequency Level', 'รหัส', 'ชื่ออุบัติการณ์ความเสี่ยง'}
+    if not required.issubset(df.columns):
+        st.warning("ไม่พบคอลัมน์ที่จำเป็น ('Impact Level','Frequency Level','รหัส','ชื่ออุบัติการณ์ความเสี่ยง')")
+        return
+
+    order = {'1': 1, '2': 2, '3': 3, '4': 4, '5': 5}
+    tmp = df.copy()
+    tmp['I_num'] = tmp['Impact Level'].map(order).fillna(0).astype(int)
+    tmp['F_num'] = tmp['Frequency Level'].map(order).fillna(0).astype(int)
+    tmp['score'] = tmp['I_num'] * 10 + tmp['F_num']  # ให้ Impact สำคัญกว่า
+
+    idx = tmp.groupby(['รหัส', 'ชื่ออุบัติการณ์ความเสี่ยง'])['score'].idxmax()
+    incident_risk_summary = (
+        tmp.loc[idx, ['รหัส', 'ชื่ออุบัติการณ์ความเสี่ยง', 'Impact Level', 'Frequency Level', 'Incident Rate/mth']]
+        .rename(columns={'Impact Level': 'max_impact_level',
+                         'Frequency Level': 'frequency_level',
+                         'Incident Rate/mth': 'total_occurrences'})
+    )
+
+    # ใช้ฟังก์ชัน _text_color_for() ที่เรานิยามไว้ข้างบน
+    incident_risk_summary['risk_color_hex'] = incident_risk_summary.apply(
+        lambda r: PALETTE_FROM_IMAGE.get(f"{str(r['max_impact_level'])}{str(r['frequency_level'])}", "#808080"), axis=1
+    )
+    if 'total_occurrences' in incident_risk_summary.columns:
+        incident_risk_summary = incident_risk_summary.sort_values('total_occurrences', ascending=False)
+
+    for _, row in incident_risk_summary.iterrows():
+        color = row['risk_color_hex'];
+        text_color = _text_color_for(color)
+        risk_label = f"I: {row['max_impact_level']} | F: {row['frequency_level']}"
+        c1, c2 = st.columns([1, 6])
+        with c1:
+            st.markdown(
+                f'<div style="background-color:{color}; color:{text_color}; font-weight:bold; '
+                f'text-align:center; padding:8px; border-radius:6px; height:100%; '
+                f'display:flex; align-items:center; justify-content:center;">{risk_label}</div>',
+                unsafe_allow_html=True
+            )
+        with c2:
+            tot = row.get('total_occurrences', 0)
+            st.markdown(f"**{row['รหัส']} | {row['ชื่ออุบัติการณ์ความเสี่ยง']}** "
+                        f"(อัตราการเกิด: {float(tot):.2f} ครั้ง/เดือน)")
+
+
+# =========================
+# Risk Matrix แบบกราฟเดียว (Plotly heatmap + คลิกเลือกช่อง)
+# =========================
+# ลำดับสีในช่อง heatmap (z เป็นดัชนีสี ไม่ใช่จำนวน) -> สเกลสีแบบขั้นบันได
+_PALETTE_ORDER = [GREEN, YELLOW, ORANGE, RED]
+_PALETTE_Z = {c: i for i, c in enumerate(_PALETTE_ORDER)}
+_DISCRETE_COLORSCALE = []
+for _i, _c in enumerate(_PALETTE_ORDER):
+    _DISCRETE_COLORSCALE += [[_i / len(_PALETTE_ORDER), _c], [(_i + 1) / len(_PALETTE_ORDER), _c]]
+
+IMPACT_LABELS_SHORT = {
+    '5': "I / 5 Extreme", '4': "G-H / 4 Major", '3': "E-F / 3 Moderate",
+    '2': "C-D / 2 Minor", '1': "A-B / 1 Insignificant",
+}
+FREQ_LABELS_SHORT = {
+    "1": "F1 Remote (<2/mth)", "2": "F2 Uncommon (2-3/mth)", "3": "F3 Occasional (4-6/mth)",
+    "4": "F4 Probable (7-29/mth)", "5": "F5 Frequent (>=30/mth)",
+}
+
+
+def build_risk_matrix_figure(counts: pd.DataFrame) -> "go.Figure":
+    """
+    สร้าง Risk Matrix เป็นกราฟ Plotly รูปเดียว จากตารางจำนวน 5x5 (ผลจาก build_risk_matrix)
+    - heatmap ใช้ระบายสีตามระดับความเสี่ยง + แสดงจำนวน
+    - scatter โปร่งใสทับกลางช่อง เพื่อให้คลิกเลือกช่องได้ (heatmap เลือกจุดเองไม่ได้)
+    """
+    counts = counts.reindex(index=IMPACT_LEVEL_KEYS, columns=FREQ_LEVEL_KEYS, fill_value=0)
+    x_labels = [FREQ_LABELS_SHORT[f] for f in FREQ_LEVEL_KEYS]
+    y_labels = [IMPACT_LABELS_SHORT[i] for i in IMPACT_LEVEL_KEYS]
+    z = np.array([[_PALETTE_Z[PALETTE_FROM_IMAGE[f"{il}{fl}"]] for fl in FREQ_LEVEL_KEYS]
+                  for il in IMPACT_LEVEL_KEYS])
+    cnt = counts.to_numpy(dtype=int)
+
+    fig = go.Figure()
+    fig.add_trace(go.Heatmap(
+        z=z, x=x_labels, y=y_labels, text=cnt, texttemplate="<b>%{text}</b>", textfont={"size": 18},
+        colorscale=_DISCRETE_COLORSCALE, zmin=0, zmax=len(_PALETTE_ORDER), showscale=False,
+        xgap=3, ygap=3, hoverinfo="skip",
+    ))
+    il_grid, fl_grid = np.meshgrid(IMPACT_LEVEL_KEYS, FREQ_LEVEL_KEYS, indexing="ij")
+    xs, ys = np.meshgrid(x_labels, y_labels)
+    fig.add_trace(go.Scatter(
+        x=xs.ravel(), y=ys.ravel(), mode="markers",
+        marker={"symbol": "square", "size": 48, "opacity": 0},
+        customdata=np.stack([il_grid.ravel(), fl_grid.ravel(), cnt.ravel()], axis=1),
+        hovertemplate="Impact %{customdata[0]} × Frequency %{customdata[1]}<br>จำนวน: %{customdata[2]}<extra></extra>",
+        showlegend=False,
+    ))
+    fig.update_layout(
+        height=480, margin={"l": 10, "r": 10, "t": 30, "b": 10}, clickmode="event+select",
+        xaxis={"side": "top", "fixedrange": True}, yaxis={"fixedrange": True},
+        plot_bgcolor="white",
+    )
+    return fig
+
+
+def render_risk_matrix_heatmap(df: pd.DataFrame, key_prefix: str = "main_rmx"):
+    """Risk Matrix แบบกราฟเดียว: คลิกช่องเพื่อแสดงตารางรายการของช่องนั้น"""
+    st.subheader("Risk Matrix (Interactive)")
+    counts = build_risk_matrix(df)
+    event = st.plotly_chart(build_risk_matrix_figure(counts), use_container_width=True,
+                            on_select="rerun", selection_mode="points", key=f"{key_prefix}_heatmap")
+
+    points = event.selection.points if event is not None else []
+    if not points:
+        st.caption("คลิกช่องใน Risk Matrix เพื่อดูรายการอุบัติการณ์")
+        return
+
+    il_selected, fl_selected = str(points[0]["customdata"][0]), str(points[0]["customdata"][1])
+    mask = (df['Impact Level'].astype(str) == il_selected) & (df['Frequency Level'].astype(str) == fl_selected)
+    disp_cols_default = ['รหัส', 'ชื่ออุบัติการณ์ความเสี่ยง', 'Impact Level', 'Frequency Level', 'Risk Level',
+                         'Occurrence Date', 'หน่วยงาน', 'กลุ่มงาน']
+    display_cols = [c for c in disp_cols_default if c in df.columns]
+    st.markdown(f"**รายการอุบัติการณ์: Impact {il_selected} × Frequency {fl_selected} – {int(mask.sum())} รายการ**")
+    paged_grid(df, f"{key_prefix}_rows_{il_selected}{fl_selected}", columns=display_cols, rows=np.flatnonzero(mask))
+
+
+# =========================
+# Risk level แบบตารางเดียว (แทนการสร้าง st.columns ทีละรหัส)
+# =========================
+# ตารางค้นสีแบบ array: index = Impact*10 + Frequency (11..55) -> สีพื้น / สีตัวอักษร
+_RISK_HEX_LUT = np.full(56, "#808080", dtype=object)
+for _code, _hex in PALETTE_FROM_IMAGE.items():
+    _RISK_HEX_LUT[int(_code)] = _hex
+_TEXT_HEX_LUT = np.array([_text_color_for(h) for h in _RISK_HEX_LUT], dtype=object)
+
+
+def summarize_risk_level_table(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    หาช่องความเสี่ยงสูงสุดของแต่ละรหัส (Impact สำคัญกว่า Frequency) และค้นสีด้วย array lookup
+    คืนค่า DataFrame 1 แถวต่อ (รหัส, ชื่ออุบัติการณ์) เรียงตามอัตราการเกิด
+    """
+    cols = ['รหัส', 'ชื่ออุบัติการณ์ความเสี่ยง', 'Impact Level', 'Frequency Level', 'Incident Rate/mth']
+    tmp = df[[c for c in cols if c in df.columns]]
+    i_num = pd.to_numeric(tmp['Impact Level'], errors='coerce').fillna(0).astype(int).to_numpy()
+    f_num = pd.to_numeric(tmp['Frequency Level'], errors='coerce').fillna(0).astype(int).to_numpy()
+    score = pd.Series(i_num * 10 + f_num, index=tmp.index)
+
+    idx = score.groupby([tmp['รหัส'], tmp['ชื่ออุบัติการณ์ความเสี่ยง']]).idxmax()
+    out = tmp.loc[idx.to_numpy()].copy()
+    out_score = score.loc[idx.to_numpy()].to_numpy()
+    out['ระดับความเสี่ยง'] = "I: " + out['Impact Level'].astype(str) + " | F: " + out['Frequency Level'].astype(str)
+    out['score'] = out_score
+    out['risk_color_hex'] = _RISK_HEX_LUT[np.clip(out_score, 0, 55)]
+    out['text_color_hex'] = _TEXT_HEX_LUT[np.clip(out_score, 0, 55)]
+    if 'Incident Rate/mth' in out.columns:
+        out = out.sort_values('Incident Rate/mth', ascending=False)
+    return out.reset_index(drop=True)
+
+
+_RISK_TABLE_JS = """
+<script>
+const tb = document.getElementById('rl-body'), q = document.getElementById('rl-q');
+q.addEventListener('input', () => {
+  const k = q.value.toLowerCase();
+  for (const tr of tb.rows) tr.style.display = tr.textContent.toLowerCase().includes(k) ? '' : 'none';
+});
+document.querySelectorAll('#rl-table th').forEach((th, ci) => th.addEventListener('click', () => {
+  const asc = th.dataset.asc !== '1'; th.dataset.asc = asc ? '1' : '0';
+  const num = th.dataset.num === '1', rows = Array.from(tb.rows);
+  rows.sort((a, b) => {
+    const x = a.cells[ci].dataset.v ?? a.cells[ci].textContent, y = b.cells[ci].dataset.v ?? b.cells[ci].textContent;
+    const r = num ? (parseFloat(x) - parseFloat(y)) : x.localeCompare(y, 'th');
+    return asc ? r : -r;
+  });
+  tb.append(...rows);
+}));
+</script>
+"""
+
+
+def _html_escape(s: pd.Series) -> pd.Series:
+    return (s.astype(str).str.replace("&", "&amp;", regex=False)
+            .str.replace("<", "&lt;", regex=False).str.replace(">", "&gt;", regex=False))
+
+
+def build_risk_level_html(summary: pd.DataFrame) -> str:
+    """สร้างตาราง HTML เดียว (สีพื้นต่อแถวจาก array lookup) พร้อมช่องค้นหาและคลิกหัวคอลัมน์เพื่อเรียง"""
+    has_rate = 'Incident Rate/mth' in summary.columns
+    rate = summary['Incident Rate/mth'].astype(float) if has_rate else pd.Series(0.0, index=summary.index)
+    rows = ("<tr><td style='background:" + summary['risk_color_hex'] + ";color:" + summary['text_color_hex'] +
+            ";font-weight:bold;text-align:center' data-v='" + (summary['score'].astype(str)) + "'>" +
+            summary['ระดับความเสี่ยง'] + "</td><td>" + _html_escape(summary['รหัส']) + "</td><td>" +
+            _html_escape(summary['ชื่ออุบัติการณ์ความเสี่ยง']) + "</td><td style='text-align:right' data-v='" +
+            rate.astype(str) + "'>" + rate.map('{:.2f}'.format) + "</td></tr>")
+    head = ("<tr><th data-num='1'>ระดับความเสี่ยง</th><th>รหัส</th><th>ชื่ออุบัติการณ์</th>"
+            "<th data-num='1'>อัตราการเกิด (ครั้ง/เดือน)</th></tr>")
+    style = ("<style>body{font-family:sans-serif;font-size:14px;margin:0}"
+             "#rl-q{width:100%;padding:6px;margin-bottom:6px;box-sizing:border-box}"
+             "#rl-table{border-collapse:collapse;width:100%}"
+             "#rl-table th{position:sticky;top:0;background:#f0f2f6;cursor:pointer;text-align:left;padding:6px}"
+             "#rl-table td{padding:6px;border-bottom:1px solid #eee}</style>")
+    return (style + "<input id='rl-q' placeholder='ค้นหารหัส / ชื่ออุบัติการณ์ / ระดับ...'>"
+            "<table id='rl-table'><thead>" + head + "</thead><tbody id='rl-body'>" + "".join(rows.tolist()) +
+            "</tbody></table>" + _RISK_TABLE_JS)
+
+
+def render_risk_level_table(df: pd.DataFrame):
+    """Risk level แบบตาราง HTML เดียว (เรียง/ค้นหาได้ฝั่งเบราว์เซอร์ ไม่ต้อง rerun)"""
+    st.subheader("ตารางสรุปสีตามระดับความเสี่ยงสูงสุดของแต่ละอุบัติการณ์")
+    st.info("สีและป้ายกำกับ (I: Impact, F: Frequency) มาจากช่องที่มีความเสี่ยงสูงสุดของอุบัติการณ์ประเภทนั้นๆ "
+            "• คลิกหัวคอลัมน์เพื่อเรียง หรือพิมพ์ในช่องค้นหาเพื่อกรอง")
+
+    required = {'Impact Level', 'Frequency Level', 'รหัส', 'ชื่ออุบัติการณ์ความเสี่ยง'}
+    if not required.issubset(df.columns):
+        st.warning("ไม่พบคอลัมน์ที่จำเป็น ('Impact Level','Frequency Level','รหัส','ชื่ออุบัติการณ์ความเสี่ยง')")
+        return
+
+    summary = summarize_risk_level_table(df)
+    components.html(build_risk_level_html(summary), height=min(700, 90 + 37 * len(summary)), scrolling=True)
@@ -0,0 +1,127 @@
+# severity_tab.py
+# -*- coding: utf-8 -*-
+# ตารางไขว้ระดับความรุนแรง (A–I) นับครั้งเดียวต่อสถานะตัวกรอง แล้วให้ตาราง PSG9 / รายรหัส / รายหมวด รวมจากผลนับนั้น
+#
+#   counts[entry, sev]  entry = ชุดค่า (รหัส, ชื่ออุบัติการณ์ความเสี่ยง, หมวด, หมวดหมู่มาตรฐานสำคัญ) ที่พบจริง
+#                       sev   = A..I (0..8), 9 = ค่า Impact อื่น (เช่น 1-5 ของกลุ่ม G) ซึ่งนับเฉพาะใน 'รวม A-I' ของ PSG9
+#
+# คอลัมน์แต่ละมิติแปลงเป็นรหัสจำนวนเต็มด้วย pd.factorize แล้วนับด้วย np.bincount ครั้งเดียว (ไม่สร้างสตริง key ต่อแถว)
+# ตารางผลลัพธ์รวมจาก counts (หลักร้อยแถว) — ผลเท่ากับ pd.crosstab เดิมทุกตาราง
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from stage_profiler import profiled
+
+SEVERITY_LEVELS = list('ABCDEFGHI')
+E_UP_LEVELS = list('EFGHI')
+OTHER_COL = '_other'
+SEVERITY_DIMS = ('รหัส', 'ชื่ออุบัติการณ์ความเสี่ยง', 'หมวด', 'หมวดหมู่มาตรฐานสำคัญ')
+PSG9_PLACEHOLDERS = ["ไม่จัดอยู่ใน PSG9 Catalog", "ไม่สามารถระบุ (Merge PSG9 ล้มเหลว)",
+                     "ไม่สามารถระบุ (เช็คคอลัมน์ใน PSG9code.xlsx)",
+                     "ไม่สามารถระบุ (PSG9code.xlsx ไม่ได้โหลด/ว่างเปล่า)",
+                     "ไม่สามารถระบุ (Merge PSG9 ล้มเหลว - rename)", "ไม่สามารถระบุ (Merge PSG9 ล้มเหลว - no col)",
+                     "ไม่สามารถระบุ (PSG9code.xlsx ไม่ได้โหลด/ข้อมูลไม่ครบถ้วน)"]
+
+
+@dataclass(frozen=True)
+class SeverityTab:
+    counts: np.ndarray       # (n_entry, 10) int64: A..I + ค่าอื่น
+    entries: pd.DataFrame    # ค่าของแต่ละมิติต่อ entry (ค่าว่าง = NaN)
+
+    def rollup(self, labels, entry_mask=None) -> pd.DataFrame:
+        """รวม counts ตามป้ายของแต่ละ entry (ป้ายว่างไม่นับ) — index เรียงเหมือน crosstab, คอลัมน์ A..I + ค่าอื่น"""
+        labels = pd.Series(labels).reset_index(drop=True)
+        keep = labels.notna().to_numpy()
+        if entry_mask is not None:
+            keep &= np.asarray(entry_mask, dtype=bool)
+        codes, uniques = pd.factorize(labels[keep], sort=True)
+        out = np.zeros((len(uniques), self.counts.shape[1]), dtype=np.int64)
+        np.add.at(out, codes, self.counts[keep])
+        return pd.DataFrame(out, index=pd.Index(uniques), columns=SEVERITY_LEVELS + [OTHER_COL])
+
+
+@profiled()
+def build_severity_tab(df: pd.DataFrame, dims=SEVERITY_DIMS) -> SeverityTab:
+    """นับ (entry × ระดับความรุนแรง) ของแถวที่มีค่า Impact — มิติที่ไม่มีในข้อมูลถือเป็นค่าว่าง"""
+    impact = df['Impact'] if 'Impact' in df.columns else pd.Series(np.nan, index=df.index)
+    has_impact = impact.notna().to_numpy()
+    sev = pd.Index(SEVERITY_LEVELS).get_indexer(impact[has_impact])
+    sev = np.where(sev < 0, len(SEVERITY_LEVELS), sev)
+
+    key = np.zeros(int(has_impact.sum()), dtype=np.int64)
+    for c in dims:
+        col = df[c][has_impact] if c in df.columns else pd.Series(np.nan, index=df.index[has_impact])
+        codes, uniques = pd.factorize(col)   # ค่าว่าง -> -1
+        # factorize ซ้ำทุกมิติ ให้ key ไม่เกินจำนวนแถว (ไม่ล้น int64 แม้มีหลายมิติ)
+        key, _ = pd.factorize(key * (len(uniques) + 1) + (codes + 1))
+    entry_id = key.astype(np.int64)
+    n_entry = int(entry_id.max()) + 1 if len(entry_id) else 0
+    _, first_row = np.unique(entry_id, return_index=True)
+
+    n_col = len(SEVERITY_LEVELS) + 1
+    counts = np.bincount(entry_id * n_col + sev, minlength=n_entry * n_col).reshape(n_entry, n_col)
+    entries = pd.DataFrame({c: (df[c][has_impact].to_numpy()[first_row] if c in df.columns else np.nan) for c in dims})
+    return SeverityTab(counts=counts.astype(np.int64), entries=entries)
+
+
+def _e_up_share(summary: pd.DataFrame) -> pd.DataFrame:
+    """A..I + 'รวม E-up' + 'ร้อยละ E-up' (สัดส่วนของ E-up ทั้งตาราง)"""
+    summary = summary[SEVERITY_LEVELS].copy()
+    summary['รวม E-up'] = summary[E_UP_LEVELS].sum(axis=1)
+    total_e_up = summary['รวม E-up'].sum()
+    if total_e_up > 0:
+        summary['ร้อยละ E-up'] = (summary['รวม E-up'] / total_e_up * 100).map('{:.2f}%'.format)
+    else:
+        summary['ร้อยละ E-up'] = '0.00%'
+    summary.columns.name = 'Impact'
+    return summary
+
+
+def code_table(tab: SeverityTab) -> pd.DataFrame:
+    """ตารางสรุปตาม 'รหัส | ชื่ออุบัติการณ์' (เฉพาะแถวที่มีระดับ A-I)"""
+    if len(tab.entries) == 0:
+        return pd.DataFrame()
+    labels = tab.entries['รหัส'].astype(str) + " | " + tab.entries['ชื่ออุบัติการณ์ความเสี่ยง'].fillna('')
+    summary = _e_up_share(tab.rollup(labels))
+    summary = summary[summary.drop(columns=['ร้อยละ E-up']).sum(axis=1) > 0]
+    summary.index.name = "รหัส | ชื่ออุบัติการณ์"
+    return summary
+
+
+def category_table(tab: SeverityTab, column: str = 'หมวด', code_prefix: str = None) -> pd.DataFrame:
+    """ตารางสรุปตามหมวดหมู่ (code_prefix เช่น 'C' / 'G' = เฉพาะรหัสที่ขึ้นต้นด้วยอักษรนั้น)"""
+    mask = None
+    if code_prefix is not None:
+        mask = tab.entries['รหัส'].str.startswith(code_prefix, na=False).to_numpy()
+    rolled = tab.rollup(tab.entries[column], mask) if len(tab.entries) else pd.DataFrame()
+    if rolled.empty:
+        return pd.DataFrame()
+    summary = _e_up_share(rolled)
+    summary.index.name = "หมวดหมู่"
+    return summary
+
+
+def psg9_table(tab: SeverityTab, psg9_label_dict: dict = None) -> pd.DataFrame:
+    """ตาราง PSG9 ตามลำดับ PSG_ID: A..I, รวม E-up, รวม A-I (ทุกค่า Impact), ร้อยละ E-up ของแต่ละหมวด"""
+    if len(tab.entries) == 0:
+        return pd.DataFrame()
+    labels = tab.entries['หมวดหมู่มาตรฐานสำคัญ']
+    labels = labels.where(~labels.isin(PSG9_PLACEHOLDERS))
+    rolled = tab.rollup(labels)
+    if rolled.empty:
+        return pd.DataFrame()
+    summary = rolled[SEVERITY_LEVELS].copy()
+    summary['รวม E-up'] = summary[E_UP_LEVELS].sum(axis=1)
+    summary['รวม A-I'] = rolled.sum(axis=1)
+    summary['ร้อยละ E-up'] = (summary['รวม E-up'] / summary['รวม A-I'] * 100).fillna(0)
+    psg9_label_dict = psg9_label_dict or {}
+    psg_order = [psg9_label_dict[i] for i in sorted(psg9_label_dict.keys())]
+    summary = summary.reindex(psg_order).fillna(0)
+    for col in summary.columns:
+        if col != 'ร้อยละ E-up': summary[col] = summary[col].astype(int)
+    summary['ร้อยละ E-up'] = summary['ร้อยละ E-up'].map('{:.2f}%'.format)
+    summary.columns.name = 'Impact'
+    summary.index.name = 'หมวดหมู่มาตรฐานสำคัญ'
+    return summary
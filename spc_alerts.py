@@ -0,0 +1,135 @@
+# spc_alerts.py
+# -*- coding: utf-8 -*-
+# Statistical process control สำหรับจำนวนอุบัติการณ์รายเดือน (Poisson EWMA + Poisson CUSUM ด้านขาขึ้น)
+#
+# ทุก series (รหัส / หน่วยงาน / รหัส × หน่วยงาน) คำนวณพร้อมกันเป็น array: วนเฉพาะแกนเดือน (ไม่กี่สิบรอบ)
+# สถานะล่าสุด (SPCState) เก็บไว้ได้ เมื่อมีเดือนใหม่เรียก update_spc() ต่อจากสถานะเดิมโดยไม่คำนวณย้อนหลัง
+#
+#   baseline λ0   = (ผลรวม baseline_months เดือนแรก + 0.5) / baseline_months
+#   EWMA          z_t = λ·x_t + (1-λ)·z_{t-1},  z_0 = λ0
+#                 UCL_t = λ0 + max(L·sqrt(λ0 · λ/(2-λ) · (1-(1-λ)^(2t))), min_excess)
+#   CUSUM         λ1 = shift·λ0,  k = (λ1-λ0)/(ln λ1 - ln λ0)
+#                 S_t = max(0, S_{t-1} + x_t - k),  สัญญาณเมื่อ S_t > h·max(1, sqrt(λ0))
+#
+# ขั้นต่ำ min_excess และ max(1, ·) กันสัญญาณหลอกของ series ที่นานๆ เกิด (Poisson ค่าน้อยเป็นค่าไม่ต่อเนื่อง)
+# ค่าเริ่มต้นให้สัญญาณหลอก ≲ 15% ต่อ series ใน 24 เดือนที่ monitor (ดู benchmarks/bench_spc.py)
+from dataclasses import dataclass, replace
+
+import numpy as np
+import pandas as pd
+
+from stage_profiler import profiled
+
+
+@dataclass(frozen=True)
+class SPCParams:
+    baseline_months: int = 12
+    ewma_lambda: float = 0.3
+    ewma_L: float = 3.0
+    min_excess: float = 1.0
+    cusum_shift: float = 2.0
+    cusum_h: float = 5.0
+
+
+@dataclass(frozen=True)
+class SPCState:
+    keys: pd.Index            # ชื่อ series (ตรงกับแถวของ count matrix)
+    baseline: np.ndarray      # λ0
+    ewma: np.ndarray          # z_t ล่าสุด
+    cusum: np.ndarray         # S_t ล่าสุด
+    n_months: int             # จำนวนเดือนที่ผ่าน monitor แล้ว (t)
+    first_alert: np.ndarray   # ลำดับเดือน (0-based หลัง baseline) ที่มีสัญญาณครั้งแรก, -1 = ยังไม่มี
+    params: SPCParams
+
+
+def _cusum_k(baseline: np.ndarray, shift: float) -> np.ndarray:
+    lam1 = shift * baseline
+    return (lam1 - baseline) / (np.log(lam1) - np.log(baseline))
+
+
+def _step(state: SPCState, x: np.ndarray):
+    """หนึ่งเดือน: คืน (state ใหม่, ewma_alert, cusum_alert, ucl)"""
+    p = state.params
+    lam0 = state.baseline
+    t = state.n_months + 1
+    z = p.ewma_lambda * x + (1.0 - p.ewma_lambda) * state.ewma
+    ucl = lam0 + np.maximum(p.ewma_L * np.sqrt(lam0 * p.ewma_lambda / (2.0 - p.ewma_lambda)
+                                               * (1.0 - (1.0 - p.ewma_lambda) ** (2 * t))), p.min_excess)
+    s = np.maximum(0.0, state.cusum + x - _cusum_k(lam0, p.cusum_shift))
+    ewma_alert = z > ucl
+    cusum_alert = s > p.cusum_h * np.maximum(1.0, np.sqrt(lam0))
+    fired = (ewma_alert | cusum_alert) & (state.first_alert < 0)
+    first_alert = np.where(fired, state.n_months, state.first_alert)
+    return replace(state, ewma=z, cusum=s, n_months=t, first_alert=first_alert), ewma_alert, cusum_alert, ucl
+
+
+def init_spc(keys, baseline_counts: np.ndarray, params: SPCParams = SPCParams()) -> SPCState:
+    """สร้างสถานะจากช่วง baseline (n_series × n_baseline_month)"""
+    baseline_counts = np.asarray(baseline_counts, dtype=float)
+    n_base = max(1, baseline_counts.shape[1])
+    lam0 = (baseline_counts.sum(1) + 0.5) / n_base
+    n = len(lam0)
+    return SPCState(keys=pd.Index(keys), baseline=lam0, ewma=lam0.copy(), cusum=np.zeros(n),
+                    n_months=0, first_alert=np.full(n, -1, dtype=np.int64), params=params)
+
+
+@profiled()
+def scan_spc(keys, Y: np.ndarray, params: SPCParams = SPCParams()):
+    """
+    สแกนทั้งประวัติ: baseline = params.baseline_months เดือนแรก (อย่างน้อย 1 เดือน, ไม่เกินครึ่งหนึ่งของข้อมูล)
+    คืน (state สุดท้าย, history dict ของ array ขนาด n_series × n_monitor_month)
+    """
+    Y = np.asarray(Y, dtype=float)
+    n_base = int(min(params.baseline_months, max(1, Y.shape[1] // 2)))
+    state = init_spc(keys, Y[:, :n_base], params)
+    monitor = Y[:, n_base:]
+    hist = {k: np.zeros_like(monitor) for k in ("ewma", "ucl", "cusum")}
+    hist["ewma_alert"] = np.zeros(monitor.shape, dtype=bool)
+    hist["cusum_alert"] = np.zeros(monitor.shape, dtype=bool)
+    for j in range(monitor.shape[1]):
+        state, ea, ca, ucl = _step(state, monitor[:, j])
+        hist["ewma"][:, j], hist["ucl"][:, j], hist["cusum"][:, j] = state.ewma, ucl, state.cusum
+        hist["ewma_alert"][:, j], hist["cusum_alert"][:, j] = ea, ca
+    hist["n_baseline"] = n_base
+    return state, hist
+
+
+def update_spc(state: SPCState, new_counts: pd.Series):
+    """
+    เพิ่มหนึ่งเดือน (จำนวนต่อ series, index = keys) ต่อจากสถานะเดิม — O(n_series)
+    series ใหม่ที่ไม่เคยมีจะได้ baseline ขั้นต่ำ 0.5/baseline_months
+    คืน (state ใหม่, DataFrame สัญญาณของเดือนนี้)
+    """
+    keys = state.keys.union(new_counts.index, sort=False) if not new_counts.index.isin(state.keys).all() else state.keys
+    if len(keys) > len(state.keys):
+        n_new = len(keys) - len(state.keys)
+        lam_new = np.full(n_new, 0.5 / max(1, state.params.baseline_months))
+        state = replace(state, keys=keys, baseline=np.concatenate([state.baseline, lam_new]),
+                        ewma=np.concatenate([state.ewma, lam_new]), cusum=np.concatenate([state.cusum, np.zeros(n_new)]),
+                        first_alert=np.concatenate([state.first_alert, np.full(n_new, -1, dtype=np.int64)]))
+    x = new_counts.reindex(state.keys, fill_value=0).to_numpy(dtype=float)
+    state, ea, ca, ucl = _step(state, x)
+    return state, pd.DataFrame({"count": x, "baseline": state.baseline, "ewma": state.ewma, "ucl": ucl,
+                                "cusum": state.cusum, "ewma_alert": ea, "cusum_alert": ca}, index=state.keys)
+
+
+def alert_table(state: SPCState, hist: dict, Y: np.ndarray, month_labels=None) -> pd.DataFrame:
+    """สรุป series ที่มีสัญญาณในเดือนล่าสุด หรือเคยมีสัญญาณระหว่าง monitor"""
+    n_base = hist["n_baseline"]
+    Y = np.asarray(Y, dtype=float)
+    any_alert = hist["ewma_alert"].any(1) | hist["cusum_alert"].any(1)
+    if hist["ewma"].shape[1] == 0 or not any_alert.any():
+        return pd.DataFrame()
+    monitor_labels = list(month_labels)[n_base:] if month_labels is not None else list(range(hist["ewma"].shape[1]))
+    first = state.first_alert
+    out = pd.DataFrame({
+        "series": state.keys, "baseline_rate": state.baseline,
+        "recent_rate": Y[:, -3:].mean(1) if Y.shape[1] else np.nan,
+        "last_count": Y[:, -1] if Y.shape[1] else np.nan,
+        "ewma": state.ewma, "ewma_ucl": hist["ucl"][:, -1], "cusum": state.cusum,
+        "alert_now": hist["ewma_alert"][:, -1] | hist["cusum_alert"][:, -1],
+        "first_alert": [monitor_labels[i] if i >= 0 else None for i in first],
+        "alert_months": (hist["ewma_alert"] | hist["cusum_alert"]).sum(1),
+    })[any_alert]
+    out["rate_ratio"] = out["recent_rate"] / out["baseline_rate"]
+    return out.sort_values(["alert_now", "cusum"], ascending=False).reset_index(drop=True)
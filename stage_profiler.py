@@ -0,0 +1,197 @@
+# stage_profiler.py
+# -*- coding: utf-8 -*-
+# จับเวลาแต่ละขั้นของ pipeline / หน้าแอป: เวลา, จำนวนแถวเข้า-ออก, RSS ที่เปลี่ยนไป (ไม่ใช้ Streamlit)
+# เปิดด้วย HOIARR_PROFILE=1 (อ่านตอน import) — บันทึก JSON หนึ่งบรรทัดต่อรอบลง HOIARR_PROFILE_LOG
+#
+#   @profiled("massage_schema")              # แถวเข้า = DataFrame ตัวแรกในอาร์กิวเมนต์, แถวออก = ผลลัพธ์
+#   def massage_schema(df, ...): ...
+#
+#   with stage("load: upload", df):           # บล็อกโค้ด
+#   lap = laps("massage", df); ...; lap("dates", df)   # โค้ดเรียงต่อกัน: แต่ละ lap = เวลาตั้งแต่ lap ก่อนหน้า
+#
+#   begin_run("หน้า ...") ... end_run()       # ครอบหนึ่งรอบ (rerun) — คืนรายการ stage ของรอบนั้น
+#
+# ปิดอยู่ (ค่าตั้งต้น): profiled() คืนฟังก์ชันเดิมไม่ห่อ, stage()/laps() คืนตัวว่างที่ใช้ร่วมกัน -> แทบไม่มีต้นทุน
+# stage ที่ทำงานนอกรอบ (thread อื่นที่ไม่ได้เรียก begin_run) ไม่ถูกบันทึก
+import functools
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+ENABLED = os.environ.get("HOIARR_PROFILE", "").strip().lower() not in ("", "0", "false", "no")
+LOG_PATH = os.environ.get("HOIARR_PROFILE_LOG", "stage_profile.jsonl")  # ค่าว่าง = ไม่เขียน log
+
+_current_run = ContextVar("hoiarr_profile_run", default=None)
+_log_lock = threading.Lock()
+try:
+    _PAGE_BYTES = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_BYTES = 4096
+
+
+def rss_mb() -> float | None:
+    """RSS ปัจจุบันของ process (MB) จาก /proc/self/statm — None บนระบบที่ไม่มี /proc"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_BYTES / 2**20
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _rows(obj) -> int | None:
+    shape = getattr(obj, "shape", None)  # DataFrame / Series / ndarray
+    return int(shape[0]) if shape else None
+
+
+class _Run:
+    def __init__(self, label: str):
+        self.label = label
+        self.records = []
+        self.depth = 0
+        self.t0 = time.perf_counter()
+        self.rss0 = rss_mb()
+
+
+def _record(name, depth, seconds, rows_in, rows_out, m0, m1) -> dict:
+    return {"stage": name, "depth": depth, "seconds": round(seconds, 6), "rows_in": rows_in, "rows_out": rows_out,
+            "mem_delta_mb": round(m1 - m0, 2) if m1 is not None and m0 is not None else None}
+
+
+class Stage:
+    """หนึ่งขั้นที่จับเวลา — ใช้เป็น context manager หรือ start()/stop() เมื่อครอบด้วย with ไม่สะดวก"""
+    __slots__ = ("name", "rows_in", "rows_out", "_run", "_t0", "_m0", "_depth", "_slot")
+
+    def __init__(self, name: str, data=None):
+        self.name = name
+        self.rows_in = _rows(data)
+        self.rows_out = None
+        self._run = None
+
+    def start(self):
+        self._run = _current_run.get()
+        if self._run is not None:
+            self._depth = self._run.depth
+            self._run.depth += 1
+            self._slot = len(self._run.records)  # จองตำแหน่งตามลำดับที่เริ่ม (ขั้นแม่อยู่ก่อนขั้นย่อย)
+            self._run.records.append(None)
+            self._m0 = rss_mb()
+            self._t0 = time.perf_counter()
+        return self
+
+    def stop(self, result=None):
+        run = self._run
+        if run is None:
+            return
+        seconds = time.perf_counter() - self._t0
+        run.depth = self._depth
+        if result is not None:
+            self.rows_out = _rows(result)
+        run.records[self._slot] = _record(self.name, self._depth, seconds, self.rows_in, self.rows_out,
+                                          self._m0, rss_mb())
+        self._run = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+class _NullStage:
+    rows_in = rows_out = None
+
+    def start(self): return self
+    def stop(self, result=None): pass
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def _null_lap(name, data=None):
+    pass
+
+
+def stage(name: str, data=None):
+    """context ของหนึ่งขั้น (data = DataFrame ขาเข้า; ตั้ง .rows_out เองได้)"""
+    return Stage(name, data) if ENABLED else _NULL_STAGE
+
+
+def start_stage(name: str, data=None):
+    """เริ่ม stage ที่ต้องปิดเองด้วย .stop(result) (เช่น ช่วงโค้ดระดับโมดูลที่ยาวเกินจะครอบด้วย with)"""
+    return Stage(name, data).start() if ENABLED else _NULL_STAGE
+
+
+def laps(prefix: str, data=None):
+    """
+    จับเวลาโค้ดที่เรียงต่อกันโดยไม่ต้องย่อหน้าใหม่: lap(name, data) บันทึกช่วงตั้งแต่ lap ก่อนหน้า (หรือตอนเรียก laps)
+    เป็น stage '<prefix>.<name>' แถวเข้า = data ของ lap ก่อนหน้า แถวออก = data ของ lap นี้
+    """
+    if not ENABLED:
+        return _null_lap
+    last = {"t": time.perf_counter(), "m": rss_mb(), "rows": _rows(data)}
+
+    def lap(name: str, data=None):
+        now, m1, rows = time.perf_counter(), rss_mb(), _rows(data)
+        run = _current_run.get()
+        if run is not None:
+            run.records.append(_record(f"{prefix}.{name}", run.depth, now - last["t"], last["rows"], rows, last["m"], m1))
+        last.update(t=now, m=m1, rows=rows)
+    return lap
+
+
+def profiled(name: str = None):
+    """decorator: บันทึกการเรียกฟังก์ชันเป็น stage (ปิดอยู่ = คืนฟังก์ชันเดิม)"""
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            data = next((a for a in args if _rows(a) is not None), None)
+            s = Stage(label, data).start()
+            result = None
+            try:
+                result = fn(*args, **kwargs)
+                return result
+            finally:
+                s.stop(result)
+        return wrapper
+    return decorate
+
+
+def begin_run(label: str):
+    """เริ่มรอบใหม่ใน thread นี้ (รอบเดิมที่ไม่ได้ end_run เช่น ถูก st.stop ถูกทิ้ง)"""
+    if ENABLED:
+        _current_run.set(_Run(label))
+
+
+def end_run(log_path: str = None, **extra) -> dict | None:
+    """
+    ปิดรอบ: คืน {label, seconds, rss_mb, mem_delta_mb, ..., stages: [stage ตามลำดับที่เริ่ม]}
+    และเขียนเป็น JSON หนึ่งบรรทัดลง log (extra = ฟิลด์เพิ่ม เช่น session) — None ถ้าไม่ได้เปิด/ไม่มีรอบ
+    """
+    run = _current_run.get()
+    if run is None:
+        return None
+    _current_run.set(None)
+    records = [r for r in run.records if r is not None]  # stage ที่ยังไม่ปิด (เช่น ถูก st.stop) ไม่นับ
+    rss = rss_mb()
+    entry = {"ts": time.strftime("%Y-%m-%dT%H:%M:%S"), "label": run.label,
+             "seconds": round(time.perf_counter() - run.t0, 6),
+             "rss_mb": round(rss, 1) if rss is not None else None,
+             "mem_delta_mb": round(rss - run.rss0, 2) if rss is not None and run.rss0 is not None else None,
+             **extra, "stages": records}
+    path = LOG_PATH if log_path is None else log_path
+    if path:
+        try:
+            with _log_lock, open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except OSError:
+            pass  # เขียน log ไม่ได้ไม่ทำให้แอปล้ม
+    return entry